@@ -1,16 +1,16 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import json
 import logging
 import os
 import re
-import base64
-import json
+import secrets
 from typing import Any
 from datetime import datetime
 
 from aiogram import Bot, F, Router
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -18,54 +18,35 @@ from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     Message,
 )
 from dotenv import load_dotenv
 import gspread
-from google.oauth2.service_account import Credentials
+
+import sheets
+import user_directory
+from throttle import BLOCKED, OK, Throttle, fan_out, get_throttle
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-_registering: set[int] = set()
-_register_lock = asyncio.Lock()
 router = Router()
 
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive",
-]
-
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
 USERS_SHEET = "user"
 
 HEADERS = ["T/r", "Telegram ID", "Username", "Ism", "Familiya", "Telefon raqami", "Qo'shilgan sana", "Holati"]
 
-_gc: gspread.Client | None = None
-
 
 def get_sheets_client() -> gspread.Client:
-    global _gc
-    if _gc is None:
-        b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
-        if not b64:
-            raise RuntimeError("GOOGLE_CREDENTIALS_B64 topilmadi")
-        creds_dict = json.loads(base64.b64decode(b64).decode("utf-8"))
-        creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-        _gc = gspread.authorize(creds)
-    return _gc
+    return sheets.client()
 
 
 def get_users_sheet() -> gspread.Worksheet:
-    gc = get_sheets_client()
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(USERS_SHEET)
-    if not ws.row_values(1):
-        ws.append_row(HEADERS)
-    return ws
+    return sheets.worksheet(USERS_SHEET, headers=HEADERS)
 
 
 # ===================== USER OPERATSIYALARI =====================
@@ -107,90 +88,76 @@ def _cleanup_sheet_sync() -> None:
             empty_rows,
             value_input_option="RAW"
         )
+    # Qatorlar joyi o'zgardi — indeks eskirdi
+    sheets.invalidate_rows(USERS_SHEET)
 
 
 def _find_user_row_sync(user_id: int) -> int | None:
-    ws = get_users_sheet()
-    telegram_ids = ws.col_values(2)
-    for i, val in enumerate(telegram_ids, start=1):
-        if str(val).strip() == str(user_id):
-            return i
-    return None
+    return sheets.find_row(USERS_SHEET, user_id)
 
 
 def _user_has_phone_sync(user_id: int) -> bool:
-    ws = get_users_sheet()
-    telegram_ids = ws.col_values(2)
-    for i, val in enumerate(telegram_ids, start=1):
-        if str(val).strip() == str(user_id):
-            phone = ws.cell(i, 6).value
-            return bool(phone and str(phone).strip())
-    return False
-
-
-def _save_user_sync(
-    user_id: int,
-    first_name: str = "",
-    last_name: str = "",
-    username: str = "",
-    phone: str = "",
-) -> None:
-    ws = get_users_sheet()
-    sana = datetime.now().strftime("%Y-%m-%d %H:%M")
-    uname = f"@{username}" if username else ""
+    row = _find_user_row_sync(user_id)
+    if row is None:
+        return False
+    phone = get_users_sheet().cell(row, 6).value
+    return bool(phone and str(phone).strip())
 
-    row_idx = _find_user_row_sync(user_id)
 
-    if row_idx is not None:
-        # Mavjud foydalanuvchi — username/ism/familiya yangilaymiz
-        updates = [
-            (row_idx, 3, uname),
-            (row_idx, 4, first_name),
-            (row_idx, 5, last_name),
-        ]
-        if phone:
-            updates.append((row_idx, 6, phone))
-        for r, c, v in updates:
-            ws.update_cell(r, c, v)
-        # Holati "Bloklagan" bo'lsa "Faol" ga qaytaramiz
-        current_holat = ws.cell(row_idx, 8).value or ""
-        if phone and current_holat.strip() == "Bloklagan":
-            ws.update_cell(row_idx, 8, "Faol")
-    else:
-        _cleanup_sheet_sync()
-        all_vals = ws.get_all_values()
-        valid_count = sum(
-            1 for r in all_vals[1:]
-            if len(r) > 1 and str(r[1]).strip()
-        )
-        tr = valid_count + 1
-        new_row = [
-            str(tr),
-            str(user_id),
-            uname,
-            first_name or "",
-            last_name or "",
-            phone or "",
-            sana,
-            "Faol",
-        ]
-        ws.append_row(new_row, value_input_option="RAW")
+def _save_users_batch_sync(batch: dict[int, tuple[str, str, str, str]]) -> dict[int, tuple[str, str, str]]:
+    """
+    Navbatdagi foydalanuvchilarni bitta o'qish + bitta yozish bilan saqlaydi.
+    batch: {user_id: (username, ism, familiya, telefon)}
+    Mavjudlari faqat o'zgargan bo'lsa yangilanadi, yangilari bitta
+    append_rows bilan qo'shiladi (to'liq tozalashsiz).
+    Qaytaradi: {user_id: (username, ism, familiya)} — varaqdagi holat.
+    """
+    ws    = get_users_sheet()
+    known: dict[int, tuple[str, str, str]] = {}
+
+    rows     = {uid: _find_user_row_sync(uid) for uid in batch}
+    existing = [uid for uid, r in rows.items() if r is not None]
+    new      = [uid for uid, r in rows.items() if r is None]
+
+    if existing:
+        current = ws.batch_get([f"C{rows[uid]}:H{rows[uid]}" for uid in existing])
+        updates = []
+        for uid, vr in zip(existing, current):
+            r    = rows[uid]
+            cur  = (list(vr[0]) if vr else []) + [""] * 6
+            uname, first, last, phone = batch[uid]
+            if (cur[0], cur[1], cur[2]) != (uname, first, last):
+                updates.append({"range": f"C{r}:E{r}", "values": [[uname, first, last]]})
+            if phone and cur[3] != phone:
+                updates.append({"range": f"F{r}", "values": [[phone]]})
+            # Holati "Bloklagan" bo'lsa "Faol" ga qaytaramiz
+            if phone and cur[5].strip() == "Bloklagan":
+                updates.append({"range": f"H{r}", "values": [["Faol"]]})
+            known[uid] = (uname, first, last)
+        if updates:
+            ws.batch_update(updates, value_input_option="RAW")
+
+    if new:
+        sana   = datetime.now().strftime("%Y-%m-%d %H:%M")
+        tr     = len(sheets.row_index(USERS_SHEET)) + 1
+        values = []
+        for i, uid in enumerate(new):
+            uname, first, last, phone = batch[uid]
+            values.append([str(tr + i), str(uid), uname, first, last, phone, sana, "Faol"])
+            known[uid] = (uname, first, last)
+        resp = ws.append_rows(values, value_input_option="RAW")
+        sheets.remember_appends(USERS_SHEET, new, resp)
+
+    return known
 
 
 def _update_user_status_sync(user_id: int, status: str) -> None:
     """user varaqida foydalanuvchi Holati ustunini yangilaydi"""
-    ws = get_users_sheet()
-    telegram_ids = ws.col_values(2)
-    for i, val in enumerate(telegram_ids, start=1):
-        if str(val).strip() == str(user_id):
-            ws.update_cell(i, 8, status)
-            return
+    sheets.write_column(USERS_SHEET, 8, {user_id: status})
 
 
 def _cleanup_any_sheet(sheet_name: str) -> None:
-    gc = get_sheets_client()
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(sheet_name)
+    ws = sheets.worksheet(sheet_name)
 
     all_rows = ws.get_all_values()
     if len(all_rows) <= 1:
@@ -229,76 +196,128 @@ def _cleanup_any_sheet(sheet_name: str) -> None:
             [[""] * 8] * (total - count - 1),
             value_input_option="RAW"
         )
+    sheets.invalidate_rows(sheet_name)
 
 
 async def cleanup_sheet() -> None:
-    loop = asyncio.get_event_loop()
     try:
-        await loop.run_in_executor(None, _cleanup_sheet_sync)
+        await sheets.run(_cleanup_sheet_sync)
     except Exception as e:
         logger.error(f"user varag'ini tozalashda xato: {e}")
 
     try:
-        await loop.run_in_executor(None, _cleanup_any_sheet, "sub_adminlar")
+        await sheets.run(_cleanup_any_sheet, "sub_adminlar")
     except Exception as e:
         import traceback
         logger.error(f"Sub-adminlar varag'ini tozalashda xato: {e}")
         logger.error(traceback.format_exc())
         try:
-            def _list_sheets():
-                gc = get_sheets_client()
-                sh = gc.open_by_key(SPREADSHEET_ID)
-                return [ws.title for ws in sh.worksheets()]
-            sheets = await loop.run_in_executor(None, _list_sheets)
-            logger.error(f"Mavjud varaqlar: {sheets}")
+            titles = await sheets.run(sheets.worksheet_titles)
+            logger.error(f"Mavjud varaqlar: {titles}")
         except Exception as e2:
             logger.error(f"Varaqlarni olishda ham xato: {e2}")
 
 
-async def save_user(
+# ===================== RO'YXATGA OLISH NAVBATI =====================
+# Har bir private update da foydalanuvchi navbatga qo'yiladi. Navbat
+# bir xil foydalanuvchining takroriy ko'rinishlarini birlashtiradi va
+# REGISTER_FLUSH_DELAY soniyada bir marta Sheets ga yoziladi.
+# Ism/username o'zgarmagan bo'lsa umuman yozilmaydi.
+
+REGISTER_FLUSH_DELAY = float(os.getenv("REGISTER_FLUSH_DELAY", "5"))
+
+_reg_queue:  dict[int, tuple[str, str, str, str]] = {}   # {uid: (username, ism, familiya, telefon)}
+_reg_known:  dict[int, tuple[str, str, str]]      = {}   # {uid: varaqdagi (username, ism, familiya)}
+_reg_lock    = asyncio.Lock()
+_reg_task:   asyncio.Task | None = None
+
+
+def enqueue_user(
     user_id: int,
     full_name: str = "",
     username: str = "",
     phone: str = "",
 ) -> bool:
     """
-    Foydalanuvchini Sheets ga saqlaydi.
-    Muvaffaqiyatli bo'lsa True, xato bo'lsa False qaytaradi.
+    Foydalanuvchini yozish navbatiga qo'yadi.
+    O'zgarish bo'lmasa False qaytaradi (navbatga qo'yilmaydi).
     """
-    async with _register_lock:
-        if user_id in _registering:
-            return True   # Parallel yozilmoqda — xato emas
-        _registering.add(user_id)
+    global _reg_task
+    parts      = (full_name or "").split(" ", 1)
+    first_name = parts[0] if parts else ""
+    last_name  = parts[1] if len(parts) > 1 else ""
+    uname      = f"@{username}" if username else ""
+    rec        = (uname, first_name, last_name)
+
+    if not phone and _reg_known.get(user_id) == rec:
+        return False
+    queued = _reg_queue.get(user_id)
+    if queued and not phone:
+        phone = queued[3]
+    _reg_queue[user_id] = (*rec, phone)
+
+    if _reg_task is None:
+        _reg_task = asyncio.ensure_future(_flush_later())
+    return True
+
+
+async def _flush_later() -> None:
+    global _reg_task
     try:
-        parts      = (full_name or "").split(" ", 1)
-        first_name = parts[0] if parts else ""
-        last_name  = parts[1] if len(parts) > 1 else ""
+        while _reg_queue:
+            await asyncio.sleep(REGISTER_FLUSH_DELAY)
+            await flush_registrations()
+    finally:
+        _reg_task = None
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None, _save_user_sync, user_id, first_name, last_name, username, phone
-        )
+
+async def flush_registrations() -> bool:
+    """Navbatni Sheets ga yozadi. Xato bo'lsa yozuvlar navbatga qaytadi."""
+    async with _reg_lock:
+        batch = dict(_reg_queue)
+        _reg_queue.clear()
+        if not batch:
+            return True
+        try:
+            known = await sheets.run(_save_users_batch_sync, batch)
+        except Exception as e:
+            logger.error(f"Foydalanuvchilarni saqlashda xato ({len(batch)} ta): {e}")
+            sheets.invalidate_rows(USERS_SHEET)
+            for uid, rec in batch.items():
+                _reg_queue.setdefault(uid, rec)
+            return False
+        _reg_known.update(known)
+        for uid, (uname, first, last) in known.items():
+            # Kontakt ulashgan foydalanuvchi find_phone da darhol topilsin
+            user_directory.note_user(uid, uname, first, last, phone=batch[uid][3])
         return True
-    except Exception as e:
-        logger.error(f"Foydalanuvchi saqlashda xato (id={user_id}): {e}")
-        return False
-    finally:
-        async with _register_lock:
-            _registering.discard(user_id)
+
+
+async def save_user(
+    user_id: int,
+    full_name: str = "",
+    username: str = "",
+    phone: str = "",
+) -> bool:
+    """
+    Foydalanuvchini darhol Sheets ga saqlaydi (navbatdagilar bilan birga).
+    Muvaffaqiyatli bo'lsa True, xato bo'lsa False qaytaradi.
+    """
+    if not enqueue_user(user_id, full_name, username, phone):
+        return True
+    return await flush_registrations()
 
 
 async def user_has_phone(user_id: int) -> bool:
     try:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _user_has_phone_sync, user_id)
+        return await sheets.run(_user_has_phone_sync, user_id)
     except Exception:
         return False
 
 
 async def get_all_users() -> list[int]:
     try:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _get_all_users_sync)
+        return await sheets.run(_get_all_users_sync)
     except Exception as e:
         logger.error(f"Foydalanuvchilarni olishda xato: {e}")
         return []
@@ -429,6 +448,10 @@ async def collect_content(message: Message, state: FSMContext):
         await message.answer("⚠️ Bu turdagi kontent qo'llab-quvvatlanmaydi.")
         return
 
+    # Manba xabar — yuborishda copy_messages bilan nusxalanadi
+    item["src_chat"] = message.chat.id
+    item["src_id"]   = message.message_id
+
     items.append(item)
     await state.update_data(items=items)
 
@@ -458,7 +481,7 @@ async def preview_broadcast(call: CallbackQuery, state: FSMContext, bot: Bot):
 
     await call.answer()
     await call.message.edit_text("👁 <b>Ko'rib chiqish (faqat sizga):</b>", parse_mode="HTML")
-    await _send_items(bot, call.from_user.id, items, is_preview=True)
+    await _send_plan(bot, call.from_user.id, compile_plan(items), is_preview=True)
 
     count = await get_user_count()
     await call.message.answer(
@@ -478,19 +501,10 @@ async def add_more(call: CallbackQuery):
 def _batch_update_statuses_sync(changes: dict[int, str]) -> None:
     """
     changes = {user_id: "Faol" | "Bloklagan"}
-    Barcha o'zgarishlarni bir tekshirishda yozadi.
+    Faqat o'zgarganlarni bir nechta batch_update bilan yozadi.
     """
-    if not changes:
-        return
-    ws = get_users_sheet()
-    telegram_ids = ws.col_values(2)
-    for i, val in enumerate(telegram_ids, start=1):
-        try:
-            uid = int(str(val).strip())
-        except (ValueError, TypeError):
-            continue
-        if uid in changes:
-            ws.update_cell(i, 8, changes[uid])
+    written = sheets.write_column(USERS_SHEET, 8, changes)
+    logger.info(f"[BC] Holati yangilandi: {written} / {len(changes)}")
 
 
 @router.callback_query(BroadcastFSM.confirming, F.data == "bc_send")
@@ -507,52 +521,304 @@ async def send_broadcast(call: CallbackQuery, state: FSMContext, bot: Bot):
     await call.answer()
     status_msg = await call.message.edit_text(f"⏳ Yuborilmoqda... 0 / {len(users)}")
 
-    success = 0
-    failed = 0
-    # Status o'zgarishlari: {user_id: "Faol" | "Bloklagan"}
-    status_changes: dict[int, str] = {}
+    job = {
+        "id":         secrets.token_hex(6),
+        "items":      items,
+        "users":      users,
+        "plan":       compile_plan(items),
+        "chat_id":    status_msg.chat.id,
+        "message_id": status_msg.message_id,
+        "created":    datetime.now().strftime("%Y-%m-%d %H:%M"),
+    }
+    await _save_job(job)
+    _start_job(bot, job)
+
+
+# ===================== BROADCAST JOBLARI =====================
+# Har bir ommaviy yuborish Redis da job sifatida saqlanadi:
+#   JOBS_KEY           — {job_id: job JSON (kontent, qabul qiluvchilar, status xabari)}
+#   DONE_KEY.{job_id}  — {user_id: natija} — kimga yuborilgani
+# Natijalar xotirada yig'ilib, CHECKPOINT_EVERY soniyada bir marta
+# bitta HSET bilan yoziladi. Jarayon qayta ishga tushsa yoki lock boshqa
+# instancega o'tsa, resume_jobs() tugallanmagan joblarni DONE_KEY dagi
+# foydalanuvchilarni o'tkazib yuborib davom ettiradi.
+#
+# Ikki marta yubormaslik uchun: yuborishdan OLDIN qabul qiluvchilar
+# CLAIM_CHUNK talik bo'laklarda SENDING deb belgilanadi (bitta Lua skript,
+# HSETNX). Faqat haqiqatan egallanganlarga yuboriladi — lock almashinuvida
+# ikki instance bir vaqtda ishlasa ham bitta qabul qiluvchi ikki marta
+# olinmaydi. Jarayon qulasa, SENDING dagilar qayta yuborilmaydi — "holati noma'lum"
+# hisoblanadi. To'xtatishda (stop_jobs) boshlangan yuborishlar tugatiladi,
+# belgilanib, lekin boshlanmaganlarning belgisi olib tashlanadi.
+
+JOBS_KEY         = "fortuna:broadcast:jobs"
+DONE_KEY         = "fortuna:broadcast:done"
+JOB_TTL          = 7 * 24 * 60 * 60   # soniya
+CHECKPOINT_EVERY = 1.0                # soniya
+CLAIM_CHUNK      = int(os.getenv("BROADCAST_CLAIM_CHUNK", "25"))
+STOP_GRACE       = 10.0               # soniya — to'xtatishda kutish
+SENDING          = "sending"
+
+# KEYS: [DONE_KEY.{job_id}]; ARGV: [SENDING, TTL, uid1, uid2, ...]
+# Hali yozuvi yo'q uid larni egallaydi va ularni qaytaradi.
+_CLAIM_LUA = """
+local got = {}
+for i = 3, #ARGV do
+  if redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[1]) == 1 then got[#got + 1] = ARGV[i] end
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+return got
+"""
+
+_redis = None   # upstash_redis.asyncio.Redis | None
+_running_jobs: dict[str, asyncio.Task] = {}
+_stopping = asyncio.Event()
+
+
+def _done_key(job_id: str) -> str:
+    return f"{DONE_KEY}:{job_id}"
+
+
+async def _save_job(job: dict) -> None:
+    if _redis is None:
+        return
+    try:
+        await _redis.hset(JOBS_KEY, values={job["id"]: json.dumps(job, ensure_ascii=False, separators=(",", ":"))})
+        await _redis.expire(JOBS_KEY, JOB_TTL)
+    except Exception as e:
+        logger.error(f"[BC] Jobni saqlashda xato ({job['id']}): {e}")
+
+
+async def _load_outcomes(job_id: str) -> dict[int, str]:
+    if _redis is None:
+        return {}
+    try:
+        raw = await _redis.hgetall(_done_key(job_id)) or {}
+    except Exception as e:
+        logger.error(f"[BC] Checkpointlarni o'qishda xato ({job_id}): {e}")
+        return {}
+    return {int(k): v for k, v in raw.items()}
 
-    for i, user_id in enumerate(users, 1):
+
+async def _checkpoint(job_id: str, pending: dict[int, str]) -> None:
+    """Yig'ilgan natijalarni bitta HSET bilan yozadi."""
+    if _redis is None or not pending:
+        return
+    batch = {str(uid): outcome for uid, outcome in pending.items()}
+    pending.clear()
+    try:
+        await _redis.hset(_done_key(job_id), values=batch)
+        await _redis.expire(_done_key(job_id), JOB_TTL)
+    except Exception as e:
+        logger.error(f"[BC] Checkpoint yozishda xato ({job_id}): {e}")
+        for uid, outcome in batch.items():
+            pending.setdefault(int(uid), outcome)
+
+
+async def _mark_sending(job_id: str, uids: list[int]) -> set[int]:
+    """
+    Qabul qiluvchilarni SENDING deb belgilaydi (faqat yozuvi yo'qlarini).
+    Haqiqatan egallanganlarni qaytaradi. Xato yuqoriga uzatiladi.
+    """
+    if _redis is None or not uids:
+        return set(uids)
+    got = await _redis.eval(
+        _CLAIM_LUA, keys=[_done_key(job_id)],
+        args=[SENDING, str(JOB_TTL), *[str(uid) for uid in uids]],
+    )
+    return {int(uid) for uid in got or []}
+
+
+async def _unmark_sending(job_id: str, uids: list[int]) -> None:
+    """Belgilangan, lekin yuborish boshlanmagan qabul qiluvchilarni qaytaradi."""
+    if _redis is None or not uids:
+        return
+    try:
+        await _redis.hdel(_done_key(job_id), *[str(uid) for uid in uids])
+    except Exception as e:
+        logger.error(f"[BC] SENDING belgisini olib tashlashda xato ({job_id}): {e}")
+
+
+async def _finish_job(job_id: str) -> None:
+    if _redis is None:
+        return
+    with contextlib.suppress(Exception):
+        await _redis.hdel(JOBS_KEY, job_id)
+    with contextlib.suppress(Exception):
+        await _redis.delete(_done_key(job_id))
+
+
+def _start_job(bot: Bot, job: dict) -> None:
+    if job["id"] in _running_jobs:
+        return
+    task = asyncio.ensure_future(_run_job(bot, job))
+    _running_jobs[job["id"]] = task
+    task.add_done_callback(lambda _t: _running_jobs.pop(job["id"], None))
+
+
+async def _run_job(bot: Bot, job: dict) -> None:
+    job_id   = job["id"]
+    plan     = job.get("plan") or compile_plan(job["items"])
+    users    = job["users"]
+    outcomes = await _load_outcomes(job_id)
+    pending: dict[int, str] = {}
+    remaining = [uid for uid in users if uid not in outcomes]
+    throttle  = get_throttle()
+
+    status_chat, status_id = job["chat_id"], job["message_id"]
+
+    async def edit_status(text: str) -> None:
+        with contextlib.suppress(Exception):
+            await bot.edit_message_text(text, chat_id=status_chat, message_id=status_id, parse_mode="HTML")
+
+    if outcomes:
+        unknown = sum(1 for o in outcomes.values() if o == SENDING)
+        logger.info(
+            f"[BC] Job {job_id} davom ettirilmoqda: {len(outcomes)}/{len(users)} yuborilgan"
+            + (f", {unknown} ta holati noma'lum (qayta yuborilmaydi)" if unknown else "")
+        )
+        await edit_status(f"♻️ Davom ettirilmoqda... {len(outcomes)} / {len(users)}")
+
+    # Bo'lak bo'yicha SENDING belgisi: bo'lakning birinchi qabul qiluvchisini
+    # olgan worker butun bo'lakni bitta skript bilan belgilaydi
+    position = {uid: i for i, uid in enumerate(remaining)}
+    claims:  dict[int, asyncio.Task] = {}
+    started: set[int] = set()
+    foreign: set[int] = set()   # boshqa instance allaqachon egallagan
+
+    async def claim(user_id: int) -> bool:
+        k    = position[user_id] // CLAIM_CHUNK
+        task = claims.get(k)
+        if task is None:
+            chunk = remaining[k * CLAIM_CHUNK:(k + 1) * CLAIM_CHUNK]
+            task  = claims[k] = asyncio.ensure_future(_mark_sending(job_id, chunk))
         try:
-            await _send_items(bot, user_id, items)
-            success += 1
-            status_changes[user_id] = "Faol"
-        except TelegramForbiddenError:
-            failed += 1
-            status_changes[user_id] = "Bloklagan"
-        except TelegramBadRequest:
-            failed += 1
+            return user_id in await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.warning(f"Yuborishda xato ({user_id}): {e}")
-            failed += 1
+            # Keyingi worker qayta urinadi; bu qabul qiluvchi yuborilmaydi (ERROR)
+            if claims.get(k) is task:
+                del claims[k]
+            logger.error(f"[BC] SENDING belgisini yozib bo'lmadi ({job_id}): {e}")
+            raise
+
+    async def send_one(user_id: int) -> None:
+        if not await claim(user_id):
+            foreign.add(user_id)
+            return
+        started.add(user_id)
+        await _send_plan(bot, user_id, plan, throttle=throttle)
 
-        if i % 50 == 0:
-            try:
-                await status_msg.edit_text(f"⏳ Yuborilmoqda... {i} / {len(users)}")
-            except Exception:
-                pass
+    def on_result(user_id: int, outcome: str) -> None:
+        if user_id in foreign:
+            # Natijasi boshqa instance da — Redis dagi yozuvga tegmaymiz
+            outcomes[user_id] = SENDING
+            return
+        outcomes[user_id] = outcome
+        pending[user_id]  = outcome
+
+    async def on_progress(done: int, total: int, stats: dict[str, int]) -> None:
+        await edit_status(f"⏳ Yuborilmoqda... {len(outcomes)} / {len(users)}")
 
-        await asyncio.sleep(0.05)
+    async def checkpointer() -> None:
+        while True:
+            await asyncio.sleep(CHECKPOINT_EVERY)
+            await _checkpoint(job_id, pending)
 
-    # Barcha o'zgarishlarni bir marta yozamiz
+    cp_task = asyncio.ensure_future(checkpointer())
+    try:
+        await fan_out(
+            remaining,
+            send_one,
+            on_result=on_result,
+            on_progress=on_progress,
+            stop=_stopping,
+        )
+    finally:
+        cp_task.cancel()
+        # To'xtatilgan bo'lsa ham yuborilganlarni yozib qo'yamiz
+        await _checkpoint(job_id, pending)
+        # Belgilangan, lekin boshlanmaganlar — resume da yuborilishi kerak
+        # (faqat shu instance egallaganlari)
+        claimed = [
+            uid for t in claims.values()
+            if t.done() and not t.cancelled() and t.exception() is None
+            for uid in t.result()
+        ]
+        await _unmark_sending(job_id, [uid for uid in claimed if uid not in started])
+
+    if _stopping.is_set():
+        logger.info(f"[BC] Job {job_id} to'xtatildi: {len(outcomes)}/{len(users)} — Redis da qoldi")
+        return
+
+    # Status o'zgarishlari: {user_id: "Faol" | "Bloklagan"} — barchasi bir marta
+    status_changes = {
+        uid: ("Faol" if outcome == OK else "Bloklagan")
+        for uid, outcome in outcomes.items() if outcome in (OK, BLOCKED)
+    }
     if status_changes:
         try:
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                None, _batch_update_statuses_sync, status_changes
-            )
+            await sheets.run(_batch_update_statuses_sync, status_changes)
         except Exception as e:
             logger.error(f"Batch status yangilashda xato: {e}")
 
-    await status_msg.edit_text(
+    await _finish_job(job_id)
+
+    success = sum(1 for o in outcomes.values() if o == OK)
+    unknown = sum(1 for o in outcomes.values() if o == SENDING)
+    failed  = len(users) - success - unknown
+    await edit_status(
         f"✅ <b>Yuborildi!</b>\n\n"
         f"👥 Jami: {len(users)}\n"
         f"✅ Muvaffaqiyatli: {success}\n"
-        f"❌ Bloklagan / o'chirgan: {failed}",
-        parse_mode="HTML",
+        f"❌ Bloklagan / o'chirgan: {failed}"
+        + (f"\n❔ Holati noma'lum (uzilish paytida): {unknown}" if unknown else "")
     )
 
 
+async def init_jobs(redis) -> None:
+    """Redis clientini o'rnatadi (main dan, lock olingandan keyin)."""
+    global _redis
+    _redis = redis
+
+
+async def resume_jobs(bot: Bot) -> None:
+    """Oldingi instance tugatmagan broadcast joblarini davom ettiradi."""
+    if _redis is None:
+        return
+    try:
+        raw = await _redis.hgetall(JOBS_KEY) or {}
+    except Exception as e:
+        logger.error(f"[BC] Joblarni o'qishda xato: {e}")
+        return
+    for job_id, payload in raw.items():
+        try:
+            job = json.loads(payload)
+        except (TypeError, ValueError):
+            logger.warning(f"[BC] Buzilgan job o'chirildi: {job_id}")
+            await _finish_job(job_id)
+            continue
+        _start_job(bot, job)
+    if raw:
+        logger.info(f"[BC] {len(raw)} ta tugallanmagan broadcast davom ettirilmoqda")
+
+
+async def stop_jobs() -> None:
+    """
+    Ishlayotgan joblarni to'xtatadi: yangi yuborish boshlanmaydi, boshlanganlari
+    STOP_GRACE soniya ichida tugatiladi, checkpoint yoziladi, job Redis da qoladi.
+    """
+    _stopping.set()
+    tasks = list(_running_jobs.values())
+    if not tasks:
+        return
+    _, late = await asyncio.wait(tasks, timeout=STOP_GRACE)
+    for t in late:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 @router.callback_query(F.data == "bc_cancel")
 async def cancel_broadcast(call: CallbackQuery, state: FSMContext):
     await state.clear()
@@ -562,29 +828,99 @@ async def cancel_broadcast(call: CallbackQuery, state: FSMContext):
 
 # ===================== YUBORISH FUNKSIYASI =====================
 
-async def _send_items(
-    bot: Bot, user_id: int, items: list[dict], is_preview: bool = False
+# Yig'ilgan kontent bir marta "reja" ga aylantiriladi va barcha
+# qabul qiluvchilar uchun qayta ishlatiladi:
+#   copy   — ketma-ket matn/lokatsiya/yakka rasmlar: bitta copy_messages
+#            (100 tagacha xabar)
+#   album  — ketma-ket 2+ rasm: bitta send_media_group (10 tagacha)
+#   forward — kanal posti: forward_message ("kimdan" ko'rinadi)
+#   item   — manba xabari yo'q eski element: avvalgidek alohida yuboriladi
+
+COPY_BATCH  = 100
+ALBUM_BATCH = 10
+
+
+def compile_plan(items: list[dict]) -> list[dict]:
+    plan: list[dict] = []
+    i = 0
+    while i < len(items):
+        item = items[i]
+        t    = item["type"]
+
+        if t == "forward":
+            plan.append({"op": "forward", "chat": item["from_chat"], "id": item["message_id"]})
+            i += 1
+            continue
+
+        if t == "photo":
+            run = []
+            while i + len(run) < len(items) and items[i + len(run)]["type"] == "photo":
+                run.append(items[i + len(run)])
+            if len(run) >= 2:
+                for k in range(0, len(run), ALBUM_BATCH):
+                    chunk = run[k:k + ALBUM_BATCH]
+                    if len(chunk) == 1:
+                        plan.append({"op": "item", "item": chunk[0]})
+                    else:
+                        plan.append({"op": "album", "media": [
+                            {"file_id": p["file_id"], "caption": p.get("caption") or ""} for p in chunk
+                        ]})
+                i += len(run)
+                continue
+
+        if "src_id" not in item:
+            plan.append({"op": "item", "item": item})
+            i += 1
+            continue
+
+        last = plan[-1] if plan else None
+        if (
+            last and last["op"] == "copy"
+            and last["chat"] == item["src_chat"]
+            and len(last["ids"]) < COPY_BATCH
+        ):
+            last["ids"].append(item["src_id"])
+        else:
+            plan.append({"op": "copy", "chat": item["src_chat"], "ids": [item["src_id"]]})
+        i += 1
+    return plan
+
+
+async def _send_plan(
+    bot: Bot,
+    user_id: int,
+    plan: list[dict],
+    is_preview: bool = False,
+    throttle: Throttle | None = None,
 ) -> None:
-    for item in items:
-        t = item["type"]
-
-        if t == "text":
-            await bot.send_message(user_id, item["text"])
-        elif t == "photo":
-            await bot.send_photo(
-                user_id,
-                item["file_id"],
-                caption=item.get("caption") or None,
-            )
-        elif t == "location":
-            await bot.send_location(user_id, item["latitude"], item["longitude"])
-        elif t == "forward":
+    """
+    Rejani bitta foydalanuvchiga yuboradi. throttle berilsa har bir
+    chaqiruv umumiy tezlik cheklovidan o'tadi (ommaviy yuborishda).
+    """
+    async def call(request):
+        if throttle is None:
+            return await request()
+        return await throttle.call(user_id, request)
+
+    for step in plan:
+        op = step["op"]
+
+        if op == "copy":
+            await call(lambda: bot.copy_messages(
+                chat_id=user_id, from_chat_id=step["chat"], message_ids=step["ids"],
+            ))
+        elif op == "album":
+            await call(lambda: bot.send_media_group(user_id, [
+                InputMediaPhoto(media=m["file_id"], caption=m["caption"] or None)
+                for m in step["media"]
+            ]))
+        elif op == "forward":
             try:
-                await bot.forward_message(
+                await call(lambda: bot.forward_message(
                     chat_id=user_id,
-                    from_chat_id=item["from_chat"],
-                    message_id=item["message_id"],
-                )
+                    from_chat_id=step["chat"],
+                    message_id=step["id"],
+                ))
             except Exception as e:
                 if is_preview:
                     await bot.send_message(
@@ -595,5 +931,19 @@ async def _send_items(
                     )
                 else:
                     raise
-
-        await asyncio.sleep(0.03)
+        else:
+            await _send_item(bot, user_id, step["item"], call)
+
+
+async def _send_item(bot: Bot, user_id: int, item: dict, call) -> None:
+    t = item["type"]
+    if t == "text":
+        await call(lambda: bot.send_message(user_id, item["text"]))
+    elif t == "photo":
+        await call(lambda: bot.send_photo(
+            user_id,
+            item["file_id"],
+            caption=item.get("caption") or None,
+        ))
+    elif t == "location":
+        await call(lambda: bot.send_location(user_id, item["latitude"], item["longitude"]))
@@ -4,14 +4,11 @@ Bot buyruqlari sozlamalari
 from aiogram import Bot
 from aiogram.types import BotCommand, BotCommandScopeDefault, BotCommandScopeChat
 import os
-import asyncio
-import base64
-import json
 import logging
-import gspread
-from google.oauth2.service_account import Credentials
 from dotenv import load_dotenv
 
+import sheets
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -19,28 +16,12 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 GROUP_ID = int(os.getenv("GROUP_ID", "0"))
 JOB_ID   = int(os.getenv("JOB_ID",   "0"))
 
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
 SUBADMIN_SHEET = "sub_adminlar"
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets.readonly",
-    "https://www.googleapis.com/auth/drive.readonly",
-]
-
-_gc = None
-
-def _get_gc():
-    global _gc
-    if _gc is None:
-        b64   = os.getenv("GOOGLE_CREDENTIALS_B64")
-        info  = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        _gc   = gspread.authorize(creds)
-    return _gc
+
 
 def _get_subadmin_ids() -> list[int]:
     try:
-        gc  = _get_gc()
-        ws  = gc.open_by_key(SPREADSHEET_ID).worksheet(SUBADMIN_SHEET)
+        ws  = sheets.worksheet(SUBADMIN_SHEET)
         ids = ws.col_values(2)[1:]
         result = []
         for v in ids:
@@ -129,8 +110,7 @@ async def set_bot_commands(bot: Bot):
             print(f"⚠️ Guruh buyruqlarini o'rnatishda xato: {e}")
 
     # Sub_adminlar uchun alohida
-    loop = asyncio.get_running_loop()
-    subadmin_ids = await loop.run_in_executor(None, _get_subadmin_ids)
+    subadmin_ids = await sheets.run(_get_subadmin_ids)
     for uid in subadmin_ids:
         if uid in (ADMIN_ID, JOB_ID):
             continue  # allaqachon o'rnatilgan
@@ -5,8 +5,13 @@ import contextlib
 import os
 import json
 import re
+import time
+import logging
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    Message, CallbackQuery, ChatMemberUpdated, Chat,
+    InlineKeyboardMarkup, InlineKeyboardButton,
+)
 from aiogram.filters import Command
 from aiogram import BaseMiddleware
 from aiogram.exceptions import TelegramBadRequest
@@ -14,20 +19,12 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from dotenv import load_dotenv
 
+from broadcast import enqueue_user
+
 load_dotenv()
+logger = logging.getLogger(__name__)
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
-async def _ensure_user_registered(user) -> None:
-    try:
-        from broadcast import save_user
-        await save_user(
-            user_id=user.id,
-            full_name=user.full_name or "",
-            username=user.username or "",
-        )
-    except Exception:
-        pass
-
 router = Router()
 
 PERMANENT_CHANNEL = "@isoqovrozimurod_blog"
@@ -50,19 +47,29 @@ def normalize_channel(text: str) -> str | None:
     return None
 
 
+# Kanallar ro'yxati xotirada — fayl faqat birinchi marta va save_channels
+# yozganda o'qiladi/yangilanadi
+_channels: list[str] | None = None
+
+
 def load_channels():
-    if not os.path.exists(CHANNEL_FILE):
-        return []
-    try:
-        with open(CHANNEL_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+    global _channels
+    if _channels is None:
+        _channels = []
+        if os.path.exists(CHANNEL_FILE):
+            try:
+                with open(CHANNEL_FILE, "r", encoding="utf-8") as f:
+                    _channels = list(json.load(f))
+            except Exception:
+                _channels = []
+    return list(_channels)
 
 
 def save_channels(data):
+    global _channels
     with open(CHANNEL_FILE, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    _channels = list(data)
 
 
 def get_all_channels():
@@ -70,6 +77,109 @@ def get_all_channels():
     return [PERMANENT_CHANNEL] + data
 
 
+# Obuna keshi: {(user_id, kanal): (obuna_bo'lganmi, amal qilish muddati)}
+# Obunachi uzoqroq, obuna bo'lmagan qisqa saqlanadi — obuna bo'lgach
+# tez o'tkazib yuborish uchun. chat_member update lari keshni darhol
+# yangilaydi (bot kanalda admin bo'lsa keladi).
+MEMBER_TTL_JOINED     = int(os.getenv("SUB_CACHE_TTL", "300"))
+MEMBER_TTL_NOT_JOINED = int(os.getenv("SUB_CACHE_NEG_TTL", "20"))
+MEMBER_CACHE_MAX      = 50_000
+
+_member_cache: dict[tuple[int, str], tuple[bool, float]] = {}
+
+
+def _cache_member(user_id: int, ch: str, joined: bool) -> None:
+    ttl = MEMBER_TTL_JOINED if joined else MEMBER_TTL_NOT_JOINED
+    now = time.monotonic()
+    if len(_member_cache) >= MEMBER_CACHE_MAX:
+        for k in [k for k, (_, exp) in _member_cache.items() if exp <= now]:
+            _member_cache.pop(k, None)
+        if len(_member_cache) >= MEMBER_CACHE_MAX:
+            _member_cache.clear()
+    _member_cache[(user_id, ch)] = (joined, now + ttl)
+
+
+def _cached_member(user_id: int, ch: str) -> bool | None:
+    rec = _member_cache.get((user_id, ch))
+    if rec is None:
+        return None
+    joined, exp = rec
+    if exp <= time.monotonic():
+        _member_cache.pop((user_id, ch), None)
+        return None
+    return joined
+
+
+# Har bir get_chat_member uchun qat'iy muddat. Kanallar parallel
+# tekshiriladi — kutish eng sekin bitta so'rovga teng, yig'indiga emas.
+# Muddat o'tsa yoki xato bo'lsa: SUB_FAIL_OPEN=1 (default) — o'tkazamiz,
+# 0 — obuna bo'lmagan deb hisoblaymiz.
+SUB_CHECK_TIMEOUT = float(os.getenv("SUB_CHECK_TIMEOUT", "3"))
+SUB_FAIL_OPEN     = os.getenv("SUB_FAIL_OPEN", "1").strip().lower() not in ("0", "false", "no")
+
+# Diagnostika uchun hisoblagichlar (/chanel panelida ko'rinadi)
+_sub_stats: dict[str, int] = {"checks": 0, "cache_hits": 0, "timeouts": 0, "errors": 0}
+
+
+async def _is_member(bot, ch: str, user_id: int, fresh: bool = False) -> bool | None:
+    """
+    Foydalanuvchi kanalga obuna bo'lganmi.
+    None — aniqlab bo'lmadi (muddat o'tdi, tarmoq xatosi), keshlanmaydi.
+    fresh=True — keshni chetlab o'tib Telegram dan so'raydi.
+    """
+    if not fresh:
+        cached = _cached_member(user_id, ch)
+        if cached is not None:
+            _sub_stats["cache_hits"] += 1
+            return cached
+    _sub_stats["checks"] += 1
+    try:
+        member = await asyncio.wait_for(bot.get_chat_member(ch, user_id), SUB_CHECK_TIMEOUT)
+        joined = member.status not in ("left", "kicked")
+    except TelegramBadRequest:
+        joined = False
+    except asyncio.TimeoutError:
+        _sub_stats["timeouts"] += 1
+        logger.warning(f"[SUB] {ch} tekshiruvi {SUB_CHECK_TIMEOUT}s da tugamadi (user {user_id})")
+        return None
+    except Exception as e:
+        _sub_stats["errors"] += 1
+        logger.warning(f"[SUB] {ch} tekshiruvida xato (user {user_id}): {e}")
+        return None
+    _cache_member(user_id, ch, joined)
+    return joined
+
+
+async def _not_joined_channels(bot, user_id: int, fresh: bool = False) -> list[str]:
+    channels = get_all_channels()
+    results  = await asyncio.gather(*(_is_member(bot, ch, user_id, fresh=fresh) for ch in channels))
+    return [
+        ch for ch, joined in zip(channels, results)
+        if joined is False or (joined is None and not SUB_FAIL_OPEN)
+    ]
+
+
+def sub_stats_text() -> str:
+    st = _sub_stats
+    return (
+        f"📈 Tekshiruvlar: {st['checks']} | keshdan: {st['cache_hits']}\n"
+        f"⏱ Muddat o'tgan: {st['timeouts']} | ❗ Xato: {st['errors']}\n"
+        f"⚙️ Muddat: {SUB_CHECK_TIMEOUT}s, rejim: {'fail-open' if SUB_FAIL_OPEN else 'fail-closed'}"
+    )
+
+
+def _matching_channels(chat: Chat) -> list[str]:
+    """Chat ga mos keladigan sozlangan kanallar (@username yoki -100... id bo'yicha)."""
+    keys = {str(chat.id)}
+    if chat.username:
+        keys.add("@" + chat.username.lower())
+    return [ch for ch in get_all_channels() if ch.lower() in keys]
+
+
+def _is_tracked_chat(event: ChatMemberUpdated) -> bool:
+    return bool(_matching_channels(event.chat))
+
+
 @router.message(Command("chanel"))
 async def chanel_panel(msg: Message, state: FSMContext):
     if msg.from_user.id != ADMIN_ID:
@@ -80,7 +190,7 @@ async def chanel_panel(msg: Message, state: FSMContext):
         [InlineKeyboardButton(text="📋 Ro'yxat", callback_data="list_ch")]
     ])
     await msg.answer(
-        f"📡 Majburiy obuna tizimi\n\n🔒 Doimiy kanal: {PERMANENT_CHANNEL}",
+        f"📡 Majburiy obuna tizimi\n\n🔒 Doimiy kanal: {PERMANENT_CHANNEL}\n\n{sub_stats_text()}",
         reply_markup=kb
     )
 
@@ -175,8 +285,8 @@ class SubscriptionMiddleware(BaseMiddleware):
         if chat.type != "private":
             return await handler(event, data)
 
-        # Har qanday xabarda foydalanuvchini ro'yxatga olamiz
-        asyncio.ensure_future(_ensure_user_registered(user))
+        # Har qanday xabarda foydalanuvchini ro'yxatga olish navbatiga qo'yamiz
+        enqueue_user(user.id, user.full_name or "", user.username or "")
 
         # /start va /chanel ni tekshirmasdan o'tkazamiz
         text = (event.text or "") if isinstance(event, Message) else ""
@@ -188,18 +298,7 @@ class SubscriptionMiddleware(BaseMiddleware):
         if cb_data == "check_sub":
             return await handler(event, data)
 
-        channels = get_all_channels()
-        not_joined = []
-
-        for ch in channels:
-            try:
-                member = await bot.get_chat_member(ch, user.id)
-                if member.status in ("left", "kicked"):
-                    not_joined.append(ch)
-            except TelegramBadRequest:
-                not_joined.append(ch)
-            except Exception:
-                pass
+        not_joined = await _not_joined_channels(bot, user.id)
 
         if not not_joined:
             return await handler(event, data)
@@ -214,18 +313,19 @@ class SubscriptionMiddleware(BaseMiddleware):
         return
 
 
+@router.chat_member(_is_tracked_chat)
+async def on_channel_member(event: ChatMemberUpdated):
+    """Majburiy kanaldagi obuna o'zgarishi — keshni darhol yangilaymiz."""
+    joined = event.new_chat_member.status not in ("left", "kicked")
+    for ch in _matching_channels(event.chat):
+        _cache_member(event.new_chat_member.user.id, ch, joined)
+
+
 @router.callback_query(F.data == "check_sub")
 async def check_sub(cb: CallbackQuery):
     bot = cb.bot
-    channels = get_all_channels()
-    not_joined = []
-    for ch in channels:
-        try:
-            member = await bot.get_chat_member(ch, cb.from_user.id)
-            if member.status in ("left", "kicked"):
-                not_joined.append(ch)
-        except TelegramBadRequest:
-            not_joined.append(ch)
+    # Foydalanuvchi "Tekshirish" ni bosdi — keshga ishonmaymiz
+    not_joined = await _not_joined_channels(bot, cb.from_user.id, fresh=True)
 
     if not_joined:
         await cb.answer("❌ Hali obuna bo'lmadingiz!", show_alert=True)
@@ -1,15 +1,11 @@
 from __future__ import annotations
 
-import asyncio
-import base64
 import csv
 import io
-import json
 import logging
 import os
 from pathlib import Path
 
-import gspread
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 from aiogram import Bot, F, Router
@@ -23,18 +19,14 @@ from aiogram.types import (
     Message,
 )
 from dotenv import load_dotenv
-from google.oauth2.service_account import Credentials
+
+import sheets
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 router = Router()
 
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive",
-]
 
 TEMP_DIR = Path(__file__).resolve().parent / "temp"
 
@@ -74,25 +66,10 @@ ITEMS = [
 ]
 
 
-# ===================== SHEETS CLIENT =====================
-
-_gc: gspread.Client | None = None
-
-
-def _get_gc() -> gspread.Client:
-    global _gc
-    if _gc is None:
-        b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
-        creds_dict = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-        _gc = gspread.authorize(creds)
-    return _gc
-
+# ===================== SHEETS =====================
 
 def _sheet_to_csv(sheet_name: str) -> bytes:
-    gc = _get_gc()
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(sheet_name)
+    ws = sheets.worksheet(sheet_name)
     rows = ws.get_all_values()
 
     buf = io.StringIO()
@@ -109,9 +86,7 @@ def _cleanup_sync(sheet_name: str) -> None:
     - Telegram ID bo'sh qatorlarni o'chiradi
     - T/r ni 1 dan tartiblab qayta yozadi
     """
-    gc = _get_gc()
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(sheet_name)
+    ws = sheets.worksheet(sheet_name)
 
     all_rows = ws.get_all_values()
     if len(all_rows) <= 1:
@@ -153,6 +128,9 @@ def _cleanup_sync(sheet_name: str) -> None:
             value_input_option="RAW"
         )
 
+    # Qatorlar joyi o'zgardi — qator indeksi eskirdi
+    sheets.invalidate_rows(sheet_name)
+
 
 # Tozalanadigan sheetlar ro'yxati (sheet nomi)
 CLEANABLE_SHEETS = {"user", "sub_adminlar"}
@@ -163,8 +141,7 @@ async def _cleanup_before_download(sheet_name: str) -> None:
     if sheet_name not in CLEANABLE_SHEETS:
         return
     try:
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, _cleanup_sync, sheet_name)
+        await sheets.run(_cleanup_sync, sheet_name)
     except Exception as e:
         logger.warning(f"Tozalashda xato ({sheet_name}): {e}")
 
@@ -176,8 +153,6 @@ SHEET_ITEMS = [item for item in ITEMS if item["type"] == "sheet"]
 
 def _all_to_excel() -> bytes:
     """Barcha Google Sheets varaqlarini bitta Excel faylga yozadi"""
-    gc = _get_gc()
-    sh = gc.open_by_key(SPREADSHEET_ID)
     wb = openpyxl.Workbook()
     wb.remove(wb.active)  # Bo'sh default sheetni o'chiramiz
 
@@ -186,7 +161,7 @@ def _all_to_excel() -> bytes:
     center = Alignment(horizontal="center", vertical="center")
 
     for item in SHEET_ITEMS:
-        ws_gsheet = sh.worksheet(item["sheet"])
+        ws_gsheet = sheets.worksheet(item["sheet"])
         rows = ws_gsheet.get_all_values()
         if not rows:
             continue
@@ -258,8 +233,7 @@ async def handle_download(call: CallbackQuery, bot: Bot):
             # Barcha tozalanadigan sheetlarni avval tozalaymiz
             for sheet_name in CLEANABLE_SHEETS:
                 await _cleanup_before_download(sheet_name)
-            loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(None, _all_to_excel)
+            data = await sheets.run(_all_to_excel)
             file = BufferedInputFile(data, filename="fortuna_biznes_malumotlar.xlsx")
             await bot.send_document(
                 call.from_user.id,
@@ -288,10 +262,7 @@ async def handle_download(call: CallbackQuery, bot: Bot):
             # Avval tozalaymiz (bo'sh qatorlar, T/r tartib)
             await _cleanup_before_download(item["sheet"])
             # Keyin yuklaymiz
-            loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(
-                None, _sheet_to_csv, item["sheet"]
-            )
+            data = await sheets.run(_sheet_to_csv, item["sheet"])
             file = BufferedInputFile(data, filename=item["filename"])
             await bot.send_document(
                 call.from_user.id,
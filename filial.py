@@ -1,16 +1,11 @@
 from __future__ import annotations
 
-import os
 import re
-import base64
-import json
 import logging
 import asyncio
 import contextlib
 import aiohttp
-import gspread
 from math import radians, sin, cos, sqrt, atan2
-from google.oauth2.service_account import Credentials
 
 from aiogram import Router, F, Bot
 from aiogram.types import (
@@ -22,16 +17,12 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import Command
 from config import load_config
+import sheets
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 # ── Config ─────────────────────────────────────────────────────
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets.readonly",
-    "https://www.googleapis.com/auth/drive.readonly",
-]
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
 SHEET_NAME     = "malumotlar"
 CALL_CENTER    = "+998 55 808 40 00"
 
@@ -54,34 +45,20 @@ COL = {
     "location":    "Location",
 }
 
-_gc: gspread.Client | None = None
 _coords_cache: dict[str, tuple[float, float]] = {}
 # Barcha filiallar keshi — bir sessiyada bir marta yuklanadi
 _branches_cache: list[dict] | None = None
 
 
 # ── Sheets ─────────────────────────────────────────────────────
-def _get_gc() -> gspread.Client:
-    global _gc
-    if _gc is None:
-        b64   = os.getenv("GOOGLE_CREDENTIALS_B64")
-        info  = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        _gc   = gspread.authorize(creds)
-    return _gc
-
-
 async def get_all_branches(force: bool = False) -> list[dict]:
     global _branches_cache
     if _branches_cache is not None and not force:
         return _branches_cache
     try:
-        loop = asyncio.get_running_loop()
         def _fetch():
-            gc = _get_gc()
-            ws = gc.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
-            return ws.get_all_records()
-        records = await loop.run_in_executor(None, _fetch)
+            return sheets.worksheet(SHEET_NAME).get_all_records()
+        records = await sheets.run(_fetch)
         _branches_cache = [r for r in records if r.get(COL["filial"])]
         return _branches_cache
     except Exception as e:
@@ -487,8 +464,8 @@ async def cmd_filiallar(message: Message, state: FSMContext):
 async def cmd_refresh(message: Message):
     if not _is_admin(message.from_user.id):
         return
-    global _gc, _coords_cache, _branches_cache
-    _gc = None
+    global _coords_cache, _branches_cache
+    sheets.reset()
     _coords_cache = {}
     _branches_cache = None
     branches = await get_all_branches(force=True)
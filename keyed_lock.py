@@ -0,0 +1,135 @@
+"""
+Kalit bo'yicha asyncio lock lar (masalan, har bir foydalanuvchi uchun).
+
+Ilgari har bir foydalanuvchi uchun asyncio.Lock yaratilib, dict da abadiy
+qolardi. Endi lock faqat kimdir uni ushlab turgan yoki kutayotgan paytda
+mavjud: refcount nolga tushishi bilan o'chiriladi.
+
+Qo'shimcha ravishda kutish metrikalari yig'iladi — qaysi kalitlar sekin
+(masalan, Sheets chaqiruvi ortida) navbatda turib qolayotganini ko'rish uchun.
+
+Foydalanish:
+    user_locks = KeyedLock("reklama.user")
+
+    async with user_locks(user_id):
+        ...
+
+    user_locks.stats_text()
+"""
+from __future__ import annotations
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable
+
+logger = logging.getLogger(__name__)
+
+SLOW_WAIT   = 2.0    # soniya — bundan uzoq kutish logga yoziladi
+STATS_KEEP  = 1000   # metrikasi saqlanadigan kalitlar soni (eng so'nggilari)
+
+
+class _Entry:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.refs = 0   # ushlab turgan + kutayotganlar
+
+
+class _KeyStats:
+    __slots__ = ("acquired", "contended", "wait_total", "wait_max", "depth_max")
+
+    def __init__(self) -> None:
+        self.acquired   = 0
+        self.contended  = 0       # kutishga to'g'ri kelgan olishlar
+        self.wait_total = 0.0
+        self.wait_max   = 0.0
+        self.depth_max  = 0       # kelganda oldida turganlar soni (eng ko'pi)
+
+
+class KeyedLock:
+    """Refcount li kalitlangan lock lar to'plami."""
+
+    def __init__(self, name: str, slow_wait: float = SLOW_WAIT) -> None:
+        self.name      = name
+        self.slow_wait = slow_wait
+        self._entries: dict[Hashable, _Entry] = {}
+        self._stats: OrderedDict[Hashable, _KeyStats] = OrderedDict()
+
+    def __call__(self, key: Hashable):
+        return self.hold(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def locked(self, key: Hashable) -> bool:
+        """Kalit hozir band (ushlab turilgan) mi."""
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def depth(self, key: Hashable) -> int:
+        """Kalitni ushlab turgan + kutayotganlar soni."""
+        entry = self._entries.get(key)
+        return entry.refs if entry else 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        ahead = entry.refs
+        entry.refs += 1
+        started = time.monotonic()
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._release_ref(key, entry)
+            raise
+        self._record(key, ahead, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            entry.lock.release()
+            self._release_ref(key, entry)
+
+    def _release_ref(self, key: Hashable, entry: _Entry) -> None:
+        entry.refs -= 1
+        if entry.refs == 0 and self._entries.get(key) is entry:
+            del self._entries[key]
+
+    def _record(self, key: Hashable, ahead: int, wait: float) -> None:
+        st = self._stats.pop(key, None) or _KeyStats()
+        self._stats[key] = st
+        if len(self._stats) > STATS_KEEP:
+            self._stats.popitem(last=False)
+        st.acquired += 1
+        if ahead:
+            st.contended  += 1
+            st.wait_total += wait
+            st.wait_max    = max(st.wait_max, wait)
+            st.depth_max   = max(st.depth_max, ahead)
+        if wait >= self.slow_wait:
+            logger.warning(
+                f"[LOCK] {self.name}:{key} — {wait:.1f}s kutildi, oldida {ahead} ta"
+            )
+
+    def top(self, n: int = 5) -> list[tuple[Hashable, _KeyStats]]:
+        """Eng ko'p kutilgan kalitlar (jami kutish vaqti bo'yicha)."""
+        items = [(k, s) for k, s in self._stats.items() if s.contended]
+        items.sort(key=lambda kv: kv[1].wait_total, reverse=True)
+        return items[:n]
+
+    def stats_text(self, n: int = 5) -> str:
+        """Qisqa hisobot (admin uchun)."""
+        lines = [f"🔒 <b>{self.name}</b> — faol: {len(self._entries)}"]
+        for key, st in self.top(n):
+            lines.append(
+                f"• <code>{key}</code>: {st.contended}/{st.acquired} kutdi, "
+                f"jami {st.wait_total:.1f}s, max {st.wait_max:.1f}s, navbat {st.depth_max}"
+            )
+        if len(lines) == 1:
+            lines.append("• navbat bo'lmagan")
+        return "\n".join(lines)
@@ -10,11 +10,12 @@ from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramConflictError
 from aiogram.client.session.aiohttp import AiohttpSession
 from upstash_redis.asyncio import Redis
 
+from redis_storage import UpstashStorage
+
 from start import router as start_router
 from contact import router as contact_router
 from kredit_turlari import router as kredit_router
@@ -34,11 +35,16 @@ from avto_drive import router as avto_drive_router
 from taxi_bandlik import router as taxi_bandlik_router
 from oila import router as oila_router
 from filial import router as filial_router
-from reklama_nazorati import router as reklama_router, setup_scheduler
-from broadcast import router as broadcast_router
+from reklama_nazorati import (
+    router as reklama_router, setup_scheduler, init_counter, flush_counts,
+)
+from broadcast import (
+    router as broadcast_router, flush_registrations, init_jobs, resume_jobs, stop_jobs,
+)
 from download import router as download_router
 from scoring import router as scoring_router
-from personal_message import router as personal_message_router
+from personal_message import router as personal_message_router, init_campaigns
+import sheets
 
 
 # =================== LOGGING ===================
@@ -82,7 +88,13 @@ async def acquire_lock(redis: Redis, key: str, value: str, ttl: int) -> bool:
         logger.error(f"Lock olishda xato: {e}")
         return False
 
+# Lock yo'qotilgach, yangi instansiya Redis dagi navbatlarni o'zi tiklaydi —
+# bu jarayon o'chayotganda ularni qayta yozmasligi kerak
+lock_held = False
+
+
 async def refresh_lock_loop(redis: Redis, key: str, value: str, ttl: int):
+    global lock_held
     interval = max(5, ttl // 2)
     while True:
         await asyncio.sleep(interval)
@@ -95,12 +107,14 @@ async def refresh_lock_loop(redis: Redis, key: str, value: str, ttl: int):
             await redis.set(key, value, ex=ttl)
         except Exception as e:
             logger.error(f"Lock refresh xato: {e}")
+            lock_held = False
             sys.exit(1)
 
 
 # =================== DISPATCHER ===================
-def setup_dispatcher() -> Dispatcher:
-    dp = Dispatcher(storage=MemoryStorage())
+def setup_dispatcher(redis: Redis) -> Dispatcher:
+    # FSM holatlari Redis da — redeploy va lock almashinuvidan keyin ham saqlanadi
+    dp = Dispatcher(storage=UpstashStorage(redis))
     dp.message.middleware(SubscriptionMiddleware())
     dp.callback_query.middleware(SubscriptionMiddleware())
 
@@ -132,6 +146,7 @@ def setup_dispatcher() -> Dispatcher:
 
 # =================== MAIN ===================
 async def main():
+    global lock_held
     load_dotenv()
 
     token = os.getenv("BOT_TOKEN")
@@ -158,12 +173,6 @@ async def main():
             else:
                 logger.warning("delete_webhook o'tkazib yuborildi, polling davom etadi")
 
-    dp = setup_dispatcher()
-    try:
-        await set_bot_commands(bot)
-    except Exception as e:
-        logger.warning(f"Buyruqlarni o'rnatishda xato: {e}")
-
     instance_id = (
         os.getenv("KOYEB_DEPLOYMENT_ID")
         or os.getenv("RENDER_INSTANCE_ID")
@@ -178,6 +187,12 @@ async def main():
         logger.error(f"Upstash Redis ulanishida xato: {e}")
         sys.exit(1)
 
+    dp = setup_dispatcher(redis)
+    try:
+        await set_bot_commands(bot)
+    except Exception as e:
+        logger.warning(f"Buyruqlarni o'rnatishda xato: {e}")
+
     logger.info("Lock tekshirilmoqda...")
     got_lock = await acquire_lock(redis, lock_key, lock_value, ttl=60)
 
@@ -187,11 +202,24 @@ async def main():
         got_lock = await acquire_lock(redis, lock_key, lock_value, ttl=60)
 
     logger.info("Lock olindi. Polling shu instanceda ishlaydi.")
+    lock_held = True
 
     lock_task = asyncio.create_task(
         refresh_lock_loop(redis, lock_key, lock_value, ttl=60)
     )
 
+    try:
+        await init_counter(redis)
+    except Exception as e:
+        logger.warning(f"Hisoblagichni tiklashda xato: {e}")
+
+    await init_jobs(redis)
+    await init_campaigns(redis)
+    try:
+        await resume_jobs(bot)
+    except Exception as e:
+        logger.warning(f"Broadcast joblarini tiklashda xato: {e}")
+
     scheduler = None
     with suppress(Exception):
         scheduler = setup_scheduler(bot)
@@ -215,6 +243,23 @@ async def main():
         if scheduler:
             with suppress(Exception):
                 scheduler.shutdown(wait=False)
+        # Tugallanmagan broadcastlar checkpoint bilan Redis da qoladi
+        with suppress(Exception):
+            await stop_jobs()
+        # Navbatda qolgan screenshot hisoblarini yo'qotmaslik uchun.
+        # Lock boshqaga o'tgan bo'lsa — deltalar Redis da, ularni yangi
+        # egasi yozadi (bu yerda yozilsa ikki marta hisoblanardi)
+        if lock_held:
+            with suppress(Exception):
+                await flush_counts()
+        else:
+            logger.warning("Lock yo'q — screenshot hisoblari flush qilinmadi")
+        with suppress(Exception):
+            await flush_registrations()
+        with suppress(Exception):
+            await dp.storage.close()
+        with suppress(Exception):
+            sheets.shutdown()
         with suppress(Exception):
             await http_runner.cleanup()
         with suppress(Exception):
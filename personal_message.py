@@ -20,19 +20,21 @@ FAQAT ADMIN_ID uchun ishlaydi.
 from __future__ import annotations
 
 import os
-import re
 import json
+import zlib
+import time
 import base64
-import asyncio
 import logging
 import secrets
 import contextlib
+from collections import OrderedDict
 from datetime import datetime
 
-import gspread
-from google.oauth2.service_account import Credentials
+import user_directory
+from throttle import OK, fan_out, get_throttle
 
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -47,110 +49,180 @@ logger = logging.getLogger(__name__)
 router = Router()
 
 ADMIN_ID       = int(os.getenv("ADMIN_ID", "0"))
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
-USER_SHEET     = "user"
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets.readonly",
-    "https://www.googleapis.com/auth/drive.readonly",
-]
 
 PAGE_SIZE = 8   # bazadan ro'yxat ko'rinishida bir sahifadagi kishilar soni
 
-_gc: gspread.Client | None = None
 
+async def load_users() -> list[dict]:
+    """Katalogdagi foydalanuvchilar (nusxa — keyingi o'zgarishlar ta'sir qilmaydi)."""
+    directory = await user_directory.get()
+    return list(directory.users)
 
-def _get_gc() -> gspread.Client:
-    global _gc
-    if _gc is None:
-        b64   = os.getenv("GOOGLE_CREDENTIALS_B64")
-        info  = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        _gc   = gspread.authorize(creds)
-    return _gc
 
+# ── Foydalanuvchilar snapshoti (bazadan tanlash uchun) ────────────────
+# Ro'yxat FSM ga yozilmaydi — jarayon ichida versiyalangan snapshot
+# sifatida saqlanadi. FSM da faqat snapshot id si, sahifa va tanlangan
+# indekslar turadi. Bir nechta versiya saqlanadi: ochiq picker lar
+# o'z ro'yxatini yangilanishdan keyin ham ko'radi.
+# FSM Redis da — redeploy dan keyin ham qoladi, shuning uchun id tasodifiy:
+# eski jarayonning id si yangi jarayondagi boshqa ro'yxatga mos kelmaydi.
 
-# ── "user" varag'ini o'qish — moslashuvchan ustun nomlari ──────────────
+SNAPSHOT_TTL  = 120   # soniya — shundan eski snapshot yangi picker uchun qayta yuklanadi
+SNAPSHOT_KEEP = 3     # xotirada saqlanadigan versiyalar soni
 
-_ID_KEYS     = ["Telegram ID", "TelegramID", "ID", "Tg ID", "Chat ID"]
-_UNAME_KEYS  = ["Username", "User", "@Username"]
-_ISM_KEYS    = ["Ism", "Name", "First Name", "Ismi"]
-_FAM_KEYS    = ["Familiya", "Last Name", "Familiyasi"]
-_TEL_KEYS    = ["Telefon", "Telefon raqami", "Phone", "Tel"]
-_HOLATI_KEYS = ["Holati", "Status"]
+_snapshots:   dict[str, list[dict]] = {}   # {id: ro'yxat}, eskisidan yangisiga
+_snapshot_at: float = 0.0
+_snapshot_id  = ""
 
 
-def _pick(rec: dict, keys: list[str]) -> str:
-    for k in keys:
-        if k in rec and str(rec[k]).strip():
-            return str(rec[k]).strip()
-    return ""
+async def _user_snapshot() -> tuple[str, list[dict]]:
+    """Eng so'nggi snapshot (eskirgan bo'lsa qayta yuklanadi): (id, ro'yxat)."""
+    global _snapshot_at, _snapshot_id
+    if _snapshot_id in _snapshots and time.monotonic() - _snapshot_at < SNAPSHOT_TTL:
+        return _snapshot_id, _snapshots[_snapshot_id]
+    users = await load_users()
+    _snapshot_id  = secrets.token_hex(4)
+    _snapshot_at  = time.monotonic()
+    _snapshots[_snapshot_id] = users
+    for old in list(_snapshots)[:-SNAPSHOT_KEEP]:
+        _snapshots.pop(old, None)
+    return _snapshot_id, users
+
+
+# ── Kampaniyalar (yuborilgan xabarlar) ombori ───────────────────────────
+# Kampaniya: {"admin_id", "kind", "recipients": {user_id: message_id}, "created": datetime}
+# Redis da saqlanadi — redeploy dan keyin ham o'chirish/tahrirlash ishlaydi.
+# TTL = 48 soat: Telegram shundan eski xabarlarni o'chirishga ruxsat bermaydi.
+# recipients ixcham saqlanadi: saralangan user_id lar farqlari + message_id
+# lar, zlib bilan siqilgan. Ustida kichik LRU kesh.
+
+CAMPAIGN_TTL   = 48 * 60 * 60   # soniya
+CAMPAIGN_CACHE = 64             # xotiradagi kampaniyalar soni
+CAMPAIGN_KEY   = "fortuna:pm:campaign"
+CAMPAIGN_INDEX = "fortuna:pm:campaigns"   # {campaign_id: "yaratilgan_ts:soni"}
+
+_redis = None   # upstash_redis.asyncio.Redis | None
+_campaigns: OrderedDict[str, dict] = OrderedDict()
+
+
+def _pack_campaign(camp: dict) -> str:
+    pairs = sorted(camp["recipients"].items())
+    uids, prev = [], 0
+    for uid, _ in pairs:
+        uids.append(uid - prev)
+        prev = uid
+    raw = json.dumps({
+        "a": camp["admin_id"],
+        "c": int(camp["created"].timestamp()),
+        "k": camp.get("kind"),
+        "u": uids,
+        "m": [mid for _, mid in pairs],
+    }, separators=(",", ":"))
+    return base64.b64encode(zlib.compress(raw.encode("ascii"), 9)).decode("ascii")
+
+
+def _unpack_campaign(blob: str) -> dict:
+    obj  = json.loads(zlib.decompress(base64.b64decode(blob)))
+    uids, acc = [], 0
+    for d in obj["u"]:
+        acc += d
+        uids.append(acc)
+    return {
+        "admin_id":   obj["a"],
+        "kind":       obj.get("k"),
+        "recipients": dict(zip(uids, obj["m"])),
+        "created":    datetime.fromtimestamp(obj["c"]),
+    }
 
 
-def _load_users_sync() -> list[dict]:
-    """
-    'user' varag'idan barcha foydalanuvchilarni o'qib, normallashtirilgan
-    dict ro'yxatini qaytaradi: {id, username, ism, familiya, fullname,
-    telefon, holati}
-    """
-    gc       = _get_gc()
-    ws       = gc.open_by_key(SPREADSHEET_ID).worksheet(USER_SHEET)
-    all_vals = ws.get_all_values()
-    if len(all_vals) < 2:
-        return []
+def _camp_expired(camp: dict) -> bool:
+    return (datetime.now() - camp["created"]).total_seconds() > CAMPAIGN_TTL
 
-    headers = [str(h).strip() for h in all_vals[0]]
-    result  = []
 
-    for row in all_vals[1:]:
-        if not any(str(c).strip() for c in row):
-            continue
-        padded = row + [""] * max(0, len(headers) - len(row))
-        rec    = {headers[i]: padded[i] for i in range(len(headers)) if headers[i]}
+def _camp_cache(campaign_id: str, camp: dict) -> None:
+    _campaigns[campaign_id] = camp
+    _campaigns.move_to_end(campaign_id)
+    while len(_campaigns) > CAMPAIGN_CACHE:
+        _campaigns.popitem(last=False)
 
-        raw_id = _pick(rec, _ID_KEYS)
-        try:
-            uid = int(float(raw_id))
-        except (ValueError, TypeError):
-            continue
 
-        ism = _pick(rec, _ISM_KEYS)
-        fam = _pick(rec, _FAM_KEYS)
-        result.append({
-            "id":       uid,
-            "username": _pick(rec, _UNAME_KEYS).lstrip("@"),
-            "ism":      ism,
-            "familiya": fam,
-            "fullname": f"{ism} {fam}".strip() or "Noma'lum",
-            "telefon":  _pick(rec, _TEL_KEYS),
-            "holati":   _pick(rec, _HOLATI_KEYS),
+async def save_campaign(campaign_id: str, camp: dict) -> None:
+    _camp_cache(campaign_id, camp)
+    if _redis is None:
+        return
+    try:
+        await _redis.set(f"{CAMPAIGN_KEY}:{campaign_id}", _pack_campaign(camp), ex=CAMPAIGN_TTL)
+        await _redis.hset(CAMPAIGN_INDEX, values={
+            campaign_id: f"{int(camp['created'].timestamp())}:{len(camp['recipients'])}"
         })
-    return result
+        # Indeks ham eng so'nggi kampaniya bilan birga eskiradi — eski
+        # yozuvlar list_campaigns ochilmasa ham Redis da abadiy qolmaydi
+        await _redis.expire(CAMPAIGN_INDEX, CAMPAIGN_TTL)
+    except Exception as e:
+        logger.error(f"[PM] Kampaniyani saqlashda xato ({campaign_id}): {e}")
 
 
-async def load_users() -> list[dict]:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _load_users_sync)
+async def get_campaign(campaign_id: str) -> dict | None:
+    camp = _campaigns.get(campaign_id)
+    if camp is None and _redis is not None:
+        try:
+            blob = await _redis.get(f"{CAMPAIGN_KEY}:{campaign_id}")
+        except Exception as e:
+            logger.error(f"[PM] Kampaniyani o'qishda xato ({campaign_id}): {e}")
+            blob = None
+        if blob:
+            camp = _unpack_campaign(blob)
+            _camp_cache(campaign_id, camp)
+    if camp is None:
+        return None
+    if _camp_expired(camp):
+        await delete_campaign(campaign_id)
+        return None
+    _campaigns.move_to_end(campaign_id)
+    return camp
+
+
+async def delete_campaign(campaign_id: str) -> None:
+    _campaigns.pop(campaign_id, None)
+    if _redis is None:
+        return
+    with contextlib.suppress(Exception):
+        await _redis.delete(f"{CAMPAIGN_KEY}:{campaign_id}")
+    with contextlib.suppress(Exception):
+        await _redis.hdel(CAMPAIGN_INDEX, campaign_id)
 
 
-def _search_users(users: list[dict], query: str) -> list[dict]:
-    """Ism, familiya, username, telefon, ID bo'yicha (qism mos kelsa ham) qidiradi."""
-    q = query.strip().lower().lstrip("@")
-    if not q:
-        return []
-    result = []
-    for u in users:
-        haystack = " ".join([
-            str(u["id"]), u["username"].lower(),
-            u["fullname"].lower(), u["telefon"].lower(),
-        ])
-        if q in haystack:
-            result.append(u)
-    return result[:20]
+async def list_campaigns(limit: int = 15) -> list[tuple[str, datetime, int]]:
+    """So'nggi kampaniyalar (yangilari birinchi): [(id, yaratilgan, soni)]."""
+    entries: dict[str, tuple[datetime, int]] = {
+        cid: (c["created"], len(c["recipients"])) for cid, c in _campaigns.items()
+    }
+    if _redis is not None:
+        try:
+            index = await _redis.hgetall(CAMPAIGN_INDEX) or {}
+        except Exception as e:
+            logger.error(f"[PM] Kampaniyalar ro'yxatini o'qishda xato: {e}")
+            index = {}
+        for cid, meta in index.items():
+            ts, _, cnt = str(meta).partition(":")
+            with contextlib.suppress(ValueError):
+                entries.setdefault(cid, (datetime.fromtimestamp(int(ts)), int(cnt)))
+
+    now     = datetime.now()
+    expired = [cid for cid, (created, _) in entries.items()
+               if (now - created).total_seconds() > CAMPAIGN_TTL]
+    for cid in expired:
+        entries.pop(cid)
+        await delete_campaign(cid)
+
+    ordered = sorted(entries.items(), key=lambda kv: kv[1][0], reverse=True)[:limit]
+    return [(cid, created, cnt) for cid, (created, cnt) in ordered]
 
 
-# ── Kampaniyalar (yuborilgan xabarlar) xotirasi ─────────────────────────
-# {campaign_id: {"recipients": {user_id: message_id}, "created": datetime}}
-_campaigns: dict[str, dict] = {}
+async def init_campaigns(redis) -> None:
+    """Redis clientini o'rnatadi (main dan, lock olingandan keyin)."""
+    global _redis
+    _redis = redis
 
 
 # ── FSM ──────────────────────────────────────────────────────────────────
@@ -160,6 +232,7 @@ class PersonalMsgFSM(StatesGroup):
     waiting_contact  = State()   # telefon kontakti kutilmoqda
     waiting_chat_pick = State()  # Telegram chat-picker orqali tanlov kutilmoqda
     waiting_forward  = State()   # forward xabar kutilmoqda
+    waiting_phones   = State()   # telefon raqamlari ro'yxati kutilmoqda
     composing        = State()   # yuboriladigan kontent kutilmoqda
     edit_wait        = State()   # tahrirlash uchun yangi matn kutilmoqda
 
@@ -168,6 +241,20 @@ def _is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
 
+# Yuborilgan xabar turi — tahrirlashda to'g'ri metod darhol tanlanadi
+KIND_TEXT    = "text"      # edit_message_text
+KIND_CAPTION = "caption"   # edit_message_caption (rasm, video, fayl, audio, ovoz, gif)
+KIND_OTHER   = "other"     # stiker, lokatsiya va h.k. — matnni tahrirlab bo'lmaydi
+
+
+def _content_kind(m: Message) -> str:
+    if m.text:
+        return KIND_TEXT
+    if m.photo or m.video or m.document or m.audio or m.voice or m.animation:
+        return KIND_CAPTION
+    return KIND_OTHER
+
+
 def _not_command(m: Message) -> bool:
     """Buyruq (masalan /xabar) bo'lsa False — keyingi handlerlarga o'tkazadi."""
     return not (m.text or "").startswith("/")
@@ -214,6 +301,7 @@ def _contact_choice_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="📱 Telefon kontaktidan",      callback_data="pm_contact_phone")],
         [InlineKeyboardButton(text="💬 Shaxsiy chatlaringizdan",  callback_data="pm_contact_chat")],
         [InlineKeyboardButton(text="📋 Bizning ro'yxatdan",        callback_data="pm_contact_db")],
+        [InlineKeyboardButton(text="📞 Raqamlar ro'yxatidan",      callback_data="pm_phones")],
         [InlineKeyboardButton(text="⬅️ Orqaga",                    callback_data="pm_back_menu")],
     ])
 
@@ -320,13 +408,13 @@ async def cmd_xabar(message: Message, state: FSMContext):
 async def cmd_xabarlarim(message: Message):
     if not _is_admin(message.from_user.id):
         return
-    if not _campaigns:
+    campaigns = await list_campaigns(15)
+    if not campaigns:
         await message.answer("📭 Hozircha yuborilgan kampaniyalar yo'q.")
         return
     rows = []
-    for cid, camp in list(_campaigns.items())[-15:][::-1]:
-        cnt = len(camp["recipients"])
-        ts  = camp["created"].strftime("%d.%m %H:%M")
+    for cid, created, cnt in campaigns:
+        ts = created.strftime("%d.%m %H:%M")
         rows.append([InlineKeyboardButton(
             text=f"🕐 {ts} — {cnt} kishi", callback_data=f"pmc_info_{cid}"
         )])
@@ -393,8 +481,8 @@ async def pm_search_btn(call: CallbackQuery, state: FSMContext):
 
 @router.message(PersonalMsgFSM.search, F.func(_not_command))
 async def pm_search_input(message: Message, state: FSMContext):
-    users   = await load_users()
-    results = _search_users(users, message.text or "")
+    directory = await user_directory.get()
+    results   = directory.search(message.text or "", limit=20)
     if not results:
         await message.answer("❌ Hech kim topilmadi. Boshqa so'z bilan urinib ko'ring:")
         return
@@ -485,12 +573,12 @@ async def pm_contact_received(message: Message, state: FSMContext):
         label = f"{contact.first_name or ''} {contact.last_name or ''}".strip() or str(uid)
     else:
         # Telegram ID mavjud bo'lmasa — telefon raqami orqali bazadan qidiramiz
-        users       = await load_users()
-        phone_clean = re.sub(r"\D", "", contact.phone_number or "")
-        match = next(
-            (u for u in users if phone_clean and re.sub(r"\D", "", u["telefon"]) == phone_clean),
-            None,
-        )
+        # Telegram xalqaro raqamni "+" siz beradi ("79161234567")
+        directory = await user_directory.get()
+        raw       = contact.phone_number or ""
+        match     = directory.find_phone(raw)
+        if not match and raw and not raw.startswith("+"):
+            match = directory.find_phone("+" + raw)
         if not match:
             await message.answer(
                 "❌ Bu kontaktning Telegram ID sini aniqlab bo'lmadi va "
@@ -512,6 +600,69 @@ async def pm_contact_received(message: Message, state: FSMContext):
     )
 
 
+# — 2d) Telefon raqamlari ro'yxatidan (nusxa-ko'chirib yuborish) —
+
+@router.callback_query(F.data == "pm_phones")
+async def pm_phones_btn(call: CallbackQuery, state: FSMContext):
+    if not _is_admin(call.from_user.id):
+        return
+    await call.answer()
+    await state.set_state(PersonalMsgFSM.waiting_phones)
+    await call.message.answer(
+        "📞 Telefon raqamlarini yuboring — har qanday ko'rinishda, vergul yoki "
+        "yangi qator bilan ajratib:\n\n"
+        "<code>+998 90 123 45 67\n901234567, 8 93 765-43-21</code>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🚫 Bekor qilish", callback_data="pm_cancel")],
+        ]),
+        parse_mode="HTML",
+    )
+
+
+@router.message(PersonalMsgFSM.waiting_phones, F.text, F.func(_not_command))
+async def pm_phones_received(message: Message, state: FSMContext):
+    phones, unparsed = user_directory.extract_phones(message.text)
+    if not phones:
+        text = "⚠️ Telefon raqami topilmadi. Qaytadan yuboring:"
+        if unparsed:
+            text += "\n\n❓ Tanilmadi:\n<code>" + "\n".join(unparsed[:20]) + "</code>"
+        await message.answer(text, parse_mode="HTML")
+        return
+
+    directory      = await user_directory.get()
+    found, missing = directory.resolve_phones(phones)
+
+    data       = await state.get_data()
+    recipients = data.get("recipients", [])
+    existing   = {r["id"] for r in recipients}
+    added      = 0
+    for u in found:
+        if u["id"] in existing:
+            continue
+        label = u["fullname"] + (f" (@{u['username']})" if u["username"] else "")
+        recipients.append({"id": u["id"], "label": label})
+        existing.add(u["id"])
+        added += 1
+
+    await state.update_data(recipients=recipients)
+    await state.set_state(None)
+
+    text = f"✅ {len(phones)} ta raqamdan {len(found)} tasi topildi, {added} kishi qo'shildi."
+    if missing:
+        shown = "\n".join(missing[:20])
+        more  = f"\n… va yana {len(missing) - 20} ta" if len(missing) > 20 else ""
+        text += f"\n\n❌ Bazada yo'q ({len(missing)}):\n<code>{shown}</code>{more}"
+    if unparsed:
+        shown = "\n".join(unparsed[:20])
+        more  = f"\n… va yana {len(unparsed) - 20} ta" if len(unparsed) > 20 else ""
+        text += f"\n\n❓ Raqam sifatida tanilmadi ({len(unparsed)}):\n<code>{shown}</code>{more}"
+    await message.answer(text, parse_mode="HTML")
+    await message.answer(
+        f"📨 <b>Shaxsiy xabar yuborish</b>\n\nTanlangan: {len(recipients)} kishi",
+        reply_markup=_menu_kb(recipients), parse_mode="HTML",
+    )
+
+
 # — 2c) Telegramning o'z chat/kontakt ro'yxatidan (telefon kitobiga bog'liq emas) —
 
 @router.callback_query(F.data == "pm_contact_chat")
@@ -588,14 +739,14 @@ async def pm_contact_db(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
     await call.answer("⏳ Yuklanmoqda...")
-    users = await load_users()
+    snap_id, users = await _user_snapshot()
     if not users:
         with contextlib.suppress(Exception):
             await call.message.edit_text(
                 "❌ Bazada foydalanuvchi topilmadi.", reply_markup=_contact_choice_kb()
             )
         return
-    await state.update_data(db_users=users, db_page=0, db_picked=[])
+    await state.update_data(db_snap=snap_id, db_page=0, db_picked=[])
     with contextlib.suppress(Exception):
         await call.message.edit_text(
             f"📋 <b>Ro'yxatdan tanlang</b> ({len(users)} kishi):",
@@ -603,13 +754,32 @@ async def pm_contact_db(call: CallbackQuery, state: FSMContext):
         )
 
 
+async def _db_snapshot(call: CallbackQuery, state: FSMContext) -> list[dict] | None:
+    """Picker snapshotini qaytaradi; u xotiradan chiqib ketgan bo'lsa ro'yxat qayta ochiladi."""
+    data  = await state.get_data()
+    users = _snapshots.get(str(data.get("db_snap", "")))
+    if users is not None:
+        return users
+    await call.answer("♻️ Ro'yxat yangilandi, qaytadan tanlang", show_alert=True)
+    snap_id, users = await _user_snapshot()
+    await state.update_data(db_snap=snap_id, db_page=0, db_picked=[])
+    with contextlib.suppress(Exception):
+        await call.message.edit_text(
+            f"📋 <b>Ro'yxatdan tanlang</b> ({len(users)} kishi):",
+            reply_markup=_paginate_kb(users, 0, set()), parse_mode="HTML",
+        )
+    return None
+
+
 @router.callback_query(F.data.startswith("pm_db_page_"))
 async def pm_db_page(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
+    users = await _db_snapshot(call, state)
+    if users is None:
+        return
     page   = int(call.data.split("_")[-1])
     data   = await state.get_data()
-    users  = data.get("db_users", [])
     picked = set(data.get("db_picked", []))
     await state.update_data(db_page=page)
     await call.answer()
@@ -621,13 +791,15 @@ async def pm_db_page(call: CallbackQuery, state: FSMContext):
 async def pm_db_pick(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
+    users = await _db_snapshot(call, state)
+    if users is None:
+        return
     idx    = int(call.data.split("_")[-1])
     data   = await state.get_data()
-    users  = data.get("db_users", [])
     page   = data.get("db_page", 0)
     picked = set(data.get("db_picked", []))
     picked.symmetric_difference_update({idx})
-    await state.update_data(db_picked=list(picked))
+    await state.update_data(db_picked=sorted(picked))
     await call.answer()
     with contextlib.suppress(Exception):
         await call.message.edit_reply_markup(reply_markup=_paginate_kb(users, page, picked))
@@ -637,14 +809,18 @@ async def pm_db_pick(call: CallbackQuery, state: FSMContext):
 async def pm_db_done(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
+    users = await _db_snapshot(call, state)
+    if users is None:
+        return
     data       = await state.get_data()
-    users      = data.get("db_users", [])
     picked     = set(data.get("db_picked", []))
     recipients = data.get("recipients", [])
     existing   = {r["id"] for r in recipients}
 
     added = 0
-    for i in picked:
+    for i in sorted(picked):
+        if not 0 <= i < len(users):
+            continue
         u = users[i]
         if u["id"] not in existing:
             label = u["fullname"] + (f" (@{u['username']})" if u["username"] else "")
@@ -652,7 +828,7 @@ async def pm_db_done(call: CallbackQuery, state: FSMContext):
             existing.add(u["id"])
             added += 1
 
-    await state.update_data(recipients=recipients, db_users=[], db_picked=[], db_page=0)
+    await state.update_data(recipients=recipients, db_snap="", db_picked=[], db_page=0)
     await call.answer(f"✅ {added} kishi qo'shildi")
     await call.message.edit_text(
         f"📨 <b>Shaxsiy xabar yuborish</b>\n\nTanlangan: {len(recipients)} kishi",
@@ -751,7 +927,11 @@ async def pm_receive_draft(message: Message, state: FSMContext):
     copy_message() barcha turlarni universal ko'chiradi, shuning uchun
     content_type bo'yicha alohida ishlov berish shart emas.
     """
-    await state.update_data(draft_chat_id=message.chat.id, draft_message_id=message.message_id)
+    await state.update_data(
+        draft_chat_id=message.chat.id,
+        draft_message_id=message.message_id,
+        draft_kind=_content_kind(message),
+    )
     await message.reply(
         "👆 Xabar shu ko'rinishda yuboriladi. Tasdiqlaysizmi?",
         reply_markup=_confirm_kb(),
@@ -767,6 +947,14 @@ async def pm_edit_draft(call: CallbackQuery, state: FSMContext):
     await call.message.answer("✏️ Yangi xabarni yuboring:")
 
 
+def _progress_editor(msg: Message, title: str):
+    """fan_out uchun progress callback — holat xabarini yangilab turadi."""
+    async def on_progress(done: int, total: int, stats: dict[str, int]) -> None:
+        with contextlib.suppress(Exception):
+            await msg.edit_text(f"⏳ {title}... {done} / {total}")
+    return on_progress
+
+
 # ── Yuborish ──────────────────────────────────────────────────────────────
 
 @router.callback_query(F.data == "pm_send")
@@ -787,24 +975,34 @@ async def pm_send(call: CallbackQuery, state: FSMContext, bot: Bot):
         return
 
     sent_map: dict[int, int] = {}
-    ok, fail = 0, 0
-    for r in recipients:
-        try:
-            sent = await bot.copy_message(
-                chat_id=r["id"], from_chat_id=draft_chat_id, message_id=draft_message_id,
-            )
-            sent_map[r["id"]] = sent.message_id
-            ok += 1
-        except Exception as e:
-            fail += 1
-            logger.warning(f"Xabar yuborilmadi ({r['id']}): {e}")
+    throttle = get_throttle()
+
+    async def send_one(uid: int) -> None:
+        sent = await throttle.call(uid, lambda: bot.copy_message(
+            chat_id=uid, from_chat_id=draft_chat_id, message_id=draft_message_id,
+        ))
+        sent_map[uid] = sent.message_id
+
+    def on_result(uid: int, outcome: str) -> None:
+        if outcome != OK:
+            logger.warning(f"Xabar yuborilmadi ({uid}): {outcome}")
+
+    user_ids = list(dict.fromkeys(r["id"] for r in recipients))
+    stats    = await fan_out(
+        user_ids, send_one,
+        on_result=on_result,
+        on_progress=_progress_editor(call.message, "📨 Yuborilmoqda"),
+        progress_every=1.5,
+    )
+    ok, fail = stats[OK], len(user_ids) - stats[OK]
 
     campaign_id = secrets.token_hex(4)
-    _campaigns[campaign_id] = {
+    await save_campaign(campaign_id, {
         "admin_id":   call.from_user.id,
+        "kind":       data.get("draft_kind"),
         "recipients": sent_map,
         "created":    datetime.now(),
-    }
+    })
 
     with contextlib.suppress(Exception):
         await call.message.edit_text(
@@ -824,9 +1022,9 @@ async def pmc_info(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
     campaign_id = call.data.split("_", 2)[2]
-    camp = _campaigns.get(campaign_id)
+    camp = await get_campaign(campaign_id)
     if not camp:
-        await call.answer("❌ Topilmadi (bot qayta ishga tushgandan keyin xotira tozalanadi)", show_alert=True)
+        await call.answer("❌ Topilmadi (48 soatdan eski kampaniyalar o'chiriladi)", show_alert=True)
         return
     await state.clear()  # agar tahrirlash o'rtasida "Orqaga" bosilgan bo'lsa ham holat tozalanadi
     await call.answer()
@@ -843,24 +1041,25 @@ async def pmc_delete(call: CallbackQuery, bot: Bot):
     if not _is_admin(call.from_user.id):
         return
     campaign_id = call.data.split("_", 2)[2]
-    camp = _campaigns.get(campaign_id)
+    camp = await get_campaign(campaign_id)
     if not camp:
         await call.answer("❌ Topilmadi (eski bo'lishi mumkin)", show_alert=True)
         return
     await call.answer("⏳ O'chirilmoqda...")
+    throttle = get_throttle()
+    messages = camp["recipients"]
 
-    ok, fail = 0, 0
-    for uid, mid in camp["recipients"].items():
-        try:
-            await bot.delete_message(uid, mid)
-            ok += 1
-        except Exception as e:
-            fail += 1
-            logger.warning(f"O'chirishda xato ({uid}): {e}")
+    async def delete_one(uid: int) -> None:
+        await throttle.call(uid, lambda: bot.delete_message(uid, messages[uid]))
+
+    stats = await fan_out(
+        list(messages), delete_one, on_progress=_progress_editor(call.message, "🗑 O'chirilmoqda"),
+    )
+    ok, fail = stats[OK], len(messages) - stats[OK]
 
     with contextlib.suppress(Exception):
         await call.message.edit_text(f"🗑 O'chirildi: {ok} ta, xato: {fail} ta")
-    del _campaigns[campaign_id]
+    await delete_campaign(campaign_id)
 
 
 @router.callback_query(F.data.startswith("pmc_edit_"))
@@ -868,7 +1067,7 @@ async def pmc_edit_start(call: CallbackQuery, state: FSMContext):
     if not _is_admin(call.from_user.id):
         return
     campaign_id = call.data.split("_", 2)[2]
-    if campaign_id not in _campaigns:
+    if await get_campaign(campaign_id) is None:
         await call.answer("❌ Topilmadi", show_alert=True)
         return
     await call.answer()
@@ -892,26 +1091,48 @@ async def pmc_edit_start(call: CallbackQuery, state: FSMContext):
 async def pmc_edit_apply(message: Message, state: FSMContext, bot: Bot):
     data        = await state.get_data()
     campaign_id = data.get("edit_campaign_id")
-    camp        = _campaigns.get(campaign_id)
+    camp        = await get_campaign(campaign_id) if campaign_id else None
     if not camp:
         await message.answer("❌ Kampaniya topilmadi (eski bo'lishi mumkin).")
         await state.clear()
         return
 
-    ok, fail = 0, 0
-    for uid, mid in camp["recipients"].items():
+    kind = camp.get("kind")
+    if kind == KIND_OTHER:
+        await message.answer("⚠️ Bu turdagi xabarni tahrirlab bo'lmaydi — o'chirib, qaytadan yuboring.")
+        await state.clear()
+        return
+
+    throttle = get_throttle()
+    messages = camp["recipients"]
+    text     = message.text
+
+    async def edit(uid: int, as_caption: bool) -> None:
+        mid = messages[uid]
         try:
-            await bot.edit_message_text(message.text, chat_id=uid, message_id=mid)
-            ok += 1
-            continue
-        except Exception:
-            pass
+            if as_caption:
+                await throttle.call(uid, lambda: bot.edit_message_caption(chat_id=uid, message_id=mid, caption=text))
+            else:
+                await throttle.call(uid, lambda: bot.edit_message_text(text, chat_id=uid, message_id=mid))
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                raise
+
+    async def edit_one(uid: int) -> None:
+        if kind is not None:
+            await edit(uid, as_caption=(kind == KIND_CAPTION))
+            return
+        # Turi yozilmagan eski kampaniya — avval matn, keyin izoh
         try:
-            await bot.edit_message_caption(chat_id=uid, message_id=mid, caption=message.text)
-            ok += 1
-        except Exception as e:
-            fail += 1
-            logger.warning(f"Tahrirlashda xato ({uid}): {e}")
+            await edit(uid, as_caption=False)
+        except TelegramBadRequest:
+            await edit(uid, as_caption=True)
+
+    status = await message.answer("⏳ Tahrirlanmoqda...")
+    stats  = await fan_out(list(messages), edit_one, on_progress=_progress_editor(status, "✏️ Tahrirlanmoqda"))
+    ok, fail = stats[OK], len(messages) - stats[OK]
+    with contextlib.suppress(Exception):
+        await status.delete()
 
     await message.answer(f"✏️ Tahrirlandi: {ok} ta, xato: {fail} ta")
     await state.clear()
@@ -0,0 +1,154 @@
+"""
+FSM holatlarini Upstash Redis da saqlovchi storage.
+
+MemoryStorage har redeploy va lock almashinuvida barcha ko'p bosqichli
+oqimlarni (ScoringFSM, CalcFSM, KreditFSM, BroadcastFSM, PersonalMsgFSM,
+IshFSM) yo'qotardi. Bu storage ularni Redis da saqlaydi.
+
+Upstash REST orqali ishlaydi — har bir so'rov HTTP chaqiruv. Shu sabab:
+  • holat va ma'lumot BITTA kalitda saqlanadi: o'qish = 1 ta GET,
+    yozish = 1 ta SET (pipeline o'rniga)
+  • jarayon ichidagi keshda saqlanadi — bir vaqtda faqat bitta instance
+    polling qiladi (Upstash lock), shuning uchun kesh ishonchli; Redis
+    faqat keshda yo'q kalit uchun o'qiladi (restart dan keyin)
+  • bitta update davomidagi bir nechta yozuv (masalan state.clear() =
+    set_state + set_data) bitta SET ga birlashtiriladi
+  • har yozuvda TTL yangilanadi — tashlab ketilgan holatlar o'zi o'chadi
+  • ma'lumot ixcham JSON, katta bo'lsa zlib bilan siqiladi
+"""
+from __future__ import annotations
+
+import json
+import zlib
+import base64
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from upstash_redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+STATE_TTL      = 24 * 60 * 60   # soniya — shundan keyin tashlab ketilgan holat o'chadi
+CACHE_SIZE     = 5000           # jarayon ichida saqlanadigan kalitlar soni
+COMPRESS_FROM  = 512            # baytdan katta ma'lumot siqiladi
+_ZLIB_PREFIX   = "z:"
+
+
+def _encode(state: str | None, data: dict[str, Any]) -> str:
+    raw = json.dumps({"s": state, "d": data}, ensure_ascii=False, separators=(",", ":"))
+    if len(raw) < COMPRESS_FROM:
+        return raw
+    packed = base64.b64encode(zlib.compress(raw.encode("utf-8"), 6)).decode("ascii")
+    return _ZLIB_PREFIX + packed
+
+
+def _decode(raw: str | None) -> tuple[str | None, dict[str, Any]]:
+    if not raw:
+        return None, {}
+    if raw.startswith(_ZLIB_PREFIX):
+        raw = zlib.decompress(base64.b64decode(raw[len(_ZLIB_PREFIX):])).decode("utf-8")
+    obj = json.loads(raw)
+    return obj.get("s"), obj.get("d") or {}
+
+
+class UpstashStorage(BaseStorage):
+    """aiogram FSM storage — Upstash Redis + jarayon ichidagi kesh."""
+
+    def __init__(
+        self,
+        redis: Redis,
+        key_builder: KeyBuilder | None = None,
+        state_ttl: int = STATE_TTL,
+        cache_size: int = CACHE_SIZE,
+    ) -> None:
+        self.redis       = redis
+        self.key_builder = key_builder or DefaultKeyBuilder(prefix="fortuna:fsm")
+        self.state_ttl   = state_ttl
+        self.cache_size  = cache_size
+        # {redis kalit: (state, data)}
+        self._cache:   OrderedDict[str, tuple[str | None, dict[str, Any]]] = OrderedDict()
+        self._dirty:   set[str] = set()
+        self._writers: dict[str, asyncio.Task] = {}
+
+    # ── Kesh ──────────────────────────────────────────────────────────
+
+    async def _load(self, key: StorageKey) -> tuple[str, tuple[str | None, dict[str, Any]]]:
+        rkey = self.key_builder.build(key)
+        rec  = self._cache.get(rkey)
+        if rec is not None:
+            self._cache.move_to_end(rkey)
+            return rkey, rec
+        try:
+            rec = _decode(await self.redis.get(rkey))
+        except Exception as e:
+            logger.warning(f"[FSM] Redis o'qishda xato ({rkey}): {e}")
+            rec = (None, {})
+        self._remember(rkey, rec)
+        return rkey, rec
+
+    def _remember(self, rkey: str, rec: tuple[str | None, dict[str, Any]]) -> None:
+        self._cache[rkey] = rec
+        self._cache.move_to_end(rkey)
+        while len(self._cache) > self.cache_size:
+            old = next(iter(self._cache))
+            if old in self._dirty:
+                break   # yozilmaganlarni chiqarib yubormaymiz
+            self._cache.pop(old)
+
+    # ── Yozish (birlashtirilgan) ──────────────────────────────────────
+
+    def _schedule_write(self, rkey: str) -> None:
+        self._dirty.add(rkey)
+        if rkey not in self._writers:
+            self._writers[rkey] = asyncio.ensure_future(self._writer(rkey))
+
+    async def _writer(self, rkey: str) -> None:
+        """
+        Handler keyingi I/O ga o'tgunicha yig'ilgan o'zgarishlarni
+        bitta SET/DEL bilan yozadi. Bitta kalit uchun yozuvlar ketma-ket.
+        """
+        try:
+            await asyncio.sleep(0)
+            while rkey in self._dirty:
+                self._dirty.discard(rkey)
+                state, data = self._cache.get(rkey, (None, {}))
+                try:
+                    if state is None and not data:
+                        await self.redis.delete(rkey)
+                    else:
+                        await self.redis.set(rkey, _encode(state, data), ex=self.state_ttl)
+                except Exception as e:
+                    logger.warning(f"[FSM] Redis yozishda xato ({rkey}): {e}")
+        finally:
+            self._writers.pop(rkey, None)
+
+    # ── BaseStorage API ───────────────────────────────────────────────
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        rkey, (_, data) = await self._load(key)
+        value = state.state if isinstance(state, State) else state
+        self._remember(rkey, (value, data))
+        self._schedule_write(rkey)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, (state, _) = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        rkey, (state, _) = await self._load(key)
+        self._remember(rkey, (state, dict(data)))
+        self._schedule_write(rkey)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, (_, data) = await self._load(key)
+        return dict(data)
+
+    async def close(self) -> None:
+        """Navbatdagi yozuvlar tugashini kutadi."""
+        writers = list(self._writers.values())
+        if writers:
+            await asyncio.gather(*writers, return_exceptions=True)
@@ -5,20 +5,26 @@ Bot: screenshot hisoblash, reyting, statistika
 """
 
 import os
-import base64
 import json
 import asyncio
 import logging
 import contextlib
 import random
-from datetime import datetime, timedelta
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 import gspread
-from google.oauth2.service_account import Credentials
+
+import sheets
+import screenshot_dedup
+from keyed_lock import KeyedLock
 
 from aiogram import Router, Bot, F
 from aiogram.types import (
@@ -27,7 +33,7 @@ from aiogram.types import (
     CallbackQuery,
 )
 from aiogram.filters import ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER, Command
-from aiogram.exceptions import TelegramForbiddenError
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 
 
 # ─── SOZLAMALAR ───────────────────────────────────────────────────────────────
@@ -37,18 +43,29 @@ logger = logging.getLogger(__name__)
 TZ     = ZoneInfo("Asia/Tashkent")
 
 def now_tz()   -> datetime: return datetime.now(TZ)
-def today_str() -> str:     return now_tz().strftime("%d.%m.%Y")
+
+
+_day_key: tuple[str, float] = ("", 0.0)   # (bugungi "dd.mm.yyyy", keyingi yarim tun epoch)
+
+
+def today_str() -> str:
+    """
+    Bugungi sana "dd.mm.yyyy". Har screenshotda bir necha marta chaqiriladi —
+    shuning uchun satr keshlanadi va faqat yarim tun o'tganda qayta hisoblanadi.
+    """
+    global _day_key
+    if time.time() >= _day_key[1]:
+        now      = now_tz()
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        _day_key = (now.strftime("%d.%m.%Y"), midnight.timestamp())
+    return _day_key[0]
+
 
 GROUP_ID       = int(os.getenv("GROUP_ID", "0"))
 ADMIN_ID       = int(os.getenv("ADMIN_ID", "0"))
 CHANNEL_LINK   = "https://t.me/FORTUNABIZNES_GALLAOROL"
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
 SUBADMIN_SHEET = "sub_adminlar"
 USER_SHEET     = "user"
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive",
-]
 BASE_COLS    = 8   # T/r, Telegram ID, Username, Ism, Familiya, Telefon, Sana, Holati
 DAILY_TARGET = 2   # Kunlik maqsad (screenshot soni)
 
@@ -72,65 +89,32 @@ def percent_bar(pct: int, width: int = 10) -> str:
 
 # ─── SHEETS ULANISH ───────────────────────────────────────────────────────────
 
-_gc: gspread.Client | None = None
-
-
-def _get_gc() -> gspread.Client:
-    """gspread clientini yaratadi. Xato bo'lsa qayta yaratadi."""
-    global _gc
-    if _gc is None:
-        b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
-        if not b64:
-            raise RuntimeError("GOOGLE_CREDENTIALS_B64 topilmadi")
-        info  = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        _gc   = gspread.authorize(creds)
-    return _gc
-
-
 def _reset_gc() -> None:
     """Sheets ulanishini qayta o'rnatadi (token xatolarida)."""
-    global _gc
-    _gc = None
+    sheets.reset()
 
 
 def _ws() -> gspread.Worksheet:
     """sub_adminlar varaqini qaytaradi. Yo'q bo'lsa yaratadi."""
-    sh = _get_gc().open_by_key(SPREADSHEET_ID)
-    try:
-        return sh.worksheet(SUBADMIN_SHEET)
-    except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=SUBADMIN_SHEET, rows="100", cols="50")
-        ws.append_row(["T/r", "Telegram ID", "Username", "Ism",
-                       "Familiya", "Telefon raqami", "Qo'shilgan sana", "Holati"])
-        return ws
+    return sheets.worksheet(
+        SUBADMIN_SHEET,
+        headers=["T/r", "Telegram ID", "Username", "Ism",
+                 "Familiya", "Telefon raqami", "Qo'shilgan sana", "Holati"],
+    )
 
 
 def _user_ws() -> gspread.Worksheet:
     """user varaqini qaytaradi."""
-    return _get_gc().open_by_key(SPREADSHEET_ID).worksheet(USER_SHEET)
+    return sheets.worksheet(USER_SHEET)
 
 
 def _find_row(ws: gspread.Worksheet, user_id: int) -> int | None:
     """
     2-ustunda user_id ni qidiradi. Topsa qator raqamini (1-based) qaytaradi.
-    "588979280", "588979280.0", 588979280 — barcha formatlarni qabul qiladi.
-    Sheets ba'zan integer larni float sifatida saqlashi mumkin.
+    Ustun har safar yuklanmaydi — sheets qator indeksidan foydalaniladi
+    ("588979280.0" kabi float formatlar indeks qurilganda tushuniladi).
     """
-    for i, v in enumerate(ws.col_values(2), start=1):
-        v_str = str(v).strip()
-        if not v_str:
-            continue
-        # To'g'ridan string taqqoslash
-        if v_str == str(user_id):
-            return i
-        # Float format: "588979280.0" → int → taqqoslash
-        try:
-            if int(float(v_str)) == user_id:
-                return i
-        except (ValueError, TypeError):
-            pass
-    return None
+    return sheets.find_row(ws.title, user_id)
 
 
 def _col_letter(n: int) -> str:
@@ -142,10 +126,85 @@ def _col_letter(n: int) -> str:
     return s
 
 
+# ─── SANA SARLAVHALARI INDEKSI ────────────────────────────────────────────────
+# Avval har bir screenshot va har bir hisobot 1-qatorni (row_values(1))
+# qayta yuklardi, statistika esa har safar barcha sarlavhalarni strptime
+# bilan qayta parse qilardi. Endi sarlavhalar bir marta o'qiladi:
+#   cols      — {"dd.mm.yyyy": ustun}   (takror sanada birinchisi)
+#   dates     — parse qilingan sanalar, o'sish tartibida (bisect uchun)
+#   date_cols — dates ga parallel ustun raqamlari
+# Indeks startupda (ensure_today_column) to'ldiriladi, yangi ustun
+# yaratilganda yangilanadi va HEADER_TTL dan keyin qayta o'qiladi — varaq
+# qo'lda o'zgartirilsa ham uzoq eskirmaydi. Sana topilmasa, ustun
+# yaratishdan oldin har doim fresh o'qiladi (dublikat ustun bo'lmasligi uchun).
+
+HEADER_TTL = int(os.getenv("REKLAMA_HEADER_TTL", "600"))   # soniya
+
+_hdr_lock = threading.RLock()   # sheets.run thread pool dan chaqiriladi
+_hdr: dict = {"at": 0.0, "width": 0, "cols": {}, "dates": [], "date_cols": []}
+
+
+def _build_header_index(headers: list) -> dict:
+    """1-qator qiymatlaridan indeks yasaydi."""
+    cols:   dict[str, int]         = {}
+    parsed: list[tuple[date, int]] = []
+    for i, h in enumerate(headers[BASE_COLS:], start=BASE_COLS + 1):
+        h = str(h).strip()
+        if not h or h in cols:
+            continue
+        try:
+            parsed.append((datetime.strptime(h, "%d.%m.%Y").date(), i))
+        except ValueError:
+            continue
+        cols[h] = i
+    parsed.sort()
+    return {
+        "at":        time.monotonic(),
+        "width":     len(headers),
+        "cols":      cols,
+        "dates":     [d for d, _ in parsed],
+        "date_cols": [c for _, c in parsed],
+    }
+
+
+def _header_index(ws: gspread.Worksheet, fresh: bool = False) -> dict:
+    """Sarlavha indeksini qaytaradi; eskirgan bo'lsa 1-qatorni qayta o'qiydi."""
+    global _hdr
+    with _hdr_lock:
+        if fresh or not _hdr["at"] or time.monotonic() - _hdr["at"] > HEADER_TTL:
+            _hdr = _build_header_index(ws.row_values(1))
+        return _hdr
+
+
+def _drop_header_index() -> None:
+    """Sarlavhalar tashqaridan o'zgarganda (tuzatish, tozalash) chaqiriladi."""
+    with _hdr_lock:
+        _hdr["at"] = 0.0
+
+
+def _index_add_column(date_str: str, col: int) -> None:
+    """Yangi yaratilgan sana ustunini indeksga qo'shadi."""
+    with _hdr_lock:
+        _hdr["cols"][date_str] = col
+        _hdr["width"]          = max(_hdr["width"], col)
+        d = datetime.strptime(date_str, "%d.%m.%Y").date()
+        i = bisect_left(_hdr["dates"], d)
+        _hdr["dates"].insert(i, d)
+        _hdr["date_cols"].insert(i, col)
+
+
+def _date_columns(ws: gspread.Worksheet, days: int) -> list[int]:
+    """So'nggi `days` kunlik sana ustunlari (1-based, o'sish tartibida)."""
+    idx    = _header_index(ws)
+    cutoff = (now_tz() - timedelta(days=days - 1)).date()
+    return sorted(idx["date_cols"][bisect_left(idx["dates"], cutoff):])
+
+
 def _get_date_col(ws: gspread.Worksheet, date_str: str) -> int:
     """
     Berilgan sana ustunini topadi yoki yaratadi.
-    Har safar Sheets dan fresh o'qiydi — kesh emas.
+    Avval sarlavha indeksidan qidiradi; topilmasa 1-qatorni fresh o'qiydi
+    va shundan keyingina yangi ustun yaratadi.
 
     MUHIM (format): yangi ustun yaratilganda katak MAJBURIY matn
     formatida ("@") belgilanadi. Aks holda Google Sheets "17.07.2026"
@@ -162,21 +221,33 @@ def _get_date_col(ws: gspread.Worksheet, date_str: str) -> int:
     yaratilmay qoladi. Endi xato aniq ko'rinadi (RuntimeError bilan)
     va logga to'liq sabab bilan yoziladi.
     """
-    headers = ws.row_values(1)
-    for i, h in enumerate(headers):
-        if str(h).strip() == date_str:
-            return i + 1
+    col = _header_index(ws)["cols"].get(date_str)
+    if col:
+        return col
+    with _hdr_lock:
+        return _create_date_col(ws, date_str)
 
-    # Ustun yo'q — yangi ustun yaratamiz
-    new_col = len(headers) + 1
 
-    # Agar varaqning joriy ustun soni yetarli bo'lmasa, avval kengaytiramiz
-    if new_col > ws.col_count:
+def _create_date_col(ws: gspread.Worksheet, date_str: str) -> int:
+    """_get_date_col ning yaratish qismi (_hdr_lock ostida chaqiriladi)."""
+    idx = _header_index(ws, fresh=True)
+    if date_str in idx["cols"]:
+        return idx["cols"][date_str]
+
+    # Ustun yo'q — yangi ustun yaratamiz
+    new_col = idx["width"] + 1
+
+    # Agar varaqning joriy ustun soni yetarli bo'lmasa, avval kengaytiramiz.
+    # ws keshlangan obyekt — uning col_count i ochilgan paytdagi qiymat
+    # (varaq qo'lda kengaytirilgan bo'lishi mumkin), shuning uchun haqiqiy
+    # o'lchamni qayta o'qiymiz va varaqni hech qachon qisqartirmaymiz.
+    actual = ws.spreadsheet.worksheet(ws.title).col_count
+    if new_col > actual:
         try:
-            ws.resize(cols=new_col + 10)  # ehtiyot uchun bir oz zaxira bilan
+            ws.resize(cols=max(actual, new_col + 10))  # ehtiyot uchun bir oz zaxira bilan
         except Exception as e:
             raise RuntimeError(
-                f"Sana ustunini kengaytirib bo'lmadi (col_count={ws.col_count}, "
+                f"Sana ustunini kengaytirib bo'lmadi (col_count={actual}, "
                 f"kerak={new_col}). Ehtimol butun fayl 10 million katak "
                 f"limitiga yetgan — boshqa varaqlardagi keraksiz bo'sh "
                 f"qator/ustunlarni qisqartiring. Asl xato: {e}"
@@ -192,6 +263,7 @@ def _get_date_col(ws: gspread.Worksheet, date_str: str) -> int:
             f"Asl xato: {e}"
         ) from e
 
+    _index_add_column(date_str, new_col)
     return new_col
 
 
@@ -226,6 +298,8 @@ def fix_date_header_formats_sync() -> int:
             sheet.format(cell.address, {"numberFormat": {"type": "TEXT"}})
             sheet.update_cell(1, i, normalized)
             fixed += 1
+    if fixed:
+        _drop_header_index()
     return fixed
 
 
@@ -289,27 +363,108 @@ def _cleanup_duplicate_cols_sync_inner(sheet: gspread.Worksheet) -> int:
 
 def _cleanup_duplicate_cols_sync() -> int:
     """sub_adminlar varaqidagi dublikat ustunlarni tozalaydi."""
-    return _cleanup_duplicate_cols_sync_inner(_ws())
+    removed = _cleanup_duplicate_cols_sync_inner(_ws())
+    if removed:
+        _drop_header_index()
+        _stats_cache.clear()
+        _drop_day_snapshot()
+    return removed
 
 
 # ─── LOCAL KESH ───────────────────────────────────────────────────────────────
-# Kesh faqat tezlik uchun. Bot restart bo'lsa tozalanadi.
-# Asosiy manba doim Sheets hisoblanadi.
+# Kesh faqat tezlik uchun, asosiy manba doim Sheets hisoblanadi.
+#
+# Bugungi hisoblar, ko'rilgan fayllar va oxirgi bot javoblari bitta kunlik
+# bo'limda (_day) turadi. Kun almashganda bo'lim bitta almashtirish bilan
+# tashlanadi — eski foydalanuvchilar xotirada to'planib qolmaydi. Redis
+# berilgan bo'lsa bo'lim u yerda ham saqlanadi (DAY_TTL bilan) va
+# init_counter da tiklanadi: deploydan keyin dublikatlar qayta qabul
+# qilinmaydi va birinchi screenshot Sheets ni o'qishni kutmaydi.
+# Redis ga yozuvlar yig'ilib, DAY_FLUSH_DELAY dan keyin bitta hset bilan ketadi.
+
+DAY_KEY         = "fortuna:reklama:day:{day}:{kind}"   # kind: counts | seen | replies
+DAY_TTL         = 36 * 3600
+DAY_FLUSH_DELAY = 1.0   # soniya
+_DAY_KINDS      = ("counts", "seen", "replies")
+
+_day: dict = {"day": "", "counts": {}, "seen": {}, "replies": {}}
+#   counts:  {user_id: N}
+#   seen:    {user_id: {file_unique_id, ...}}
+#   replies: {user_id: message_id} — oxirgi bot javobi
+_day_dirty: dict[str, dict[str, str]] = {}   # {kind: {field: value}} — Redis ga yozilmagan
+_day_task:  asyncio.Task | None       = None
+
+# Per-user lock lar (race condition uchun) — faqat ishlatilayotgan paytda mavjud
+_user_locks = KeyedLock("reklama.screenshot")
+_reg_locks  = KeyedLock("reklama.register")
+
+
+def _day_part() -> dict:
+    """Bugungi bo'lim. Kun almashgan bo'lsa eskisini tashlaydi."""
+    global _day, _day_dirty
+    today = today_str()
+    if _day["day"] != today:
+        _day       = {"day": today, "counts": {}, "seen": {}, "replies": {}}
+        _day_dirty = {}
+    return _day
+
+
+def _day_persist(kind: str, field: str, value) -> None:
+    """Bo'lim o'zgarishini Redis navbatiga qo'shadi."""
+    global _day_task
+    if _redis is None:
+        return
+    _day_dirty.setdefault(kind, {})[field] = str(value)
+    if _day_task is None or _day_task.done():
+        _day_task = asyncio.ensure_future(_day_flush_later(_day["day"]))
+
+
+async def _day_flush_later(day: str) -> None:
+    await asyncio.sleep(DAY_FLUSH_DELAY)
+    await _day_flush(day)
 
-_local_counts: dict[int, dict]   = {}   # {user_id: {"date": "dd.mm.yyyy", "count": N}}
-_seen_files:   dict[int, dict]   = {}   # {user_id: {"date": ..., "files": set()}}
-_user_locks:   dict[int, asyncio.Lock] = {}   # Per-user lock (race condition uchun)
-_last_reply_msgs: dict[int, int] = {}   # {user_id: message_id} — oxirgi bot javob
 
-_registering: set[int] = set()
-_reg_lock     = asyncio.Lock()
+async def _day_flush(day: str) -> None:
+    """Yig'ilgan o'zgarishlarni yozadi: har bir tur uchun bitta hset."""
+    global _day_dirty
+    if _redis is None or not _day_dirty or day != _day["day"]:
+        return
+    dirty, _day_dirty = _day_dirty, {}
+    for kind, values in dirty.items():
+        key = DAY_KEY.format(day=day, kind=kind)
+        try:
+            await _redis.hset(key, values=values)
+            await _redis.expire(key, DAY_TTL)
+        except Exception as e:
+            logger.warning(f"[REDIS] kunlik kesh ({kind}) yozishda xato: {e}")
 
 
-def _get_user_lock(user_id: int) -> asyncio.Lock:
-    """Har bir user uchun alohida asyncio.Lock qaytaradi."""
-    if user_id not in _user_locks:
-        _user_locks[user_id] = asyncio.Lock()
-    return _user_locks[user_id]
+async def _day_load() -> None:
+    """Bugungi bo'limni Redis dan tiklaydi (init_counter dan)."""
+    part = _day_part()
+    for kind in _DAY_KINDS:
+        try:
+            saved = await _redis.hgetall(DAY_KEY.format(day=part["day"], kind=kind)) or {}
+        except Exception as e:
+            logger.warning(f"[REDIS] kunlik kesh ({kind}) o'qishda xato: {e}")
+            continue
+        for field, val in saved.items():
+            try:
+                if kind == "seen":
+                    uid, file_uid = str(field).split(":", 1)
+                    part["seen"].setdefault(int(uid), set()).add(file_uid)
+                elif kind == "counts":
+                    uid = int(field)
+                    part["counts"][uid] = max(part["counts"].get(uid, 0), int(val))
+                else:
+                    # Tiklash paytida yuborilgan yangi javob ustun
+                    part["replies"].setdefault(int(field), int(val))
+            except (ValueError, TypeError):
+                continue
+    logger.info(
+        f"[REDIS] Kunlik kesh tiklandi: {len(part['counts'])} hisob, "
+        f"{sum(len(v) for v in part['seen'].values())} fayl"
+    )
 
 
 def _local_get(user_id: int) -> int:
@@ -317,44 +472,45 @@ def _local_get(user_id: int) -> int:
     Bugungi kesh qiymatini qaytaradi.
     -1 = keshda yo'q, Sheets dan o'qish kerak.
     """
-    data = _local_counts.get(user_id)
-    if data and data.get("date") == today_str():
-        return data.get("count", 0)
-    return -1
+    return _day_part()["counts"].get(user_id, -1)
 
 
 def _local_set(user_id: int, count: int) -> None:
     """Bugungi kesh qiymatini saqlaydi."""
-    _local_counts[user_id] = {"date": today_str(), "count": count}
+    _day_part()["counts"][user_id] = count
+    _day_persist("counts", str(user_id), count)
 
 
 def _is_duplicate(user_id: int, file_unique_id: str) -> bool:
     """Bugun shu fayl yuborilgan-yuborilmaganini tekshiradi."""
-    today = today_str()
-    rec   = _seen_files.get(user_id)
-    if rec is None or rec.get("date") != today:
-        _seen_files[user_id] = {"date": today, "files": set()}
-    return file_unique_id in _seen_files[user_id]["files"]
+    return file_unique_id in _day_part()["seen"].get(user_id, ())
 
 
 def _mark_seen(user_id: int, file_unique_id: str) -> None:
     """Faylni ko'rilgan deb belgilaydi."""
-    today = today_str()
-    rec   = _seen_files.get(user_id)
-    if rec is None or rec.get("date") != today:
-        _seen_files[user_id] = {"date": today, "files": set()}
-    _seen_files[user_id]["files"].add(file_unique_id)
+    _day_part()["seen"].setdefault(user_id, set()).add(file_unique_id)
+    _day_persist("seen", f"{user_id}:{file_unique_id}", 1)
+
+
+def _last_reply(user_id: int) -> int | None:
+    """Foydalanuvchiga bugun yuborilgan oxirgi bot javobi (message_id)."""
+    return _day_part()["replies"].get(user_id)
+
+
+def _set_last_reply(user_id: int, message_id: int) -> None:
+    _day_part()["replies"][user_id] = message_id
+    _day_persist("replies", str(user_id), message_id)
 
 
-def _increment_sheet_sync(user_id: int) -> int:
+def _read_count_sync(user_id: int, date_str: str) -> int:
     """
-    Sheets dan bugungi qiymatni o'qiydi, +1 qo'shib yozadi.
-    Yangi qiymatni qaytaradi. Xato bo'lsa 0 qaytaradi.
-    Ulanish xatosida _gc ni qayta o'rnatadi.
+    Sheets dan berilgan kundagi qiymatni o'qiydi (keshni to'ldirish uchun).
+    Foydalanuvchi topilmasa 0, xato bo'lsa -1 qaytaradi.
+    Ulanish xatosida Sheets ulanishini qayta o'rnatadi.
     """
     try:
         sheet    = _ws()
-        date_col = _get_date_col(sheet, today_str())
+        date_col = _get_date_col(sheet, date_str)
         row      = _find_row(sheet, user_id)
         if not row:
             # Foydalanuvchi sub_adminlar da yo'q — jiddiy xato
@@ -363,16 +519,331 @@ def _increment_sheet_sync(user_id: int) -> int:
                 f"Screenshot hisoblanmadi. /start_register buyrug'ini yuboring."
             )
             return 0
-        val     = sheet.cell(row, date_col).value
-        current = int(val) if val and str(val).strip().isdigit() else 0
-        next_   = current + 1
-        sheet.update_cell(row, date_col, next_)
-        logger.debug(f"[SHEETS] User {user_id}: {today_str()} → {next_}")
-        return next_
+        val = sheet.cell(row, date_col).value
+        return int(val) if val and str(val).strip().isdigit() else 0
     except Exception as e:
-        logger.error(f"[SHEETS] Increment xato (user={user_id}): {e}")
+        logger.error(f"[SHEETS] O'qishda xato (user={user_id}): {e}")
         _reset_gc()   # Keyingi urinishda yangi ulanish
-        return 0
+        return -1
+
+
+# ─── YOZISH NAVBATI (WRITE-BEHIND) ────────────────────────────────────────────
+# handle_media Sheets ga to'g'ridan yozmaydi — faqat shu yerga +1 qo'shadi.
+# Fon vazifasi (flush_counts) har FLUSH_INTERVAL soniyada barcha
+# o'zgarishlarni BITTA batch_update bilan yozadi. Bu yerda absolyut qiymat
+# emas, DELTA saqlanadi: flush paytida katakning joriy qiymati o'qiladi va
+# ustiga qo'shiladi — kesh noto'g'ri bo'lsa ham Sheets dagi son buzilmaydi.
+#
+# Redis berilgan bo'lsa, deltalar u yerda ham saqlanadi — flush dan oldin
+# bot qayta ishga tushsa, hisob yo'qolmaydi.
+#
+# Ikki marta hisoblamaslik uchun:
+#   • Sheets ga yozishdan OLDIN Redis ga flush belgisi (FLUSH_KEY) yoziladi:
+#     har bir katak, uning yozishdan oldingi qiymati (base) va delta.
+#     Jarayon yozish va tozalash orasida o'lsa, init_counter kataklarni
+#     o'qib, yozuv Sheets ga yetib borgan-bormaganini aniqlaydi.
+#   • Yozish xato bersa va natijani tekshirib ham bo'lmasa, reja
+#     _unverified da saqlanadi: keyingi flush avval uni tekshiradi va
+#     shundan keyingina yangi reja tuzadi (FLUSH_KEY ustiga yozmaydi).
+#   • Redis dagi deltalar absolyut qiymat bilan almashtirilmaydi — flush
+#     qilinganlari HINCRBY -delta bilan ayiriladi (Lua skriptida, belgi
+#     bilan birga). Flush paytida kelgan _redis_incr lar bilan to'qnashmaydi.
+
+FLUSH_INTERVAL = int(os.getenv("REKLAMA_FLUSH_INTERVAL", "20"))   # soniya
+PENDING_KEY    = "fortuna:reklama:pending"
+FLUSH_KEY      = "fortuna:reklama:flush"
+FLUSH_MARK_TTL = 7 * 24 * 3600
+
+# KEYS: [PENDING_KEY, FLUSH_KEY]; ARGV: [belgi | "", field1, delta1, ...]
+# Belgi berilgan bo'lsa, u Redis dagisi bilan mos kelgandagina ayiriladi
+# (boshqa instansiya allaqachon tiklagan bo'lsa — hech narsa qilinmaydi).
+_SETTLE_LUA = """
+if ARGV[1] ~= '' and redis.call('GET', KEYS[2]) ~= ARGV[1] then return 0 end
+for i = 2, #ARGV, 2 do
+  if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) == 0 then
+    redis.call('HDEL', KEYS[1], ARGV[i])
+  end
+end
+if ARGV[1] ~= '' then redis.call('DEL', KEYS[2]) end
+return 1
+"""
+
+_pending:    dict[tuple[int, str], int] = {}   # {(user_id, "dd.mm.yyyy"): delta}
+_flush_lock  = asyncio.Lock()
+_redis       = None   # upstash_redis.asyncio.Redis | None
+_unsettled: tuple[str, dict[str, int]] | None = None   # Redis da ayirilmay qolgan flush
+# Natijasi noma'lum flush: (belgi, {field: (katak, base, delta)})
+_unverified: tuple[str, dict[str, tuple[str, int, int]]] | None = None
+
+
+def _pending_field(user_id: int, date_str: str) -> str:
+    return f"{user_id}:{date_str}"
+
+
+def _pending_key(field: str) -> tuple[int, str]:
+    uid, date_str = str(field).split(":", 1)
+    return int(uid), date_str
+
+
+def _add_pending(user_id: int, date_str: str, delta: int = 1) -> None:
+    """Yozilmagan hisobga delta qo'shadi (Redis bo'lsa u yerga ham)."""
+    key = (user_id, date_str)
+    _pending[key] = _pending.get(key, 0) + delta
+    if _redis is not None:
+        asyncio.ensure_future(_redis_incr(_pending_field(user_id, date_str), delta))
+
+
+async def _redis_incr(field: str, delta: int) -> None:
+    try:
+        await _redis.hincrby(PENDING_KEY, field, delta)
+    except Exception as e:
+        logger.warning(f"[REDIS] pending yozishda xato: {e}")
+
+
+def _flush_plan_sync(
+    pending: dict[tuple[int, str], int],
+) -> tuple[set[tuple[int, str]], dict[tuple[int, str], tuple[str, int]]]:
+    """
+    Flush rejasi: har bir kalit uchun katak manzili va joriy qiymati
+    (bitta batch_get). Qaytaradi: (varaqda topilmaganlar, {kalit: (katak, base)}).
+    Topilmaganlarni qayta urinishdan foyda yo'q — ular ham "bajarilgan".
+    """
+    sheet     = _ws()
+    missing:   set[tuple[int, str]]       = set()
+    cells:     dict[tuple[int, str], str] = {}
+    date_cols: dict[str, int]             = {}
+
+    for key in pending:
+        user_id, date_str = key
+        row = _find_row(sheet, user_id)
+        if not row:
+            logger.error(f"[SHEETS] User {user_id} sub_adminlar da topilmadi — hisob tashlab yuborildi")
+            missing.add(key)
+            continue
+        if date_str not in date_cols:
+            date_cols[date_str] = _get_date_col(sheet, date_str)
+        cells[key] = f"{_col_letter(date_cols[date_str])}{row}"
+
+    if not cells:
+        return missing, {}
+
+    keys    = list(cells)
+    current = sheet.batch_get([cells[k] for k in keys])
+    plan    = {}
+    for key, rng in zip(keys, current):
+        val       = rng[0][0] if rng and rng[0] else ""
+        plan[key] = (cells[key], int(val) if str(val).strip().isdigit() else 0)
+    return missing, plan
+
+
+def _flush_write_sync(updates: list[dict]) -> None:
+    """Rejadagi yangi qiymatlarni bitta batch_update bilan yozadi."""
+    _ws().batch_update(updates, value_input_option="RAW")
+
+
+def _flush_landed_sync(items: dict) -> set:
+    """
+    Yozuv Sheets ga yetib borganmi: {id: (katak, base)} dan qiymati
+    base dan o'zgargan kataklarning id larini qaytaradi.
+    """
+    ids     = list(items)
+    current = _ws().batch_get([items[i][0] for i in ids])
+    landed  = set()
+    for i, rng in zip(ids, current):
+        val = rng[0][0] if rng and rng[0] else ""
+        if (int(val) if str(val).strip().isdigit() else 0) != items[i][1]:
+            landed.add(i)
+    return landed
+
+
+async def _settle_pending(marker: str, deltas: dict[str, int]) -> bool:
+    """Flush qilingan deltalarni Redis dan ayiradi va belgini o'chiradi."""
+    global _unsettled
+    args = [marker]
+    for field, delta in deltas.items():
+        args += [field, str(delta)]
+    try:
+        await _redis.eval(_SETTLE_LUA, keys=[PENDING_KEY, FLUSH_KEY], args=args)
+    except Exception as e:
+        logger.warning(f"[REDIS] pending tozalashda xato: {e}")
+        _unsettled = (marker, deltas)
+        return False
+    _unsettled = None
+    return True
+
+
+async def flush_counts() -> int:
+    """
+    Yig'ilgan hisoblarni Sheets ga yozadi. Scheduler va bot o'chayotganda
+    chaqiriladi. Yozilgan kataklar sonini qaytaradi.
+    Kunlik keshning Redis navbati ham shu yerda bo'shatiladi.
+    """
+    global _unverified
+    await _day_flush(_day["day"])
+    async with _flush_lock:
+        # Oldingi flush Redis da ayirilmay qolgan bo'lsa — avval uni tugatamiz,
+        # aks holda yangi belgi eskisini yopib qo'yadi
+        if _unsettled is not None and not await _settle_pending(*_unsettled):
+            return 0
+        # Natijasi noma'lum flush bo'lsa — yangi reja (va belgi) faqat
+        # u tekshirilgandan keyin: aks holda delta ikki marta qo'shilardi
+        if _unverified is not None and not await _resolve_unverified():
+            return 0
+        if not _pending:
+            return 0
+        snapshot = dict(_pending)
+        try:
+            missing, plan = await sheets.run(_flush_plan_sync, snapshot)
+        except Exception as e:
+            logger.error(f"[SHEETS] Flush xato ({len(snapshot)} ta): {e}")
+            _reset_gc()
+            return 0
+
+        marker = ""
+        if _redis is not None and plan:
+            marker = json.dumps({
+                "gen":   f"{time.time():.6f}",
+                "items": {_pending_field(*k): [cell, base, snapshot[k]]
+                          for k, (cell, base) in plan.items()},
+            })
+            try:
+                await _redis.set(FLUSH_KEY, marker, ex=FLUSH_MARK_TTL)
+            except Exception as e:
+                # Belgisiz yozmaymiz — restart da deltalar qayta qo'shilardi
+                logger.warning(f"[REDIS] flush belgisini yozib bo'lmadi: {e}")
+                return 0
+
+        written = set(plan)
+        if plan:
+            updates = [{"range": cell, "values": [[base + snapshot[k]]]}
+                       for k, (cell, base) in plan.items()]
+            try:
+                await sheets.run(_flush_write_sync, updates)
+            except Exception as e:
+                logger.error(f"[SHEETS] Flush xato ({len(plan)} ta): {e}")
+                _reset_gc()
+                # Xato javobi yozuv bajarilmaganini anglatmaydi — tekshiramiz
+                try:
+                    written = await sheets.run(_flush_landed_sync, plan)
+                except Exception as e2:
+                    # _pending ga tegmaymiz — keyingi flush (yoki restart da
+                    # init_counter Redis dagi belgi orqali) avval tekshiradi
+                    logger.error(f"[SHEETS] Flush holatini tekshirib bo'lmadi: {e2}")
+                    _unverified = (marker, {_pending_field(*k): (cell, base, snapshot[k])
+                                            for k, (cell, base) in plan.items()})
+                    return 0
+        done = missing | written
+
+        # Snapshot dagi Sheets qiymati endi eskirgan — delta ikki marta qo'shilmasin
+        _drop_day_snapshot()
+        _stats_cache.clear()
+
+        # Flush davomida kelgan yangi screenshotlar navbatda qoladi
+        for key in done:
+            left = _pending.get(key, 0) - snapshot[key]
+            if left > 0:
+                _pending[key] = left
+            else:
+                _pending.pop(key, None)
+
+        if _redis is not None and (done or marker):
+            await _settle_pending(marker, {_pending_field(*k): snapshot[k] for k in done})
+
+        logger.debug(f"[SHEETS] Flush: {len(done)} ta katak yozildi")
+        return len(done)
+
+
+async def _resolve_unverified() -> bool:
+    """
+    Natijasi noma'lum flush ni yakunlaydi: kataklar qayta o'qiladi,
+    Sheets ga yetib borgan deltalar _pending va Redis dan ayiriladi.
+    Tekshirib bo'lmasa False — reja keyingi urinishgacha saqlanadi.
+    """
+    global _unverified
+    marker, items = _unverified
+    try:
+        landed = await sheets.run(
+            _flush_landed_sync, {f: (cell, base) for f, (cell, base, _) in items.items()})
+    except Exception as e:
+        logger.warning(f"[SHEETS] Tugallanmagan flush ni tekshirib bo'lmadi: {e}")
+        _reset_gc()
+        return False
+    _unverified = None
+
+    if landed:
+        _drop_day_snapshot()
+        _stats_cache.clear()
+    for field in landed:
+        key  = _pending_key(field)
+        left = _pending.get(key, 0) - items[field][2]
+        if left > 0:
+            _pending[key] = left
+        else:
+            _pending.pop(key, None)
+
+    if _redis is not None and marker:
+        await _settle_pending(marker, {f: items[f][2] for f in landed})
+    logger.info(f"[SHEETS] Tugallanmagan flush: {len(landed)}/{len(items)} ta katak Sheets da bor edi")
+    return True
+
+
+async def _load_flush_marker() -> None:
+    """
+    Oldingi jarayon Sheets ga yozib, Redis ni tozalashga ulgurmagan
+    flush belgisini _unverified ga oladi (darhol tekshirish uchun).
+    """
+    global _unverified
+    try:
+        marker = await _redis.get(FLUSH_KEY)
+    except Exception as e:
+        logger.warning(f"[REDIS] flush belgisini o'qishda xato: {e}")
+        return
+    if not marker:
+        return
+    if isinstance(marker, bytes):
+        marker = marker.decode()
+    try:
+        items = {f: (cell, int(base), int(delta))
+                 for f, (cell, base, delta) in json.loads(marker)["items"].items()}
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(f"[REDIS] flush belgisi buzilgan: {e}")
+        return
+    _unverified = (marker, items)
+
+
+async def init_counter(redis=None) -> None:
+    """
+    Write-behind hisoblagichni sozlaydi. main.py da lock olingandan
+    keyin chaqiriladi. Redis da qolib ketgan (flush qilinmagan)
+    deltalarni va bugungi kunlik keshni tiklaydi.
+    """
+    global _redis
+    _redis = redis
+    if redis is None:
+        return
+    await _day_load()
+    await _load_flush_marker()
+    try:
+        saved = await redis.hgetall(PENDING_KEY) or {}
+    except Exception as e:
+        logger.warning(f"[REDIS] pending o'qishda xato: {e}")
+        saved = {}
+    for field, val in saved.items():
+        try:
+            key = _pending_key(field)
+            # Manfiy qiymat — ayirish kechikkan _redis_incr dan oldin tushgan
+            if int(val) > 0:
+                _pending[key] = _pending.get(key, 0) + int(val)
+        except (ValueError, TypeError):
+            continue
+    if saved:
+        logger.info(f"[REDIS] {len(saved)} ta yozilmagan hisob tiklandi")
+    # Deltalar yuklangandan keyin: Sheets ga yetib borganlari _pending dan
+    # ham, Redis dan ham ayiriladi. Tekshirib bo'lmasa — flush_counts qayta urinadi
+    if _unverified is not None:
+        async with _flush_lock:
+            if _unverified is not None:
+                await _resolve_unverified()
 
 
 # ─── RO'YXATGA OLISH ──────────────────────────────────────────────────────────
@@ -396,120 +867,225 @@ def _register_sync(user_id: int, full_name: str, username: str) -> bool:
     row         = [str(valid_count + 1), str(user_id), uname, ism, familiya, "", sana, "Faol"]
     while len(row) < len(headers):
         row.append("")
-    sheet.append_row(row, value_input_option="RAW")
+    resp = sheet.append_row(row, value_input_option="RAW")
+    sheets.remember_append(SUBADMIN_SHEET, user_id, resp)
     logger.info(f"Yangi sub_admin: {full_name} ({user_id})")
     return True
 
 
 def _set_status_sync(user_id: int, status: str) -> None:
     """Foydalanuvchi Holati ustunini yangilaydi."""
-    sheet = _ws()
-    row   = _find_row(sheet, user_id)
-    if row:
-        sheet.update_cell(row, 8, status)
+    _ws()   # varaq va sarlavhalar mavjudligini ta'minlaydi
+    sheets.write_column(SUBADMIN_SHEET, 8, {user_id: status})
 
 
 async def register_user(user_id: int, full_name: str, username: str) -> bool:
-    """Foydalanuvchini ro'yxatga oladi (race condition xavfsiz)."""
-    async with _reg_lock:
-        if user_id in _registering:
-            return False
-        _registering.add(user_id)
-    try:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _register_sync, user_id, full_name, username)
-    finally:
-        async with _reg_lock:
-            _registering.discard(user_id)
+    """
+    Foydalanuvchini ro'yxatga oladi (race condition xavfsiz).
+    Shu foydalanuvchi allaqachon ro'yxatga olinayotgan bo'lsa, kutmaydi.
+    """
+    if _reg_locks.locked(user_id):
+        return False
+    async with _reg_locks(user_id):
+        return await sheets.run(_register_sync, user_id, full_name, username)
 
 
 async def set_status(user_id: int, status: str) -> None:
     """Foydalanuvchi statusini yangilaydi."""
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, _set_status_sync, user_id, status)
+    await sheets.run(_set_status_sync, user_id, status)
 
 
-# ─── GURUH HANDLERLARI ────────────────────────────────────────────────────────
+# ─── JAVOBLARNI BIRLASHTIRISH ────────────────────────────────────────────────
+# Avval har bir screenshotga 2 ta API chaqiruv ketardi: oldingi javobni
+# o'chirish + yangi reply. 5 ta rasm ketma-ket kelsa — 10 ta chaqiruv va
+# guruhda shovqin. Endi javob har bir xodim uchun REPLY_DEBOUNCE soniya
+# kutiladi va faqat oxirgi holat yuboriladi. Oldingi javob yaqinda
+# (REPLY_EDIT_WINDOW ichida) yuborilgan bo'lsa, u joyida tahrirlanadi —
+# bitta chaqiruv; aks holda eski o'chirilib, oxirgi rasmga yangi reply.
 
-@router.chat_member(ChatMemberUpdatedFilter(IS_NOT_MEMBER >> IS_MEMBER))
-async def on_join(event: ChatMemberUpdated):
-    """Guruhga yangi a'zo qo'shilganda ro'yxatga oladi."""
-    if event.chat.id != GROUP_ID:
-        return
-    u = event.new_chat_member.user
-    if not u.is_bot:
+REPLY_DEBOUNCE    = float(os.getenv("REKLAMA_REPLY_DEBOUNCE", "1.5"))   # soniya
+REPLY_EDIT_WINDOW = 600                                                  # soniya
+
+_reply_pending: dict[int, tuple[Message, str]] = {}   # {user_id: (oxirgi rasm, matn)}
+_reply_tasks:   dict[int, asyncio.Task]        = {}
+_reply_sent_at: dict[int, float]               = {}   # {user_id: monotonic}
+_reply_locks    = KeyedLock("reklama.reply")
+
+
+def _queue_reply(message: Message, text: str) -> None:
+    """Javobni navbatga qo'yadi; oldingi yuborilmagan javob almashtiriladi."""
+    uid = message.from_user.id
+    _reply_pending[uid] = (message, text)
+    if uid not in _reply_tasks:
+        _reply_tasks[uid] = asyncio.ensure_future(_reply_later(uid))
+
+
+async def _reply_later(uid: int) -> None:
+    try:
+        await asyncio.sleep(REPLY_DEBOUNCE)
+    finally:
+        # Yuborish davomida kelgan rasm yangi debounce boshlaydi
+        _reply_tasks.pop(uid, None)
+    pending = _reply_pending.pop(uid, None)
+    if pending:
+        async with _reply_locks(uid):
+            await _deliver_reply(uid, *pending)
+
+
+async def _deliver_reply(uid: int, message: Message, text: str) -> None:
+    """Oxirgi javobni tahrirlaydi yoki yangisini yuboradi."""
+    prev = _last_reply(uid)
+    if prev and time.monotonic() - _reply_sent_at.get(uid, 0.0) < REPLY_EDIT_WINDOW:
+        try:
+            await message.bot.edit_message_text(
+                text, chat_id=GROUP_ID, message_id=prev,
+                parse_mode="HTML", disable_web_page_preview=True,
+            )
+            return
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return
+        except Exception:
+            pass
+
+    if prev:
         with contextlib.suppress(Exception):
-            await register_user(u.id, u.full_name or "", u.username or "")
+            await message.bot.delete_message(GROUP_ID, prev)
+
+    with contextlib.suppress(Exception):
+        sent = await message.reply(text, parse_mode="HTML", disable_web_page_preview=True)
+        _set_last_reply(uid, sent.message_id)
+        _reply_sent_at[uid] = time.monotonic()
+        if len(_reply_sent_at) > 5000:
+            cutoff = time.monotonic() - REPLY_EDIT_WINDOW
+            for k in [k for k, t in _reply_sent_at.items() if t < cutoff]:
+                del _reply_sent_at[k]
+
+
+# ─── SCREENSHOT QABUL QILISH ──────────────────────────────────────────────────
+# Albom (bir xil media_group_id) yuborilganda Telegram har bir rasmni
+# alohida xabar qilib yuboradi. Avval har biri uchun alohida
+# register_user, lock, hisob va javob bo'lardi — 10 ta rasm = 10 ta
+# yozuv va 10 ta javob. Endi albom ALBUM_WAIT soniya yig'iladi va bitta
+# partiya sifatida qayta ishlanadi: bitta ro'yxatga olish, bitta lock,
+# +N delta va bitta javob.
+
+ALBUM_WAIT = float(os.getenv("REKLAMA_ALBUM_WAIT", "1.0"))   # soniya
+
+_albums: dict[str, list[Message]] = {}   # {media_group_id: [xabarlar]}
+
+
+def _buffer_album(message: Message) -> None:
+    """Albom rasmini yig'adi; birinchisi kelganda qayta ishlash rejalanadi."""
+    key  = message.media_group_id
+    msgs = _albums.get(key)
+    if msgs is None:
+        _albums[key] = [message]
+        asyncio.ensure_future(_flush_album(key))
+    else:
+        msgs.append(message)
 
 
-@router.chat_member(ChatMemberUpdatedFilter(IS_MEMBER >> IS_NOT_MEMBER))
-async def on_leave(event: ChatMemberUpdated):
-    """A'zo guruhdan chiqqanda statusini o'zgartiradi."""
-    if event.chat.id != GROUP_ID:
+async def _flush_album(key: str) -> None:
+    await asyncio.sleep(ALBUM_WAIT)
+    msgs = _albums.pop(key, [])
+    if not msgs:
         return
-    u = event.new_chat_member.user
-    if not u.is_bot:
-        with contextlib.suppress(Exception):
-            await set_status(u.id, "Chiqib ketdi")
+    msgs.sort(key=lambda m: m.message_id)
+    try:
+        await _ingest_screenshots(msgs)
+    except Exception as e:
+        logger.error(f"Albom ({len(msgs)} ta) xato: {e}")
 
 
-@router.message(
-    F.chat.func(lambda c: c.id == GROUP_ID and GROUP_ID != 0),
-    F.photo | F.document,
-)
-async def handle_media(message: Message):
+async def _duplicate_warning(message: Message) -> str | None:
     """
-    Guruhga yuborilgan rasm/hujjatni hisoblaydi.
-    Rasmlar: screenshot sifatida qabul qilinadi.
-    Rasm bo'lmagan hujjatlar: faqat ro'yxatga olinadi.
+    Rasm dublikat bo'lsa ogohlantirish matnini qaytaradi, aks holda
+    uni ko'rilgan deb belgilab None qaytaradi.
     """
-    if message.from_user is None or message.from_user.is_bot:
-        return
+    u = message.from_user
 
-    # Rasm bo'lmagan hujjat — faqat ro'yxatga olamiz
-    if message.document and not (message.document.mime_type or "").startswith("image/"):
-        with contextlib.suppress(Exception):
-            await register_user(
-                message.from_user.id,
-                message.from_user.full_name or "",
-                message.from_user.username or "",
+    # Dublikat tekshiruv
+    file_uid = message.photo[-1].file_unique_id if message.photo else message.document.file_unique_id
+    if _is_duplicate(u.id, file_uid):
+        return "⚠️ <b>Bu rasmni bugun allaqachon yuborgansiz!</b>"
+    _mark_seen(u.id, file_uid)
+
+    # Perceptual-hash tekshiruv — qayta yuklangan yoki boshqa xodimdan
+    # olingan screenshot. Eng kichik o'lcham yetarli; hujjatda thumbnail.
+    if message.photo:
+        hash_file = message.photo[0].file_id
+    else:
+        hash_file = message.document.thumbnail.file_id if message.document.thumbnail else None
+    if hash_file:
+        dup = await screenshot_dedup.find_duplicate(
+            message.bot, hash_file, (u.id, message.message_id), u.id, today_str())
+        if dup is not None:
+            return (
+                "⚠️ <b>Bu screenshot avval yuborilgan!</b>"
+                if dup[0] == u.id else
+                "⚠️ <b>Bu screenshot boshqa xodim tomonidan yuborilgan!</b>"
             )
-        return
+    return None
 
-    u = message.from_user
+
+async def _ingest_screenshots(messages: list[Message]) -> None:
+    """
+    Bitta xodimning bir yoki bir nechta (albom) screenshotini hisoblaydi:
+    dublikatlar chiqarib tashlanadi, qolganlari bitta delta bilan qo'shiladi
+    va bitta javob yuboriladi.
+    """
+    u = messages[0].from_user
     with contextlib.suppress(Exception):
         await register_user(u.id, u.full_name or "", u.username or "")
 
-    # Dublikat tekshiruv
-    file_uid = message.photo[-1].file_unique_id if message.photo else message.document.file_unique_id
-    if _is_duplicate(u.id, file_uid):
+    warnings = await asyncio.gather(*(_duplicate_warning(m) for m in messages))
+    accepted = [m for m, w in zip(messages, warnings) if w is None]
+    rejected = [w for w in warnings if w is not None]
+
+    if not accepted:
+        text = rejected[0] if len(rejected) == 1 else \
+            f"⚠️ <b>Albomdagi {len(rejected)} ta rasm avval yuborilgan!</b>"
         with contextlib.suppress(Exception):
-            await message.reply(
-                "⚠️ <b>Bu rasmni bugun allaqachon yuborgansiz!</b>\n"
-                "Yangi reklama screenshotini yuboring.",
-                parse_mode="HTML",
-            )
+            await messages[0].reply(text + "\nYangi reklama screenshotini yuboring.",
+                                    parse_mode="HTML")
         return
-    _mark_seen(u.id, file_uid)
 
-    # Hisoblash — per-user lock bilan race condition oldini olamiz
-    loop = asyncio.get_running_loop()
-    async with _get_user_lock(u.id):
+    # Hisoblash — per-user lock bilan race condition oldini olamiz.
+    # Sheets ga yozilmaydi — faqat navbatga qo'shiladi (flush_counts yozadi).
+    added = len(accepted)
+    async with _user_locks(u.id):
+        today  = today_str()
         cached = _local_get(u.id)
-        if cached >= 0:
-            # Keshda bor — ustiga +1 qo'shamiz, Sheets ga ham yozamiz
-            count = cached + 1
-            _local_set(u.id, count)
-            await loop.run_in_executor(None, _increment_sheet_sync, u.id)
-        else:
-            # Keshda yo'q — Sheets dan o'qib +1 (increment_sheet qaytaradi)
-            count = await loop.run_in_executor(None, _increment_sheet_sync, u.id)
+        seeded = cached >= 0
+        if not seeded:
+            # Keshda yo'q — Sheets dan bir marta o'qiymiz (navbatdagilar ham hisobda).
+            # flush_counts bilan navbatma-navbat: flush yozgan qiymatga hali
+            # ayirilmagan _pending qo'shilib, kunlik keshda qolib ketmasin
+            async with _flush_lock:
+                from_sheet = await sheets.run(_read_count_sync, u.id, today)
+                seeded     = from_sheet >= 0
+                cached     = max(from_sheet, 0) + _pending.get((u.id, today), 0)
+        count = cached + added
+        _add_pending(u.id, today, added)
+        if seeded:
             _local_set(u.id, count)
 
-    # Javob matni
+    text = _progress_text(u.full_name, count, added)
+    if rejected:
+        text += f"\n⚠️ {len(rejected)} ta rasm dublikat — hisoblanmadi."
+
+    # Javob debounce bilan: ketma-ket rasmlarda faqat oxirgi holat chiqadi
+    _queue_reply(accepted[-1], text)
+
+
+def _progress_text(full_name: str, count: int, added: int = 1) -> str:
+    """Screenshotdan keyingi javob matni."""
     bar   = progress_bar(count, DAILY_TARGET)
     emoji = "📸" if count == 1 else "✅" if count == 2 else "🔥"
-    text  = f"{emoji} <b>{u.full_name}</b>\n{bar} <b>{count}/{DAILY_TARGET}</b>"
+    text  = f"{emoji} <b>{full_name}</b>\n{bar} <b>{count}/{DAILY_TARGET}</b>"
+    if added > 1:
+        text += f"\n📎 Albomdan <b>{added} ta</b> screenshot qabul qilindi."
 
     if count == DAILY_TARGET:
         msg = random.choice([
@@ -545,15 +1121,62 @@ async def handle_media(message: Message):
             f"\n📌 {CHANNEL_LINK}"
         )
 
-    # Avvalgi bot javobini o'chiramiz
-    if u.id in _last_reply_msgs:
+    return text
+
+
+# ─── GURUH HANDLERLARI ────────────────────────────────────────────────────────
+
+@router.chat_member(ChatMemberUpdatedFilter(IS_NOT_MEMBER >> IS_MEMBER))
+async def on_join(event: ChatMemberUpdated):
+    """Guruhga yangi a'zo qo'shilganda ro'yxatga oladi."""
+    if event.chat.id != GROUP_ID:
+        return
+    u = event.new_chat_member.user
+    if not u.is_bot:
         with contextlib.suppress(Exception):
-            await message.bot.delete_message(GROUP_ID, _last_reply_msgs[u.id])
-        del _last_reply_msgs[u.id]
+            await register_user(u.id, u.full_name or "", u.username or "")
 
-    with contextlib.suppress(Exception):
-        sent = await message.reply(text, parse_mode="HTML", disable_web_page_preview=True)
-        _last_reply_msgs[u.id] = sent.message_id
+
+@router.chat_member(ChatMemberUpdatedFilter(IS_MEMBER >> IS_NOT_MEMBER))
+async def on_leave(event: ChatMemberUpdated):
+    """A'zo guruhdan chiqqanda statusini o'zgartiradi."""
+    if event.chat.id != GROUP_ID:
+        return
+    u = event.new_chat_member.user
+    if not u.is_bot:
+        with contextlib.suppress(Exception):
+            await set_status(u.id, "Chiqib ketdi")
+
+
+@router.message(
+    F.chat.func(lambda c: c.id == GROUP_ID and GROUP_ID != 0),
+    F.photo | F.document,
+)
+async def handle_media(message: Message):
+    """
+    Guruhga yuborilgan rasm/hujjatni hisoblaydi.
+    Rasmlar: screenshot sifatida qabul qilinadi.
+    Rasm bo'lmagan hujjatlar: faqat ro'yxatga olinadi.
+    """
+    if message.from_user is None or message.from_user.is_bot:
+        return
+
+    # Rasm bo'lmagan hujjat — faqat ro'yxatga olamiz
+    if message.document and not (message.document.mime_type or "").startswith("image/"):
+        with contextlib.suppress(Exception):
+            await register_user(
+                message.from_user.id,
+                message.from_user.full_name or "",
+                message.from_user.username or "",
+            )
+        return
+
+    # Albom — barcha rasmlar bir marta, birgalikda hisoblanadi
+    if message.media_group_id:
+        _buffer_album(message)
+        return
+
+    await _ingest_screenshots([message])
 
 
 @router.message(
@@ -644,93 +1267,112 @@ async def _send_long(bot: Bot, chat_id: int, text: str) -> None:
 
 # ─── STATISTIKA ───────────────────────────────────────────────────────────────
 
-def _stats_sync(days: int) -> list[dict]:
-    """
-    Sheets dan so'nggi `days` kunlik statistikani hisoblaydi.
+# Hisobot faqat so'nggi `days` kunlik ustunlarga muhtoj. Avval butun varaq
+# (ishga tushgandan beri barcha sana ustunlari) yuklanardi. Endi sarlavha
+# indeksidan kerakli ustunlar aniqlanadi va bitta batch_get bilan faqat B:H hamda shu
+# ustunlar (qo'shni ustunlar bitta diapazonga birlashtiriladi) o'qiladi.
+#
+# Natija (days, bugun) bo'yicha STATS_TTL soniya keshlanadi. Keshda faqat
+# Sheets qiymatlari turadi — bugungi local hisob va yozilmagan deltalar
+# har o'qishda qo'shiladi; flush_counts keshni bekor qiladi.
 
-    MUHIM: bitta get_all_values() ishlatiladi.
-    Avval row_values(1) + _safe_records() alohida chaqirilganda
-    sarlavhalar strip() qilinmagan holda valid_dates ga kirar,
-    lekin rec dict da stripped kalit bo'lardi.
-    Natijada rec.get(d, 0) = 0 — barchada 0 ko'rinardi.
-    """
-    sheet    = _ws()
-    all_vals = sheet.get_all_values()   # BITTA o'qish
-    if len(all_vals) < 2:
-        return []
+STATS_TTL = int(os.getenv("REKLAMA_STATS_TTL", "300"))   # soniya
 
-    # Sarlavhalarni strip() qilamiz — whitespace muammosini oldini olamiz
-    headers = [str(h).strip() for h in all_vals[0]]
+_stats_cache: dict[tuple[int, str], tuple[float, list[dict]]] = {}
 
-    # So'nggi `days` kunlik sana ustunlarini topamiz
-    cutoff = (now_tz() - timedelta(days=days - 1)).replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-    valid_dates = []
-    for h in headers[BASE_COLS:]:
-        if not h:
-            continue
-        try:
-            dt = datetime.strptime(h, "%d.%m.%Y").replace(tzinfo=TZ)
-            if dt >= cutoff:
-                valid_dates.append(h)
-        except ValueError:
-            pass
 
-    today_s = today_str()
-    result  = []
+def _to_int(v) -> int:
+    return int(v) if str(v).strip().isdigit() else 0
 
-    for row in all_vals[1:]:
-        # Bo'sh qatorlarni o'tkazib yuboramiz
-        if not any(str(c).strip() for c in row[:8]):
-            continue
-
-        # Qisqa qatorni sarlavha uzunligiga tenglashtiramiz
-        padded = row + [""] * max(0, len(headers) - len(row))
-
-        # Dict yasaymiz: stripped kalit → qiymat
-        # valid_dates ham stripped — ikkalasi mos keladi
-        rec = {headers[i]: padded[i] for i in range(len(headers)) if headers[i]}
 
-        if str(rec.get("Holati", "")).strip() == "Chiqib ketdi":
-            continue
-        tg_id = str(rec.get("Telegram ID", "")).strip()
-        if not tg_id:
-            continue
-
-        name = (
-            f"{rec.get('Ism', '')} {rec.get('Familiya', '')}".strip()
-            or "Noma'lum"
-        )
+def _col_runs(cols: list[int]) -> list[tuple[int, int]]:
+    """[9, 10, 11, 14] → [(9, 11), (14, 14)] — ketma-ket ustunlar birlashadi."""
+    runs: list[tuple[int, int]] = []
+    for c in cols:
+        if runs and runs[-1][1] == c - 1:
+            runs[-1] = (runs[-1][0], c)
+        else:
+            runs.append((c, c))
+    return runs
 
-        total = 0
-        for d in valid_dates:
-            v          = rec.get(d, "")
-            from_sheet = int(v) if str(v).strip().isdigit() else 0
 
-            # Bugungi kun uchun local cache ni ham hisobga olamiz
-            if d == today_s:
-                try:
-                    from_local = _local_get(int(float(tg_id)))
-                    if from_local > from_sheet:
-                        from_sheet = from_local
-                except (ValueError, TypeError):
-                    pass
+def _stats_sync(days: int) -> list[dict]:
+    """
+    Sheets dan so'nggi `days` kunlik xom statistikani o'qiydi:
+    [{"id", "name", "past", "today"}] — past: bugundan oldingi kunlar
+    yig'indisi, today: bugungi ustundagi qiymat. "Chiqib ketdi" lar
+    tashlab yuboriladi.
+    """
+    sheet     = _ws()
+    cols      = _date_columns(sheet, days)
+    today_col = _header_index(sheet)["cols"].get(today_str())
+    runs      = _col_runs(cols)
 
-            total += from_sheet
+    result = sheet.batch_get(
+        ["B2:H"] + [f"{_col_letter(a)}2:{_col_letter(b)}" for a, b in runs]
+    )
+    ident = result[0] if result else []
+    n     = len(ident)
+    past  = [0] * n
+    today = [0] * n
+
+    # Ustun bo'yicha yig'indi: har bir diapazon bir marta aylanadi
+    for (start, _), values in zip(runs, result[1:]):
+        for i, row in enumerate(values[:n]):
+            for col, v in enumerate(row, start=start):
+                if col == today_col:
+                    today[i] = _to_int(v)
+                else:
+                    past[i] += _to_int(v)
+
+    rows = []
+    for i, row in enumerate(ident):
+        row   = list(row) + [""] * (7 - len(row))
+        tg_id = str(row[0]).strip()
+        if not tg_id or str(row[6]).strip() == "Chiqib ketdi":
+            continue
+        rows.append({
+            "id":    tg_id,
+            "name":  f"{row[2]} {row[3]}".strip() or "Noma'lum",
+            "past":  past[i],
+            "today": today[i],
+        })
+    return rows
 
-        result.append({"id": tg_id, "name": name, "total": total})
 
+async def get_stats(days: int) -> list[dict]:
+    """
+    So'nggi `days` kunlik statistika, jami bo'yicha kamayish tartibida:
+    [{"id", "name", "total"}]. /reklama_stat, reyting va oylik e'lon
+    shu funksiyadan foydalanadi.
+    """
+    today  = today_str()
+    key    = (days, today)
+    cached = _stats_cache.get(key)
+    if cached and time.monotonic() - cached[0] <= STATS_TTL:
+        rows = cached[1]
+    else:
+        # flush_counts bilan navbatma-navbat — flush yozgan qiymat va
+        # hali ayirilmagan _pending ikki marta qo'shilmasin
+        async with _flush_lock:
+            rows = await sheets.run(_stats_sync, days)
+            for k in [k for k in _stats_cache if k[1] != today]:
+                del _stats_cache[k]
+            _stats_cache[key] = (time.monotonic(), rows)
+
+    result = []
+    for r in rows:
+        cnt = r["today"]
+        try:
+            uid = int(float(r["id"]))
+            cnt = max(cnt + _pending.get((uid, today), 0), _local_get(uid))
+        except (ValueError, TypeError):
+            pass
+        result.append({"id": r["id"], "name": r["name"], "total": r["past"] + cnt})
     result.sort(key=lambda x: x["total"], reverse=True)
     return result
 
 
-async def get_stats(days: int) -> list[dict]:
-    """_stats_sync ni async wrapperda ishlatadi."""
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _stats_sync, days)
-
-
 def _stat_text(stats: list[dict], label: str, days: int) -> str:
     """Statistikani progress bar ko'rinishida matn sifatida qaytaradi."""
     if not stats:
@@ -808,9 +1450,8 @@ async def cb_stat(call: CallbackQuery):
 
     if call.data == "stat_rating":
         await call.answer("⏳ Reyting hisoblanmoqda...")
-        loop = asyncio.get_running_loop()
         with contextlib.suppress(Exception):
-            await loop.run_in_executor(None, _cleanup_duplicate_cols_sync)
+            await sheets.run(_cleanup_duplicate_cols_sync)
         try:
             text = await _build_rating_text(30)
             await call.message.edit_text(text, reply_markup=_stat_kb(), parse_mode="HTML")
@@ -820,9 +1461,8 @@ async def cb_stat(call: CallbackQuery):
         return
 
     await call.answer("⏳ Hisoblanmoqda...")
-    loop = asyncio.get_running_loop()
     with contextlib.suppress(Exception):
-        await loop.run_in_executor(None, _cleanup_duplicate_cols_sync)
+        await sheets.run(_cleanup_duplicate_cols_sync)
 
     days_map = {
         "stat_daily":   (1,  "Kunlik"),
@@ -974,23 +1614,117 @@ async def ensure_today_column(bot: Bot | None = None) -> None:
     qolmasligi uchun.
     """
     try:
-        loop = asyncio.get_running_loop()
         def _ensure():
             sheet = _ws()
             _get_date_col(sheet, today_str())
-        await loop.run_in_executor(None, _ensure)
+        await sheets.run(_ensure)
     except Exception as e:
         logger.error(f"ensure_today_column xato: {e}")
-        if bot and ADMIN_ID:
-            with contextlib.suppress(Exception):
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"🚨 <b>Bugungi sana ustunini yaratib bo'lmadi!</b>\n\n"
-                    f"<code>{e}</code>\n\n"
-                    f"<i>Sheets to'liq bo'lib qolgan bo'lishi mumkin — "
-                    f"boshqa varaqlardagi bo'sh qator/ustunlarni tekshiring.</i>",
-                    parse_mode="HTML",
-                )
+        await _alert_column_error(bot, e)
+
+
+async def _alert_column_error(bot: Bot | None, error: Exception | str) -> None:
+    """Sana ustunini yaratib bo'lmaganini ADMIN_ID ga xabar qiladi."""
+    if bot and ADMIN_ID:
+        with contextlib.suppress(Exception):
+            await bot.send_message(
+                ADMIN_ID,
+                f"🚨 <b>Bugungi sana ustunini yaratib bo'lmadi!</b>\n\n"
+                f"<code>{error}</code>\n\n"
+                f"<i>Sheets to'liq bo'lib qolgan bo'lishi mumkin — "
+                f"boshqa varaqlardagi bo'sh qator/ustunlarni tekshiring.</i>",
+                parse_mode="HTML",
+            )
+
+
+# ─── KUNLIK SNAPSHOT ──────────────────────────────────────────────────────────
+# Nazorat hisobotlari (9:30/12:00/15:00/18:00, /reklama_tekshir,
+# /reklama_users) faqat bugungi ustunga muhtoj. Avval har biri butun
+# varaqni (get_all_values) o'qirdi — sana ustunlari har kuni ko'payadi.
+# Endi bitta ranged batch_get: B:H (identifikatsiya) + bugungi ustun.
+# Natija SNAPSHOT_TTL soniya qayta ishlatiladi; flush_counts yozgach
+# bekor qilinadi (aks holda _pending dagi delta ikki marta hisoblanadi).
+
+SNAPSHOT_TTL = int(os.getenv("REKLAMA_SNAPSHOT_TTL", "90"))   # soniya
+
+_day_snapshot: dict | None = None   # {"date", "at", "rows", "error"}
+_snapshot_lock = asyncio.Lock()
+
+
+def _day_snapshot_sync(date_str: str) -> dict:
+    """
+    sub_adminlar dan faqat kerakli ustunlarni o'qiydi.
+    Sana ustunini yaratib bo'lmasa, hisoblar 0 bilan qaytadi va
+    xato matni "error" da bo'ladi.
+    """
+    sheet = _ws()
+    error = None
+    try:
+        letter = _col_letter(_get_date_col(sheet, date_str))
+    except RuntimeError as e:
+        letter, error = None, str(e)
+
+    ranges = ["B2:H"] + ([f"{letter}2:{letter}"] if letter else [])
+    result = sheet.batch_get(ranges)
+    ident  = result[0] if result else []
+    counts = result[1] if len(result) > 1 else []
+
+    rows = []
+    for i, row in enumerate(ident):
+        row   = list(row) + [""] * (7 - len(row))
+        tg_id = str(row[0]).strip()
+        if not tg_id:
+            continue
+        cnt_raw = counts[i][0] if i < len(counts) and counts[i] else ""
+        rows.append({
+            "id":     tg_id,
+            "name":   f"{row[2]} {row[3]}".strip() or "Noma'lum",
+            "holati": str(row[6]).strip(),
+            "sheet":  int(cnt_raw) if str(cnt_raw).strip().isdigit() else 0,
+        })
+    return {"rows": rows, "error": error}
+
+
+async def _today_rows(bot: Bot | None = None) -> list[dict]:
+    """
+    Bugungi faol xodimlar: [{"id", "name", "count"}].
+    count = max(Sheets + yozilmagan delta, local kesh).
+    Sheets xatosi yuqoriga uzatiladi.
+    """
+    global _day_snapshot
+    today = today_str()
+    async with _snapshot_lock:
+        snap = _day_snapshot
+        if (snap is None or snap["date"] != today
+                or time.monotonic() - snap["at"] > SNAPSHOT_TTL):
+            # flush_counts bilan navbatma-navbat: aks holda o'qish flush
+            # yozgan qiymatni ko'rib, hali ayirilmagan _pending ni ham
+            # qo'shardi (yoki eski qiymat flush dan keyin keshda qolardi)
+            async with _flush_lock:
+                snap = await sheets.run(_day_snapshot_sync, today)
+                snap.update(date=today, at=time.monotonic())
+                _day_snapshot = snap
+            if snap["error"]:
+                logger.error(f"Bugungi ustun xato: {snap['error']}")
+                await _alert_column_error(bot, snap["error"])
+
+    rows = []
+    for r in snap["rows"]:
+        if r["holati"] == "Chiqib ketdi":
+            continue
+        cnt = r["sheet"]
+        try:
+            uid  = int(r["id"])
+            cnt  = max(cnt + _pending.get((uid, today), 0), _local_get(uid))
+        except (ValueError, TypeError):
+            pass
+        rows.append({"id": r["id"], "name": r["name"], "count": cnt})
+    return rows
+
+
+def _drop_day_snapshot() -> None:
+    global _day_snapshot
+    _day_snapshot = None
 
 
 async def check_screenshots(bot: Bot) -> None:
@@ -1000,10 +1734,8 @@ async def check_screenshots(bot: Bot) -> None:
     """
     if GROUP_ID == 0:
         return
-    await ensure_today_column(bot)
     try:
-        loop = asyncio.get_running_loop()
-        data = await loop.run_in_executor(None, lambda: _safe_records(_ws()))
+        data = await _today_rows(bot)
     except Exception as e:
         logger.error(f"check_screenshots Sheets xato: {e}")
         return
@@ -1020,24 +1752,8 @@ async def check_screenshots(bot: Bot) -> None:
     debtors  = []
     done     = []
 
-    for r in data:
-        if str(r.get("Holati", "")).strip() == "Chiqib ketdi":
-            continue
-        tg_id = str(r.get("Telegram ID", "")).strip()
-        if not tg_id:
-            continue
-        cnt_raw    = r.get(today, "")
-        from_sheet = int(cnt_raw) if str(cnt_raw).strip().isdigit() else 0
-        try:
-            from_local = _local_get(int(tg_id))
-            if from_local < 0:
-                from_local = 0
-        except (ValueError, TypeError):
-            from_local = 0
-        cnt  = max(from_sheet, from_local)
-        name = f"{r.get('Ism', '')} {r.get('Familiya', '')}".strip() or "Noma'lum"
-        (done if cnt >= DAILY_TARGET else debtors).append(
-            {"id": tg_id, "name": name, "count": cnt})
+    for u in data:
+        (done if u["count"] >= DAILY_TARGET else debtors).append(u)
 
     total    = len(done) + len(debtors)
     done_cnt = len(done)
@@ -1085,7 +1801,8 @@ async def check_screenshots(bot: Bot) -> None:
                 ADMIN_ID,
                 f"📊 <b>{time_str}</b>\n"
                 f"{percent_bar(pct)} {pct}%\n"
-                f"✅ {done_cnt}  ❌ {len(debtors)} / {total}",
+                f"✅ {done_cnt}  ❌ {len(debtors)} / {total}\n"
+                f"{screenshot_dedup.stats_text()}",
                 parse_mode="HTML",
             )
 
@@ -1096,34 +1813,14 @@ async def check_midday(bot: Bot) -> None:
     """
     if GROUP_ID == 0:
         return
-    await ensure_today_column(bot)
     try:
-        loop = asyncio.get_running_loop()
-        data = await loop.run_in_executor(None, lambda: _safe_records(_ws()))
+        data = await _today_rows(bot)
     except Exception as e:
         logger.error(f"check_midday Sheets xato: {e}")
         return
 
     today   = today_str()
-    debtors = []
-
-    for r in data:
-        if str(r.get("Holati", "")).strip() == "Chiqib ketdi":
-            continue
-        tg_id = str(r.get("Telegram ID", "")).strip()
-        if not tg_id:
-            continue
-        cnt_raw = r.get(today, "")
-        cnt     = int(cnt_raw) if str(cnt_raw).strip().isdigit() else 0
-        try:
-            local = _local_get(int(tg_id))
-            if local > cnt:
-                cnt = local
-        except (ValueError, TypeError):
-            pass
-        if cnt < DAILY_TARGET:
-            name = f"{r.get('Ism', '')} {r.get('Familiya', '')}".strip() or "Noma'lum"
-            debtors.append({"id": tg_id, "name": name, "count": cnt})
+    debtors = [u for u in data if u["count"] < DAILY_TARGET]
 
     if not debtors:
         return
@@ -1180,34 +1877,19 @@ async def cmd_users(message: Message):
     if not _is_admin(message):
         return
     try:
-        loop = asyncio.get_running_loop()
-        data = await loop.run_in_executor(None, lambda: _safe_records(_ws()))
+        data = await _today_rows()
     except Exception as e:
         await message.answer(f"❌ Xato: {e}")
         return
 
-    today = today_str()
     lines = ["👥 <b>Faol xodimlar bugun:</b>\n"]
     count = 0
 
-    for r in data:
-        if str(r.get("Holati", "")).strip() == "Chiqib ketdi":
-            continue
-        tg_id = str(r.get("Telegram ID", "")).strip()
-        if not tg_id:
-            continue
-        cnt_raw = r.get(today, "")
-        cnt     = int(cnt_raw) if str(cnt_raw).strip().isdigit() else 0
-        try:
-            local = _local_get(int(tg_id))
-            if local > cnt:
-                cnt = local
-        except (ValueError, TypeError):
-            pass
-        name  = f"{r.get('Ism', '')} {r.get('Familiya', '')}".strip() or "Noma'lum"
+    for u in data:
+        cnt   = u["count"]
         bar   = progress_bar(cnt, DAILY_TARGET)
         emoji = "✅" if cnt >= DAILY_TARGET else "⚠️" if cnt > 0 else "❌"
-        lines.append(f"{emoji} <b>{name}</b>\n   {bar} {cnt}/{DAILY_TARGET}")
+        lines.append(f"{emoji} <b>{u['name']}</b>\n   {bar} {cnt}/{DAILY_TARGET}")
         count += 1
         if count >= 30:
             break
@@ -1257,8 +1939,7 @@ async def cmd_sync(message: Message, bot: Bot):
                     updated += 1
             return updated
 
-        loop    = asyncio.get_running_loop()
-        updated = await loop.run_in_executor(None, _sync)
+        updated = await sheets.run(_sync)
         await msg.edit_text(f"✅ Sinxronlash yakunlandi! {updated} ta qator yangilandi.")
     except Exception as e:
         await msg.edit_text(f"❌ Xato: {e}")
@@ -1277,8 +1958,7 @@ async def cmd_fix_date_headers(message: Message):
         return
     msg = await message.answer("🔧 Sana ustunlari tekshirilmoqda...")
     try:
-        loop  = asyncio.get_running_loop()
-        fixed = await loop.run_in_executor(None, fix_date_header_formats_sync)
+        fixed = await sheets.run(fix_date_header_formats_sync)
         if fixed:
             await msg.edit_text(f"✅ {fixed} ta sana ustuni tuzatildi! Endi statistikani qayta tekshiring.")
         else:
@@ -1296,8 +1976,7 @@ async def cmd_cleanup_dupes(message: Message):
         return
     msg = await message.answer("🧹 Dublikat ustunlar tekshirilmoqda...")
     try:
-        loop    = asyncio.get_running_loop()
-        removed = await loop.run_in_executor(None, _cleanup_duplicate_cols_sync)
+        removed = await sheets.run(_cleanup_duplicate_cols_sync)
         if removed:
             await msg.edit_text(f"✅ {removed} ta dublikat ustun tozalandi!")
         else:
@@ -1308,6 +1987,22 @@ async def cmd_cleanup_dupes(message: Message):
         await message.delete()
 
 
+@router.message(Command("reklama_locks"))
+async def cmd_locks(message: Message):
+    """Per-user lock lardagi navbat metrikalari (60 soniyadan so'ng o'chadi)."""
+    if not _is_admin(message):
+        return
+    sent = await message.answer(
+        _user_locks.stats_text() + "\n\n" + _reg_locks.stats_text(),
+        parse_mode="HTML",
+    )
+    with contextlib.suppress(Exception):
+        await message.delete()
+    await asyncio.sleep(60)
+    with contextlib.suppress(Exception):
+        await sent.delete()
+
+
 @router.message(Command("reklama_help"))
 async def cmd_help(message: Message):
     """Yordam xabarini guruhga yuboradi (40 soniyadan so'ng o'chadi)."""
@@ -1325,7 +2020,8 @@ async def cmd_help(message: Message):
         "/reklama_reyting — Oylik reyting e'lon qilish\n"
         "/reklama_users — Faol xodimlar (progress bar)\n"
         "/sync_subadmin — User → sub_admin sinxronlash\n"
-        "/reklama_tozala — Dublikat ustunlarni tozalash 🧹\n\n"
+        "/reklama_tozala — Dublikat ustunlarni tozalash 🧹\n"
+        "/reklama_locks — Navbat (lock) metrikalari\n\n"
         "<b>Avtomatik (Apps Script):</b>\n"
         "⏰ 09:30, 15:00 — Nazorat + progress bar\n"
         "🕛 12:00 — Tushlik nazorati\n"
@@ -1352,10 +2048,9 @@ async def _send_today_stats(bot: Bot) -> None:
 
 async def _send_weekly_stats(bot: Bot) -> None:
     """Dushanba 09:00 — haftalik statistikani guruhga yuboradi."""
-    loop = asyncio.get_running_loop()
     # Dublikat ustunlarni avval tozalaymiz
     with contextlib.suppress(Exception):
-        await loop.run_in_executor(None, _cleanup_duplicate_cols_sync)
+        await sheets.run(_cleanup_duplicate_cols_sync)
     stats = await get_stats(7)
     text  = _stat_text(stats, "Haftalik", 7)
     with contextlib.suppress(TelegramForbiddenError):
@@ -1378,12 +2073,13 @@ async def _create_daily_column_job() -> None:
     00:00 — bugungi sana ustunini Sheets da yaratadi.
     Apps Script `createDailyColumn` o'rnini bosadi.
     """
-    loop = asyncio.get_running_loop()
     try:
         def _create():
             sheet = _ws()
+            _header_index(sheet, fresh=True)
             _get_date_col(sheet, today_str())
-        await loop.run_in_executor(None, _create)
+        _day_part()   # kechagi kunlik keshni tashlaymiz
+        await sheets.run(_create)
         logger.info(f"Kunlik ustun yaratildi: {today_str()}")
     except Exception as e:
         logger.error(f"create_daily_column xato: {e}")
@@ -1406,6 +2102,7 @@ def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
       18:00        — Bugungi statistika
       Dushanba 09:00 — Haftalik statistika
       Har kuni 09:05 — Oylik reyting (faqat 1-sana)
+      Har FLUSH_INTERVAL soniyada — screenshot hisoblarini Sheets ga yozish
     """
     TZ_STR = "Asia/Tashkent"
     sched  = AsyncIOScheduler(timezone=TZ_STR)
@@ -1419,6 +2116,8 @@ def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
     # Bot har ishga tushganda (yoki restart bo'lganda) darhol tekshiradi —
     # 00:00 trigger biror sababdan o'tkazib yuborilgan bo'lsa ham,
     # bugungi ustun 00:00 ni kutmasdan zudlik bilan yaratiladi.
+    # Shu chaqiruv sarlavha indeksini ham to'ldiradi (birinchi screenshot
+    # 1-qatorni yuklashni kutmaydi).
     asyncio.ensure_future(ensure_today_column(bot))
 
     sched.add_job(
@@ -1451,7 +2150,12 @@ def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
         CronTrigger(hour=9, minute=5, timezone=TZ_STR),
         id="monthly_check", replace_existing=True,
     )
+    sched.add_job(
+        lambda: asyncio.ensure_future(flush_counts()),
+        IntervalTrigger(seconds=FLUSH_INTERVAL, timezone=TZ_STR),
+        id="flush_counts", replace_existing=True,
+    )
 
     sched.start()
-    logger.info("Scheduler ishga tushdi — 7 ta trigger faol")
+    logger.info("Scheduler ishga tushdi — 8 ta trigger faol")
     return sched
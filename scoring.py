@@ -5,13 +5,9 @@ from __future__ import annotations
 
 import os
 import re
-import base64
-import json
-import asyncio
 import logging
 
-import gspread
-from google.oauth2.service_account import Credentials
+import sheets
 from aiogram import Router, F, Bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -26,42 +22,21 @@ from aiogram.types import (
 logger = logging.getLogger(__name__)
 router = Router()
 
-SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
 SUBADMIN_SHEET = "sub_adminlar"
-SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets.readonly",
-    "https://www.googleapis.com/auth/drive.readonly",
-]
-
-_gc: gspread.Client | None = None
 
 
 # ===================== RUXSAT TEKSHIRUV =====================
 
-def _get_gc() -> gspread.Client:
-    global _gc
-    if _gc is None:
-        b64   = os.getenv("GOOGLE_CREDENTIALS_B64")
-        info  = json.loads(base64.b64decode(b64).decode())
-        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-        _gc   = gspread.authorize(creds)
-    return _gc
-
-
 def _is_subadmin_sync(user_id: int) -> bool:
     try:
-        gc = _get_gc()
-        ws = gc.open_by_key(SPREADSHEET_ID).worksheet(SUBADMIN_SHEET)
-        ids = ws.col_values(2)[1:]
-        return str(user_id) in [str(v).strip() for v in ids]
+        return sheets.find_row(SUBADMIN_SHEET, user_id) is not None
     except Exception as e:
         logger.error(f"Sub-admin tekshirishda xato: {e}")
         return False
 
 
 async def is_subadmin(user_id: int) -> bool:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _is_subadmin_sync, user_id)
+    return await sheets.run(_is_subadmin_sync, user_id)
 
 
 # ===================== KREDIT KONFIGURATSIYASI =====================
@@ -0,0 +1,223 @@
+"""
+Screenshotlar uchun perceptual-hash dublikat aniqlash.
+
+Ilgari faqat Telegram file_unique_id solishtirilardi — faqat shu
+xodimning o'zi, faqat bugun. Qayta yuklangan (qayta siqilgan) rasm yoki
+xodimlar o'rtasida ulashilgan bitta screenshot yangi deb hisoblanardi.
+
+Endi:
+  • rasmning ENG KICHIK o'lchami (thumbnail) yuklanadi va executor da
+    64-bit dHash hisoblanadi — event loop to'xtamaydi
+  • hashlar barcha xodimlar bo'yicha DEDUP_DAYS kunlik rolling indeksda
+    saqlanadi; qidiruv — banded LSH: 64 bit DEDUP_BANDS ta bo'lakka
+    bo'linadi, Hamming masofasi < DEDUP_BANDS bo'lgan har qanday juftlik
+    kamida bitta bo'lakda to'liq mos keladi (pigeonhole) — shuning uchun
+    faqat shu bo'lak nomzodlari solishtiriladi
+  • har bir xodim uchun vaqt byudjeti (CostBudget): byudjet tugasa yoki
+    tekshiruv DEDUP_TIMEOUT dan oshsa, rasm tekshiruvsiz qabul qilinadi —
+    handler hech qachon sekinlashmaydi
+
+Foydalanish:
+    h   = await image_hash(bot, message.photo[0].file_id)
+    dup = index.check_and_add(h, owner=(user_id, message_id), day="17.07.2026")
+"""
+from __future__ import annotations
+
+import io
+import os
+import time
+import asyncio
+import logging
+from functools import partial
+
+from PIL import Image
+
+from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+DEDUP_DAYS         = int(os.getenv("DEDUP_DAYS", "3"))
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))    # 64 bitdan
+DEDUP_BANDS        = DEDUP_MAX_DISTANCE + 1                       # pigeonhole
+DEDUP_TIMEOUT      = float(os.getenv("DEDUP_TIMEOUT", "1.5"))     # soniya
+DEDUP_BUDGET       = float(os.getenv("DEDUP_BUDGET", "3"))        # soniya / oyna
+DEDUP_WINDOW       = 60.0                                         # soniya
+
+HASH_BITS = 64
+
+
+# ─── DHASH ────────────────────────────────────────────────────────────────────
+
+def dhash_bytes(data: bytes) -> int:
+    """
+    64-bit difference hash: 9x8 kulrang rasmda qo'shni piksellar
+    taqqoslanadi. Qayta siqish va o'lcham o'zgarishiga chidamli.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", (32, 32))   # JPEG ni dekodlashda kichraytiradi
+        px = list(img.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    h = 0
+    for row in range(8):
+        base = row * 9
+        for col in range(8):
+            h = (h << 1) | (px[base + col] > px[base + col + 1])
+    return h
+
+
+async def image_hash(bot: Bot, file_id: str) -> int:
+    """Faylni xotiraga yuklab, dHash ni executor da hisoblaydi."""
+    buf = io.BytesIO()
+    await bot.download(file_id, destination=buf)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(dhash_bytes, buf.getvalue()))
+
+
+# ─── ROLLING LSH INDEKS ───────────────────────────────────────────────────────
+
+def _bands(h: int) -> list[tuple[int, int]]:
+    """Hashni (bo'lak raqami, qiymat) juftliklariga ajratadi."""
+    width = HASH_BITS // DEDUP_BANDS
+    mask  = (1 << width) - 1
+    out   = []
+    for b in range(DEDUP_BANDS):
+        shift = b * width
+        # Oxirgi bo'lak qolgan barcha bitlarni oladi
+        m = mask if b < DEDUP_BANDS - 1 else (1 << (HASH_BITS - shift)) - 1
+        out.append((b, (h >> shift) & m))
+    return out
+
+
+class DedupIndex:
+    """
+    Kunlarga bo'lingan LSH indeks. Har bir kun — alohida bo'lim:
+    {band_key: [hash, ...]} va {hash: owner}. Eski kunlar bitta
+    dict o'chirish bilan tashlanadi.
+    """
+
+    def __init__(self, days: int = DEDUP_DAYS, max_distance: int = DEDUP_MAX_DISTANCE) -> None:
+        self.days         = days
+        self.max_distance = max_distance
+        self._parts: dict[str, dict] = {}   # {"dd.mm.yyyy": {"bands": {}, "owners": {}}}
+
+    def _roll(self, day: str) -> dict:
+        part = self._parts.get(day)
+        if part is None:
+            part = self._parts[day] = {"bands": {}, "owners": {}}
+            # Yangi kun — eng eskilarini tashlaymiz (dd.mm.yyyy → sortable)
+            order = sorted(self._parts, key=lambda d: d[6:] + d[3:5] + d[:2])
+            for old in order[:-self.days]:
+                del self._parts[old]
+        return part
+
+    def find(self, h: int) -> tuple | None:
+        """Masofasi max_distance dan oshmaydigan eng yaqin hash egasi."""
+        best, best_d = None, self.max_distance + 1
+        for part in self._parts.values():
+            bands  = part["bands"]
+            owners = part["owners"]
+            seen   = set()
+            for key in _bands(h):
+                for cand in bands.get(key, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    d = (cand ^ h).bit_count()
+                    if d < best_d:
+                        best, best_d = owners[cand], d
+        return best
+
+    def check_and_add(self, h: int, owner: tuple, day: str) -> tuple | None:
+        """
+        Mos hash bo'lsa uning egasini qaytaradi (indeksga qo'shmaydi),
+        aks holda hashni `day` bo'limiga qo'shib None qaytaradi.
+        Ichida await yo'q — bir vaqtdagi ikki xabar o'rtasida poyga bo'lmaydi.
+        """
+        part = self._roll(day)
+        dup  = self.find(h)
+        if dup is not None:
+            return dup
+        if h not in part["owners"]:
+            part["owners"][h] = owner
+            for key in _bands(h):
+                part["bands"].setdefault(key, []).append(h)
+        return None
+
+    def __len__(self) -> int:
+        return sum(len(p["owners"]) for p in self._parts.values())
+
+
+# ─── XARAJAT BYUDJETI ─────────────────────────────────────────────────────────
+
+class CostBudget:
+    """
+    Har bir xodim uchun DEDUP_WINDOW soniyada DEDUP_BUDGET soniya
+    tekshiruv vaqti. Ko'p rasm tashlagan xodim boshqalarni sekinlashtirmaydi.
+    """
+
+    def __init__(self, budget: float = DEDUP_BUDGET, window: float = DEDUP_WINDOW) -> None:
+        self.budget = budget
+        self.window = window
+        self._spent: dict[int, tuple[float, float]] = {}   # {uid: (oyna boshi, sarflangan)}
+
+    def allow(self, uid: int) -> bool:
+        start, spent = self._spent.get(uid, (0.0, 0.0))
+        return time.monotonic() - start > self.window or spent < self.budget
+
+    def charge(self, uid: int, cost: float) -> None:
+        now = time.monotonic()
+        start, spent = self._spent.get(uid, (now, 0.0))
+        if now - start > self.window:
+            start, spent = now, 0.0
+        self._spent[uid] = (start, spent + cost)
+        if len(self._spent) > 5000:
+            self._spent = {k: v for k, v in self._spent.items() if now - v[0] <= self.window}
+
+
+# ─── UMUMIY TEKSHIRUV ─────────────────────────────────────────────────────────
+
+_index  = DedupIndex()
+_budget = CostBudget()
+_stats  = {"checked": 0, "dupes": 0, "skipped": 0, "failed": 0, "ms_total": 0.0}
+
+
+async def find_duplicate(bot: Bot, file_id: str, owner: tuple, uid: int, day: str) -> tuple | None:
+    """
+    Rasm avval (DEDUP_DAYS ichida, istalgan xodimdan) yuborilganmi?
+    Topilsa avvalgi egasini (owner) qaytaradi. Byudjet tugagan,
+    vaqt tugagan yoki xato bo'lsa None — rasm qabul qilinadi.
+    """
+    if not _budget.allow(uid):
+        _stats["skipped"] += 1
+        return None
+    started = time.monotonic()
+    try:
+        h = await asyncio.wait_for(image_hash(bot, file_id), DEDUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        _stats["failed"] += 1
+        logger.warning(f"[DEDUP] {uid}: hash {DEDUP_TIMEOUT}s ichida tayyor bo'lmadi")
+        return None
+    except Exception as e:
+        _stats["failed"] += 1
+        logger.warning(f"[DEDUP] {uid}: hash xato: {e}")
+        return None
+    finally:
+        cost = time.monotonic() - started
+        _budget.charge(uid, cost)
+        _stats["ms_total"] += cost * 1000
+
+    _stats["checked"] += 1
+    dup = _index.check_and_add(h, owner, day)
+    if dup is not None:
+        _stats["dupes"] += 1
+    return dup
+
+
+def stats_text() -> str:
+    """Qisqa statistika (admin uchun)."""
+    n   = _stats["checked"] + _stats["failed"]
+    avg = _stats["ms_total"] / n if n else 0.0
+    return (
+        f"🧩 Dublikat: {_stats['dupes']} / {_stats['checked']} tekshirildi, "
+        f"o'tkazildi {_stats['skipped']}, xato {_stats['failed']}, "
+        f"o'rtacha {avg:.0f} ms, indeksda {len(_index)}"
+    )
@@ -0,0 +1,314 @@
+"""
+Google Sheets shlyuzi — barcha modullar uchun umumiy ulanish.
+
+Avval har bir modul (reklama_nazorati, broadcast, personal_message,
+scoring, filial, download, buyruqlar) o'z gspread clientini yaratib,
+har bir operatsiyada open_by_key() chaqirardi — bu har safar
+spreadsheet metadata sini qayta yuklash degani edi.
+
+Endi:
+  • bitta avtorizatsiyalangan client
+  • Spreadsheet va Worksheet obyektlari keshlanadi
+  • bloklovchi chaqiruvlar alohida, chegaralangan thread pool da
+    ishlaydi (default executor emas) — guruh band bo'lganda ham
+    Sheets so'rovlari boshqa ishlarni siqib chiqarmaydi
+
+Foydalanish:
+    import sheets
+    ws   = sheets.worksheet("user")             # sync (thread ichida)
+    rows = await sheets.run(ws.get_all_values)  # async
+"""
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+import gspread
+from google.oauth2.service_account import Credentials
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SPREADSHEET_ID = "1UU87w2q9zk8q5_3pQqfVhp0Zp2hnU70bWWgu1R9q3No"
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+# Bir vaqtda Sheets ga ketadigan so'rovlar soni. Google per-minute
+# kvotasi baribir cheklaydi — ko'p thread faqat navbatni uzaytiradi.
+MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sheets")
+_lock     = threading.RLock()
+
+_gc:         gspread.Client | None      = None
+_sh:         gspread.Spreadsheet | None = None
+_worksheets: dict[str, gspread.Worksheet] = {}
+
+
+# ─── ULANISH ──────────────────────────────────────────────────────────────────
+
+def client() -> gspread.Client:
+    """Avtorizatsiyalangan gspread clientini qaytaradi (bitta nusxa)."""
+    global _gc
+    with _lock:
+        if _gc is None:
+            b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
+            if not b64:
+                raise RuntimeError("GOOGLE_CREDENTIALS_B64 topilmadi")
+            info  = json.loads(base64.b64decode(b64).decode("utf-8"))
+            creds = Credentials.from_service_account_info(info, scopes=SCOPES)
+            _gc   = gspread.authorize(creds)
+        return _gc
+
+
+def spreadsheet() -> gspread.Spreadsheet:
+    """Asosiy spreadsheet ni qaytaradi. Metadata faqat bir marta yuklanadi."""
+    global _sh
+    with _lock:
+        if _sh is None:
+            _sh = client().open_by_key(SPREADSHEET_ID)
+        return _sh
+
+
+def worksheet(title: str, headers: list[str] | None = None) -> gspread.Worksheet:
+    """
+    Varaqni keshdan qaytaradi.
+    headers berilsa: varaq yo'q bo'lsa yaratiladi, 1-qator bo'sh bo'lsa
+    sarlavha yoziladi. Bu tekshiruv faqat birinchi ochilishda bo'ladi.
+    """
+    with _lock:
+        ws = _worksheets.get(title)
+        if ws is not None:
+            return ws
+        sh = spreadsheet()
+        try:
+            ws = sh.worksheet(title)
+            if headers and not ws.row_values(1):
+                ws.append_row(headers)
+        except gspread.WorksheetNotFound:
+            if not headers:
+                raise
+            ws = sh.add_worksheet(title=title, rows="100", cols=str(max(50, len(headers))))
+            ws.append_row(headers)
+        _worksheets[title] = ws
+        return ws
+
+
+def worksheet_titles() -> list[str]:
+    """Spreadsheet dagi barcha varaq nomlari (diagnostika uchun)."""
+    return [ws.title for ws in spreadsheet().worksheets()]
+
+
+def reset() -> None:
+    """
+    Keshlangan client va varaqlarni tashlab yuboradi.
+    Token yoki ulanish xatosidan keyin chaqiriladi — keyingi
+    so'rov yangi ulanish bilan boshlanadi.
+    """
+    global _gc, _sh
+    with _lock:
+        _gc = None
+        _sh = None
+        _worksheets.clear()
+
+
+# ─── QATOR INDEKSI ────────────────────────────────────────────────────────────
+# {varaq nomi: {telegram_id: qator raqami}} — 2-ustun (Telegram ID) bir
+# marta o'qiladi, keyin har bir qidiruv O(1). Yangi qator qo'shilganda
+# yangilanadi, qatorlarni qayta tartiblaydigan tozalashlardan keyin
+# bekor qilinadi (invalidate_rows).
+#
+# Indeksda topilmagan ID uchun — agar indeks ROW_INDEX_MISS_AGE dan eski
+# bo'lsa — bir marta qayta quriladi (qo'lda yoki Apps Script qo'shgan
+# qatorlar uchun). ROW_INDEX_TTL dan eski indeks har holda yangilanadi.
+
+ID_COL             = 2
+ROW_INDEX_MISS_AGE = 60      # soniya
+ROW_INDEX_TTL      = 600     # soniya
+
+_row_index:    dict[str, dict[int, int]] = {}
+_row_index_at: dict[str, float]          = {}
+
+_UPDATED_ROW_RE = re.compile(r"![A-Z]+(\d+)")
+
+
+def parse_id(val: Any) -> int | None:
+    """
+    Katakdagi Telegram ID ni int ga aylantiradi.
+    "588979280", "588979280.0", 588979280 — barcha formatlarni qabul qiladi.
+    """
+    v = str(val).strip()
+    if not v:
+        return None
+    try:
+        return int(v)
+    except ValueError:
+        pass
+    try:
+        return int(float(v))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _build_row_index(title: str) -> dict[int, int]:
+    values = worksheet(title).col_values(ID_COL)
+    index: dict[int, int] = {}
+    for i, v in enumerate(values, start=1):
+        uid = parse_id(v)
+        if uid is not None and uid not in index:
+            index[uid] = i
+    with _lock:
+        _row_index[title]    = index
+        _row_index_at[title] = time.monotonic()
+    return index
+
+
+def row_index(title: str, fresh: bool = False) -> dict[int, int]:
+    """
+    Varaq uchun {telegram_id: qator} indeksini qaytaradi (kerak bo'lsa quradi).
+    fresh=True — indeks har holda qayta o'qiladi (ommaviy yozuvlardan oldin).
+    """
+    with _lock:
+        index = _row_index.get(title)
+        age   = time.monotonic() - _row_index_at.get(title, 0.0)
+    if fresh or index is None or age > ROW_INDEX_TTL:
+        index = _build_row_index(title)
+    return index
+
+
+def find_row(title: str, user_id: int) -> int | None:
+    """Telegram ID bo'yicha qator raqamini (1-based) qaytaradi."""
+    row = row_index(title).get(user_id)
+    if row is None:
+        with _lock:
+            age = time.monotonic() - _row_index_at.get(title, 0.0)
+        if age > ROW_INDEX_MISS_AGE:
+            row = _build_row_index(title).get(user_id)
+    return row
+
+
+def remember_row(title: str, user_id: int, row: int) -> None:
+    """Yangi qo'shilgan qatorni indeksga yozadi."""
+    with _lock:
+        index = _row_index.get(title)
+        if index is not None:
+            index.setdefault(user_id, row)
+
+
+def remember_append(title: str, user_id: int, response: Any) -> None:
+    """
+    append_row() javobidan qator raqamini olib indeksga yozadi.
+    Javobni tushunib bo'lmasa indeks bekor qilinadi.
+    """
+    remember_appends(title, [user_id], response)
+
+
+def remember_appends(title: str, user_ids: list[int], response: Any) -> None:
+    """append_rows() javobi uchun: qatorlar ketma-ket, user_ids tartibida."""
+    try:
+        rng   = response["updates"]["updatedRange"]
+        first = int(_UPDATED_ROW_RE.search(rng).group(1))
+    except (KeyError, TypeError, AttributeError, ValueError):
+        invalidate_rows(title)
+        return
+    for i, uid in enumerate(user_ids):
+        remember_row(title, uid, first + i)
+
+
+def invalidate_rows(title: str | None = None) -> None:
+    """Qatorlar tartibi o'zgarganda indeksni bekor qiladi (None — barchasi)."""
+    with _lock:
+        if title is None:
+            _row_index.clear()
+            _row_index_at.clear()
+        else:
+            _row_index.pop(title, None)
+            _row_index_at.pop(title, None)
+
+
+# ─── USTUNGA YOZISH ───────────────────────────────────────────────────────────
+# Bir nechta foydalanuvchining bitta ustunini (masalan Holati — H) yozish.
+# update_cell() ni har bir qator uchun chaqirish o'rniga: ID → qator
+# xaritasi (2-ustun) + ustunning joriy qiymatlari bir martadan o'qiladi,
+# faqat o'zgargan kataklar yoziladi, qo'shni qatorlar bitta diapazonga
+# birlashtiriladi va barchasi bir nechta batch_update da yuboriladi.
+
+WRITE_CHUNK = 500   # bitta batch_update dagi diapazonlar soni
+
+
+def _col_letter(col: int) -> str:
+    return re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, col))
+
+
+def write_column(title: str, col: int, values: dict[int, str]) -> int:
+    """
+    {telegram_id: qiymat} ni varaqning col ustuniga yozadi.
+    Varaqda yo'q ID lar o'tkazib yuboriladi. Bittadan ortiq yozuvda
+    o'zgarmagan kataklar yozilmaydi. Qaytaradi: yozilgan kataklar soni.
+    """
+    if not values:
+        return 0
+    ws = worksheet(title)
+
+    if len(values) == 1:
+        (uid, value), = values.items()
+        row = find_row(title, uid)
+        if row is None:
+            return 0
+        ws.update_cell(row, col, value)
+        return 1
+
+    index   = row_index(title, fresh=True)
+    current = ws.col_values(col)
+    changes: dict[int, str] = {}
+    for uid, value in values.items():
+        row = index.get(uid)
+        if row is None:
+            continue
+        old = current[row - 1] if row <= len(current) else ""
+        if str(old) != str(value):
+            changes[row] = value
+    if not changes:
+        return 0
+
+    # Qo'shni qatorlarni bitta diapazonga birlashtiramiz
+    letter = _col_letter(col)
+    ranges: list[dict] = []
+    run: list[int] = []
+    for row in sorted(changes):
+        if run and row != run[-1] + 1:
+            ranges.append({"range": f"{letter}{run[0]}:{letter}{run[-1]}", "values": [[changes[r]] for r in run]})
+            run = []
+        run.append(row)
+    ranges.append({"range": f"{letter}{run[0]}:{letter}{run[-1]}", "values": [[changes[r]] for r in run]})
+
+    for i in range(0, len(ranges), WRITE_CHUNK):
+        ws.batch_update(ranges[i:i + WRITE_CHUNK], value_input_option="RAW")
+    return len(changes)
+
+
+# ─── ASYNC API ────────────────────────────────────────────────────────────────
+
+async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Bloklovchi Sheets funksiyasini Sheets thread pool ida bajaradi."""
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        func = partial(func, **kwargs)
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+def shutdown() -> None:
+    """Thread pool ni to'xtatadi (bot o'chayotganda)."""
+    _executor.shutdown(wait=False, cancel_futures=True)
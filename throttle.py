@@ -0,0 +1,247 @@
+"""
+Ko'p foydalanuvchiga xabar yuborish dvigateli (broadcast, shaxsiy xabar).
+
+Telegram cheklovlari: bot umumiy ~30 xabar/soniya, bitta chatga
+~1 xabar/soniya. Ilgari har bir foydalanuvchiga ketma-ket, qat'iy
+sleep bilan yuborilardi (10–15 xabar/soniya) va TelegramRetryAfter
+e'tiborsiz qolardi.
+
+Endi:
+  • TokenBucket — umumiy tezlik (default 25/s, zaxira bilan)
+  • har bir chat uchun minimal oraliq
+  • TelegramRetryAfter — butun dvigatel ko'rsatilgan vaqtga to'xtaydi va
+    tezlikni pasaytiradi, keyin asta-sekin tiklaydi
+  • tarmoq/server xatolari — eksponensial backoff bilan qayta urinish
+  • cheklangan parallel yuboruvchilar (worker pool)
+  • progress — bitta agregator vazifa, har N soniyada bir marta
+
+Foydalanish:
+    throttle = get_throttle()
+    await throttle.call(chat_id, lambda: bot.send_message(chat_id, "..."))
+
+    stats = await fan_out(user_ids, send_one, on_progress=report)
+"""
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE       = float(os.getenv("SEND_RATE", "25"))          # xabar/soniya
+MIN_RATE          = 5.0
+PER_CHAT_INTERVAL = float(os.getenv("SEND_PER_CHAT_INTERVAL", "1"))
+WORKERS           = int(os.getenv("SEND_WORKERS", "40"))
+MAX_RETRIES       = 5
+PROGRESS_EVERY    = 3.0                                           # soniya
+
+# Yuborish natijalari
+OK      = "ok"
+BLOCKED = "blocked"   # bot bloklangan / foydalanuvchi o'chirilgan
+BAD     = "bad"       # TelegramBadRequest (chat topilmadi va h.k.)
+ERROR   = "error"     # boshqa xatolar (qayta urinishlardan keyin)
+
+
+# ===== TOKEN BUCKET =====
+
+class TokenBucket:
+    """Oddiy token bucket — rate token/soniya, capacity gacha to'planadi."""
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate     = rate
+        self.capacity = capacity or rate
+        self._tokens  = self.capacity
+        self._stamp   = 0.0
+        self._lock    = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self._stamp:
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                self._refill(loop.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ===== THROTTLE =====
+
+class Throttle:
+    """
+    Bitta Telegram chaqiruvini cheklovlarga rioya qilgan holda bajaradi.
+    Umumiy limit butun bot uchun — shuning uchun odatda get_throttle()
+    qaytaradigan bitta umumiy nusxa ishlatiladi.
+    """
+
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        per_chat_interval: float = PER_CHAT_INTERVAL,
+    ) -> None:
+        self.max_rate          = rate
+        self.bucket            = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self._chat_next: dict[int | str, float] = {}
+        self._paused_until     = 0.0
+        self._penalized_at     = 0.0
+        self.retry_after_hits  = 0
+
+    async def _wait_turn(self, chat_id: int | str) -> None:
+        loop = asyncio.get_running_loop()
+        # Umumiy pauza (RetryAfter dan keyin)
+        while (delay := self._paused_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+        # Shu chat uchun oraliq
+        now  = loop.time()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self.bucket.acquire()
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+    def _penalize(self, retry_after: float) -> None:
+        loop = asyncio.get_running_loop()
+        self.retry_after_hits += 1
+        self._paused_until  = max(self._paused_until, loop.time() + retry_after)
+        self._penalized_at  = loop.time()
+        self.bucket.rate    = max(MIN_RATE, self.bucket.rate * 0.7)
+        logger.warning(
+            f"[SEND] RetryAfter {retry_after}s — tezlik {self.bucket.rate:.1f}/s ga tushirildi"
+        )
+
+    def _recover(self) -> None:
+        if self.bucket.rate >= self.max_rate:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.time() - self._penalized_at > 10:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.05)
+
+    async def call(self, chat_id: int | str, request: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        request() ni cheklovlar bilan bajaradi.
+        TelegramForbiddenError / TelegramBadRequest darhol yuqoriga uzatiladi.
+        """
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                result = await request()
+            except TelegramRetryAfter as e:
+                self._penalize(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt >= MAX_RETRIES:
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt)
+                logger.warning(f"[SEND] {chat_id}: {e} — {delay}s dan keyin qayta")
+                await asyncio.sleep(delay)
+            else:
+                self._recover()
+                return result
+
+
+_shared: Throttle | None = None
+
+
+def get_throttle() -> Throttle:
+    """Bot bo'yicha umumiy Throttle (broadcast va shaxsiy xabarlar birga)."""
+    global _shared
+    if _shared is None:
+        _shared = Throttle()
+    return _shared
+
+
+def classify(exc: BaseException | None) -> str:
+    """Istisnoni yuborish natijasiga aylantiradi."""
+    if exc is None:
+        return OK
+    if isinstance(exc, TelegramForbiddenError):
+        return BLOCKED
+    if isinstance(exc, TelegramBadRequest):
+        return BAD
+    return ERROR
+
+
+# ===== FAN-OUT =====
+
+async def fan_out(
+    recipients: Iterable[int],
+    send_one: Callable[[int], Awaitable[Any]],
+    *,
+    total: int | None = None,
+    workers: int = WORKERS,
+    on_result: Callable[[int, str], Any] | None = None,
+    on_progress: Callable[[int, int, dict[str, int]], Awaitable[Any]] | None = None,
+    progress_every: float = PROGRESS_EVERY,
+    stop: asyncio.Event | None = None,
+) -> dict[str, int]:
+    """
+    recipients ning har biri uchun send_one(uid) ni cheklangan parallel
+    worker lar bilan bajaradi. on_result(uid, natija) — har bir yakunda,
+    on_progress(bajarildi, jami, statistika) — agregatordan davriy.
+    stop o'rnatilsa, worker lar yangi qabul qiluvchi olmaydi — boshlangan
+    yuborishlar tugaydi va fan_out qaytadi.
+    Qaytaradi: {OK: n, BLOCKED: n, BAD: n, ERROR: n}
+    """
+    recipients = list(recipients)
+    total      = total if total is not None else len(recipients)
+    stats      = {OK: 0, BLOCKED: 0, BAD: 0, ERROR: 0}
+    queue: asyncio.Queue[int] = asyncio.Queue()
+    for uid in recipients:
+        queue.put_nowait(uid)
+
+    async def worker() -> None:
+        while True:
+            if stop is not None and stop.is_set():
+                return
+            try:
+                uid = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            exc: BaseException | None = None
+            try:
+                await send_one(uid)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                exc = e
+                if classify(e) == ERROR:
+                    logger.warning(f"Yuborishda xato ({uid}): {e}")
+            outcome = classify(exc)
+            stats[outcome] += 1
+            if on_result:
+                on_result(uid, outcome)
+
+    async def reporter() -> None:
+        while True:
+            await asyncio.sleep(progress_every)
+            try:
+                await on_progress(total - (len(recipients) - sum(stats.values())), total, dict(stats))
+            except Exception:
+                pass
+
+    report_task = asyncio.ensure_future(reporter()) if on_progress else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(recipients))))))
+    finally:
+        if report_task:
+            report_task.cancel()
+    return stats
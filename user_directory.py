@@ -0,0 +1,430 @@
+"""
+Foydalanuvchilar katalogi — "user" varag'ining xotiradagi indekslangan nusxasi.
+
+Ilgari /xabar qidiruvi har safar butun varaqni qayta yuklab, har bir
+foydalanuvchi uchun matn yig'ib, birinchi 20 ta qism-moslikni qaytarardi.
+
+Endi:
+  • varaq bir marta o'qiladi, DIRECTORY_TTL dan keyin fonda yangilanadi
+    (eski nusxa yangilanish tugaguncha xizmat qiladi)
+  • ro'yxatdan o'tgan/o'zgargan foydalanuvchilar note_user() orqali
+    darhol qo'shiladi — to'liq qayta yuklash shart emas
+  • qidiruv: 3 va undan uzun so'rovlar — trigram indeks, qisqalari —
+    saralangan tokenlar bo'yicha prefiks; natijalar moslik darajasi
+    bo'yicha tartiblanadi
+
+Foydalanish:
+    directory = await user_directory.get()
+    results   = directory.search("ali", limit=20)
+"""
+from __future__ import annotations
+
+import re
+import time
+import asyncio
+import logging
+from bisect import bisect_left, insort
+
+import sheets
+
+logger = logging.getLogger(__name__)
+
+USER_SHEET    = "user"
+DIRECTORY_TTL = 300   # soniya
+
+# ─── VARAQNI O'QISH ───────────────────────────────────────────────────────────
+# Ustun nomlari moslashuvchan — qo'lda tahrirlangan varaqlar uchun
+
+_ID_KEYS     = ["Telegram ID", "TelegramID", "ID", "Tg ID", "Chat ID"]
+_UNAME_KEYS  = ["Username", "User", "@Username"]
+_ISM_KEYS    = ["Ism", "Name", "First Name", "Ismi"]
+_FAM_KEYS    = ["Familiya", "Last Name", "Familiyasi"]
+_TEL_KEYS    = ["Telefon", "Telefon raqami", "Phone", "Tel"]
+_HOLATI_KEYS = ["Holati", "Status"]
+
+
+def _pick(rec: dict, keys: list[str]) -> str:
+    for k in keys:
+        if k in rec and str(rec[k]).strip():
+            return str(rec[k]).strip()
+    return ""
+
+
+def load_users_sync() -> list[dict]:
+    """
+    'user' varag'idan barcha foydalanuvchilarni o'qib, normallashtirilgan
+    dict ro'yxatini qaytaradi: {id, username, ism, familiya, fullname,
+    telefon, holati}
+    """
+    ws       = sheets.worksheet(USER_SHEET)
+    all_vals = ws.get_all_values()
+    if len(all_vals) < 2:
+        return []
+
+    headers = [str(h).strip() for h in all_vals[0]]
+    result  = []
+    seen: set[int] = set()
+
+    for row in all_vals[1:]:
+        if not any(str(c).strip() for c in row):
+            continue
+        padded = row + [""] * max(0, len(headers) - len(row))
+        rec    = {headers[i]: padded[i] for i in range(len(headers)) if headers[i]}
+
+        uid = sheets.parse_id(_pick(rec, _ID_KEYS))
+        if uid is None or uid in seen:
+            continue
+        seen.add(uid)
+
+        ism = _pick(rec, _ISM_KEYS)
+        fam = _pick(rec, _FAM_KEYS)
+        result.append({
+            "id":       uid,
+            "username": _pick(rec, _UNAME_KEYS).lstrip("@"),
+            "ism":      ism,
+            "familiya": fam,
+            "fullname": f"{ism} {fam}".strip() or "Noma'lum",
+            "telefon":  _pick(rec, _TEL_KEYS),
+            "holati":   _pick(rec, _HOLATI_KEYS),
+        })
+    return result
+
+
+# ─── INDEKS ───────────────────────────────────────────────────────────────────
+
+def _norm(text: str) -> str:
+    return text.strip().lower().lstrip("@")
+
+
+def _digits(text: str) -> str:
+    return "".join(ch for ch in text if ch.isdigit())
+
+
+_PHONE_LIKE = re.compile(r"\+?[\d\s()-]*\d[\d\s()-]*")
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# ─── TELEFON ──────────────────────────────────────────────────────────────────
+# Varaqdagi raqamlar turli ko'rinishda: "+998 90 123 45 67", "998901234567",
+# "90 123-45-67", "8 90 1234567", "00998...". Barchasi E.164 ga keltiriladi.
+# Xorijiy raqam faqat davlat kodi aniq berilganda ("+7 916...", "0049...")
+# qabul qilinadi — "1234567890" kabi kodsiz raqamni taxmin qilmaymiz.
+
+COUNTRY_CODE  = "998"
+LOCAL_DIGITS  = 9
+FULL_DIGITS   = len(COUNTRY_CODE) + LOCAL_DIGITS   # 12
+E164_MAX      = 15
+
+
+def normalize_phone(raw: str) -> str | None:
+    """Telefon raqamini "+998901234567" ko'rinishiga keltiradi (bo'lmasa None)."""
+    text     = (raw or "").strip()
+    d        = _digits(text)
+    explicit = text.startswith("+") or d.startswith("00")
+    if d.startswith("00"):
+        d = d[2:]
+    if explicit:
+        if d.startswith(COUNTRY_CODE):
+            return "+" + d if len(d) == FULL_DIGITS else None
+        return "+" + d if 10 <= len(d) <= E164_MAX and d[0] != "0" else None
+    if len(d) == LOCAL_DIGITS:
+        return "+" + COUNTRY_CODE + d
+    if len(d) == LOCAL_DIGITS + 1 and d[0] in "08":
+        return "+" + COUNTRY_CODE + d[1:]
+    if len(d) == FULL_DIGITS and d.startswith(COUNTRY_CODE):
+        return "+" + d
+    return None
+
+
+_PHONE_SPLIT = re.compile(r"[,;\n|/]+")
+_PHONE_PART  = re.compile(r"\+?\d+")
+_MIN_DIGITS  = 5   # bundan qisqa raqamlar (tartib raqami, yil) e'tiborsiz
+
+
+def _needed_digits(first: str) -> int | None:
+    """
+    Raqamning birinchi bo'lagidan u necha xonali bo'lishini aniqlaydi
+    (prefiks raqamlari bilan birga). Xorijiy raqamda uzunlik noma'lum — None.
+    """
+    d = first.lstrip("+")
+    if d.startswith("00"):
+        return 2 + FULL_DIGITS if d[2:].startswith(COUNTRY_CODE) else None
+    if first.startswith("+"):
+        return FULL_DIGITS if d.startswith(COUNTRY_CODE) else None
+    if d == COUNTRY_CODE or (len(d) >= FULL_DIGITS and d.startswith(COUNTRY_CODE)):
+        return FULL_DIGITS
+    return LOCAL_DIGITS + 1 if d[0] in "08" else LOCAL_DIGITS
+
+
+def extract_phones(text: str) -> tuple[list[str], list[str]]:
+    """
+    Matndan (ro'yxat, vergul, yangi qator bilan) raqamlarni ajratib oladi.
+    Bo'shliq bilan ajratilgan ketma-ket raqamlar ham bo'linadi: raqam
+    kutilgan uzunlikka yetishi bilan yopiladi ("901234567 911234567" — 2 ta).
+    Qaytaradi: (E.164 raqamlar, tanib bo'lmagan bo'laklar).
+    """
+    phones: list[str] = []
+    bad:    list[str] = []
+
+    def close(buf: list[str]) -> None:
+        raw = " ".join(buf)
+        if len(_digits(raw)) < _MIN_DIGITS:
+            return
+        phone = normalize_phone(raw)
+        if phone is None:
+            if raw not in bad:
+                bad.append(raw)
+        elif phone not in phones:
+            phones.append(phone)
+
+    for chunk in _PHONE_SPLIT.split(text or ""):
+        buf:  list[str]  = []
+        need: int | None = None
+        for part in _PHONE_PART.findall(chunk):
+            # "+" yoki o'zi to'liq raqam bo'lgan bo'lak — yangi raqam boshlanadi
+            # ("2) 0901234567" dagi "2" kabi qisqa qoldiqlar tashlanadi)
+            if buf and (part.startswith("+")
+                        or len(_digits(part)) >= (_needed_digits(part) or E164_MAX + 1)):
+                close(buf)
+                buf = []
+            if not buf:
+                need = _needed_digits(part)
+            buf.append(part)
+            if need is not None and len(_digits("".join(buf))) >= need:
+                close(buf)
+                buf = []
+        if buf:
+            close(buf)
+    return phones, bad
+
+
+# Moslik darajalari
+SCORE_EXACT  = 100   # ID, username yoki telefon to'liq mos
+SCORE_PREFIX = 60    # so'z boshi mos
+SCORE_SUFFIX = 50    # telefonning oxirgi raqamlari mos
+SCORE_INNER  = 20    # ichida uchraydi
+
+
+class UserDirectory:
+    """Foydalanuvchilar ro'yxati + qidiruv indekslari."""
+
+    def __init__(self, users: list[dict]) -> None:
+        self.users:  list[dict]          = []
+        self.by_id:  dict[int, int]      = {}   # {telegram_id: indeks}
+        self._fields: list[list[str]]    = []   # har bir foydalanuvchining qidiriladigan maydonlari
+        self._grams:  dict[str, set[int]] = {}
+        self._tokens: list[tuple[str, int]] = []   # saralangan (token, indeks)
+        self.by_phone: dict[str, int]   = {}   # {"+998...": indeks}
+        self.loaded_at = time.monotonic()
+        for u in users:
+            self._add(u, bulk=True)
+        self._tokens.sort()
+
+    # ── Qurish ──
+
+    def _add(self, user: dict, bulk: bool = False) -> None:
+        idx = self.by_id.get(user["id"])
+        if idx is None:
+            idx = len(self.users)
+            self.users.append(user)
+            self.by_id[user["id"]] = idx
+            self._fields.append([])
+        else:
+            self.users[idx].update(user)
+            user = self.users[idx]
+
+        fields = [
+            str(user["id"]),
+            _norm(user["username"]),
+            _norm(user["fullname"]),
+            _digits(user["telefon"]),
+        ]
+        self._fields[idx] = fields
+        phone = normalize_phone(user["telefon"])
+        if phone:
+            if bulk:
+                self.by_phone.setdefault(phone, idx)   # varaqda birinchisi
+            else:
+                self.by_phone[phone] = idx             # eng so'nggi ulashilgan
+        for f in fields:
+            for g in _trigrams(f):
+                self._grams.setdefault(g, set()).add(idx)
+        tokens = {str(user["id"]), _norm(user["username"]), _digits(user["telefon"])}
+        tokens.update(_norm(user["fullname"]).split())
+        for t in tokens:
+            if not t:
+                continue
+            if bulk:
+                self._tokens.append((t, idx))   # oxirida bir marta saralanadi
+            else:
+                insort(self._tokens, (t, idx))
+
+    def upsert(self, user: dict) -> None:
+        """Bitta foydalanuvchini qo'shadi yoki yangilaydi (eski indeks yozuvlari
+        qoladi, lekin qidiruvda maydonlar qayta tekshiriladi)."""
+        self._add(user)
+
+    # ── Qidiruv ──
+
+    def _score(self, idx: int, term: str, digits: str) -> int:
+        uid, uname, name, phone = self._fields[idx]
+        if term in (uid, uname) or (digits and digits == phone):
+            return SCORE_EXACT
+        words = name.split()
+        if uname.startswith(term) or any(w.startswith(term) for w in words) or uid.startswith(term):
+            return SCORE_PREFIX
+        if digits and len(digits) >= 4 and phone.endswith(digits):
+            return SCORE_SUFFIX
+        if term in uname or term in name or term in uid or (digits and digits in phone):
+            return SCORE_INNER
+        return 0
+
+    def _candidates(self, term: str) -> set[int]:
+        if len(term) >= 3:
+            grams = sorted((self._grams.get(g, set()) for g in _trigrams(term)), key=len)
+            if not grams:
+                return set()
+            result = set(grams[0])
+            for g in grams[1:]:
+                result &= g
+                if not result:
+                    break
+            return result
+        # Qisqa so'rov — faqat so'z boshi bo'yicha
+        result: set[int] = set()
+        i = bisect_left(self._tokens, (term, -1))
+        while i < len(self._tokens) and self._tokens[i][0].startswith(term):
+            result.add(self._tokens[i][1])
+            i += 1
+        return result
+
+    def search(self, query: str, limit: int = 20) -> list[dict]:
+        """
+        Ism, familiya, username, telefon, ID bo'yicha qidiradi. Bir nechta
+        so'z — barchasi mos kelishi kerak. Eng mos natijalar birinchi.
+        """
+        terms = _norm(query).split()
+        if _PHONE_LIKE.fullmatch(query.strip()):
+            terms = [_digits(query)]   # "+998 90 123-45-67" — bitta raqam
+        if not terms or not terms[0]:
+            return []
+        scores: dict[int, int] | None = None
+        for term in terms:
+            digits = ""
+            if term.lstrip("+").isdigit():
+                term = digits = _digits(term)
+            found: dict[int, int] = {}
+            for idx in self._candidates(term):
+                sc = self._score(idx, term, digits)
+                if sc:
+                    found[idx] = sc
+            if scores is None:
+                scores = found
+            else:
+                scores = {i: scores[i] + sc for i, sc in found.items() if i in scores}
+            if not scores:
+                return []
+        ranked = sorted(
+            scores.items(),
+            key=lambda kv: (-kv[1], len(self.users[kv[0]]["fullname"]), self.users[kv[0]]["fullname"]),
+        )
+        return [self.users[i] for i, _ in ranked[:limit]]
+
+    def get(self, user_id: int) -> dict | None:
+        idx = self.by_id.get(user_id)
+        return self.users[idx] if idx is not None else None
+
+    def find_phone(self, raw: str) -> dict | None:
+        """Telefon raqami bo'yicha foydalanuvchi (O(1))."""
+        phone = normalize_phone(raw)
+        idx   = self.by_phone.get(phone) if phone else None
+        if idx is None:
+            return None
+        user = self.users[idx]
+        # Raqam keyin o'zgargan bo'lsa eski indeks yozuvi e'tiborsiz qoladi
+        return user if normalize_phone(user["telefon"]) == phone else None
+
+    def resolve_phones(self, phones: list[str]) -> tuple[list[dict], list[str]]:
+        """Ko'p raqamni bir yo'la: (topilgan foydalanuvchilar, topilmagan raqamlar)."""
+        found, missing, seen = [], [], set()
+        for p in phones:
+            user = self.find_phone(p)
+            if user is None:
+                missing.append(p)
+            elif user["id"] not in seen:
+                seen.add(user["id"])
+                found.append(user)
+        return found, missing
+
+
+# ─── KESH ─────────────────────────────────────────────────────────────────────
+
+_directory: UserDirectory | None = None
+_load_lock = asyncio.Lock()
+_refresh_task: asyncio.Task | None = None
+
+
+async def _load() -> UserDirectory:
+    global _directory
+    users      = await sheets.run(load_users_sync)
+    _directory = UserDirectory(users)
+    logger.info(f"[DIR] Katalog yuklandi: {len(users)} foydalanuvchi")
+    return _directory
+
+
+async def _refresh() -> None:
+    global _refresh_task
+    try:
+        async with _load_lock:
+            await _load()
+    except Exception as e:
+        logger.warning(f"[DIR] Katalogni yangilashda xato: {e}")
+    finally:
+        _refresh_task = None
+
+
+async def get() -> UserDirectory:
+    """
+    Katalogni qaytaradi. Birinchi chaqiruvda yuklanadi; eskirgan bo'lsa
+    joriy nusxa qaytariladi va fonda yangilanadi.
+    """
+    global _refresh_task
+    if _directory is None:
+        async with _load_lock:
+            if _directory is None:
+                return await _load()
+    if time.monotonic() - _directory.loaded_at > DIRECTORY_TTL and _refresh_task is None:
+        _refresh_task = asyncio.ensure_future(_refresh())
+    return _directory
+
+
+def invalidate() -> None:
+    """Keyingi get() da katalog fonda qayta yuklanadi."""
+    if _directory is not None:
+        _directory.loaded_at = 0.0
+
+
+def note_user(
+    user_id: int, username: str, first_name: str, last_name: str, phone: str = "",
+) -> None:
+    """
+    Ro'yxatga olingan/yangilangan foydalanuvchini katalogga darhol yozadi
+    (katalog hali yuklanmagan bo'lsa hech narsa qilmaydi). phone berilsa
+    telefon indeksi ham yangilanadi.
+    """
+    if _directory is None:
+        return
+    fullname = f"{first_name} {last_name}".strip() or "Noma'lum"
+    current  = _directory.get(user_id) or {"telefon": "", "holati": "Faol"}
+    _directory.upsert({
+        **current,
+        "id":       user_id,
+        "username": username.lstrip("@"),
+        "ism":      first_name,
+        "familiya": last_name,
+        "fullname": fullname,
+        **({"telefon": phone} if phone else {}),
+    })